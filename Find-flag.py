@@ -11,32 +11,74 @@ Dependencies:
 - requests v2.27.1
 - Pillow v9.0.0
 """
+from __future__ import annotations  # annotations name classes of modules imported on first use, e.g. Pillow's
+
+import sys
+from time import perf_counter
+
+STARTED = perf_counter()
+if '--profile-startup' in sys.argv:  # before any other import, so that they are all timed
+    from flag_finder.profiling import profile_imports
+    profile_imports()
+
+import argparse
+import importlib
 import os
+import queue
+import threading
 import tkinter as tk
 import tkinter.ttk as ttk
-from io import BytesIO
-from hashlib import sha3_256
-from time import time
-from ast import literal_eval
-from fnmatch import fnmatch
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
 from string import ascii_lowercase
 from subprocess import run
 
-# External packages
-import requests
-from PIL import ImageTk
+# requests, Pillow and the modules of flag_finder using them take longer to import than the window takes to show,
+# they are imported on first use instead, see preload()
+from flag_finder import config
+from flag_finder.catalog import get_catalog
+from flag_finder.scheduler import get_scheduler, set_priority
+from flag_finder.search import PrefixIndex, SubsequenceIndex
+from flag_finder.settings import apply_settings, settings_parser
+from flag_finder.speculate import SpeculativePrefetcher
+from flag_finder.trace import Trace, span, tracing
+
+TYPE_CHECKING = False  # typing.TYPE_CHECKING, without importing typing at startup
+if TYPE_CHECKING:
+    from PIL import Image, ImageTk
+
+FIRST_WINDOW_TARGET = 0.15  # seconds from start to the window being shown, reported by --profile-startup
 
 
-FLAGS_LOG_DIR = os.path.join(os.getenv("LocalAppData"), "Flags")
-FLAGS_DIR = os.path.join(os.getenv("AppData"), "Flags")
 if os.name.startswith('nt'):
     EXPLORER_PATH = os.path.join(os.getenv("WINDIR"), "explorer.exe")
 
+parser = argparse.ArgumentParser(description='Fetch and display flag of selected country from Wikimedia Commons',
+                                 parents=[settings_parser()])
+parser.add_argument('--prefetch', action='store_true',
+                    help='cache flags of all countries without opening the window, then exit')
+parser.add_argument('--build-catalog', nargs='*', metavar='CATEGORY',
+                    help='rebuild the catalog of flags from the files in these Wikimedia Commons categories '
+                         f'(default: {", ".join(config.CATALOG_CATEGORIES)}) without opening the window, then exit')
+parser.add_argument('--image-cache-mb', type=int, default=64,
+                    help='memory kept for recently shown flags, so reselecting them is instant (default: 64)')
+parser.add_argument('--debug-overlay', action='store_true',
+                    help='show below each flag how long each stage of loading it took, and whether it was cached')
+parser.add_argument('--speculate', type=int, default=config.SPECULATE_TOP_N,
+                    help='number of best matches fetched ahead once what is typed matches a handful of countries, '
+                         f'0 to never fetch ahead (default: {config.SPECULATE_TOP_N})')
+parser.add_argument('--speculate-kbps', type=int, default=config.SPECULATE_BANDWIDTH // 1024,
+                    help='kilobytes per second fetching ahead may download at most '
+                         f'(default: {config.SPECULATE_BANDWIDTH // 1024})')
+parser.add_argument('--profile-startup', action='store_true',
+                    help='print how long the window took to show, and which imports took the longest')
+
 
 class SearchableCombobox(ttk.Combobox):
     """
     A ttk.Combobox whose entry field comes with autocompletion and can be used as a search bar (non-case sensitive)
     Calls the assigned function when an element was typed correctly/selected
+    Search results are ranked, see SubsequenceIndex.search()
 
     :param no_match_msg: Message to show on top of menu when no matching elements are found
     :param function: Callback function when an element is chosen
@@ -53,6 +95,9 @@ class SearchableCombobox(ttk.Combobox):
         self.__function = function if callable(function) and not isinstance(function, type) else None
         self.__func_args = func_args
         self.__values = self['values']  # The real value list of the CBox, while the seen list is dynamically changed depending on what's typed in
+        self.__index = None  # SubsequenceIndex and PrefixIndex of the values, built the first time they are needed
+        self.__prefixes = None
+        self.__on_candidates = None  # called with the few elements left matching what is typed, see configure()
         self.bind('<KeyRelease>', self.__autocomplete)
         self.bind('<<ComboboxSelected>>', self.__selected)
         self.bind('<Return>', self.__selected)
@@ -66,27 +111,12 @@ class SearchableCombobox(ttk.Combobox):
         Shows the dropdown list with elements with the letters typed in, in the corresponding order,
         or if an element was typed correctly/selected, call the assigned function
         """
-        # Only accepts letters and spaces
-        if not ''.join(self.get().split(' ')).isalpha():
+        if not self.get().strip():
             return
 
-        if self.get() not in self.__values:
-            matching_elem = []
-
-            for elem in self.__values:
-                if len(self.get()) > len(elem):
-                    continue
-
-                last_checked = -1
-                for typed_char in self.get().lower():
-                    for index, char in enumerate(elem[last_checked + 1:].lower()):
-                        if typed_char == char:
-                            last_checked += index + 1
-                            break
-                    else:
-                        break
-                else:
-                    matching_elem.append(elem)
+        if self.get() not in self.__search_index():
+            matching_elem = self.__search_index().search(self.get())
+            self.__narrowed(len(matching_elem), matching_elem)
 
             if len(matching_elem) == 0:
                 matching_elem.append(self.__no_match_msg)
@@ -104,10 +134,14 @@ class SearchableCombobox(ttk.Combobox):
         """
         Internally called only
 
-        Automatically completes the combobox entry field with the first element's name found that matches exactly with what
-        has been typed in so far, continuously update the autocompletion as user continues typing
+        Automatically completes the combobox entry field with the first element's name (alphabetically) that matches exactly
+        with what has been typed in so far, continuously update the autocompletion as user continues typing
         """
         typed = self.get()
+        if event.keysym == 'BackSpace':
+            self.__prefix_index().rewind(typed)
+            return
+
         # <event.state> = 8 -> No modifiers (irrelevant)
         #               = 9 -> Shift (irrelevant)
         #               = 12 -> Ctrl
@@ -117,20 +151,46 @@ class SearchableCombobox(ttk.Combobox):
         #               = 131084 -> Ctrl+Alt
         #               = 131085 -> Ctrl+Alt+Shift
         #               = ... -> To be discovered
-        if not ''.join(typed.split(' ')).isalpha() or typed in self.__values \
+        if not typed.strip() or typed in self.__search_index() \
                 or event.state in (12, 13, 131080, 131081, 131084, 131085) \
                 or event.keysym.lower() not in tuple(ascii_lowercase):
             return
 
-        for elem in self.__values:
-            if len(typed) > len(elem):
-                continue
+        completion = self.__prefix_index().complete(typed)
+        if completion:
+            self.set(completion)
+            self.selection_range(len(typed), 'end')
+            self.icursor('end')
+        self.__narrowed(*self.__prefix_index().matches(typed, config.SPECULATE_TOP_N))
+
+    def __narrowed(self, count: int, best: list[str]) -> None:
+        """
+        Internally called only
+
+        Passes the best matches to the on_candidates callback once what is typed matches only a handful of elements
+        """
+        if self.__on_candidates and 0 < count <= config.SPECULATE_MATCHES:
+            self.__on_candidates(best)
+
+    def matches(self) -> list[str]:
+        """
+        Returns the elements matching what is typed in (not what autocompletion added to it), best matches first,
+        or all elements if nothing is typed in
+        """
+        typed = self.get()
+        if self.selection_present():
+            typed = typed[:self.index('sel.first')]
+        return self.__search_index().search(typed.strip())
+
+    def __search_index(self) -> SubsequenceIndex:
+        if self.__index is None:
+            self.__index = SubsequenceIndex(self.__values)
+        return self.__index
 
-            if fnmatch(elem, f'{typed}*'):
-                self.set(elem)
-                self.selection_range(len(typed), 'end')
-                self.icursor('end')
-                break
+    def __prefix_index(self) -> PrefixIndex:
+        if self.__prefixes is None:
+            self.__prefixes = PrefixIndex(self.__values)
+        return self.__prefixes
 
     def configure(self, **kwargs) -> None:
         """
@@ -140,6 +200,8 @@ class SearchableCombobox(ttk.Combobox):
         :key no_match_msg:  Message to show on top of menu when no matching elements are found
         :key function: Callback function when an element is chosen
         :key func_args: Arguments for callback function, passed in a tuple or list
+        :key on_candidates: Function called with the best few elements (best first) whenever what is typed narrows
+                            the matching elements down to config.SPECULATE_MATCHES or fewer, e.g. to fetch them ahead
         """
         if 'no_match_msg' in kwargs:
             self.__no_match_msg = str(kwargs.pop('no_match_msg'))
@@ -156,9 +218,17 @@ class SearchableCombobox(ttk.Combobox):
             else:
                 raise TypeError('Keyword "func_args" only accepts tuple or list')
 
+        if 'on_candidates' in kwargs:
+            if callable(kwargs['on_candidates']):
+                self.__on_candidates = kwargs.pop('on_candidates')
+            else:
+                raise TypeError('Keyword "on_candidates" only accepts callable functions')
+
         if 'values' in kwargs:
-            if isinstance(kwargs['values'], (list[str], tuple[str, ...])):
+            if isinstance(kwargs['values'], (list, tuple)):
                 self.__values = kwargs['values']
+                self.__index = None
+                self.__prefixes = None
         super().configure(**kwargs)
     config = configure
 
@@ -184,6 +254,7 @@ class ToolTip:
         self.master.bind('<Enter>', self._enter)
         self.master.bind('<Leave>', self._leave)
         self.master.bind('<Button>', self._leave)
+        self.master.bind('<Destroy>', self._leave)
 
     def _enter(self, _):
         self._schedule()
@@ -226,400 +297,363 @@ class ToolTip:
         self._tip_window = None
 
 
-# Greeting window: a small window with a label and a dropdown list of countries for user to choose from
-root = tk.Tk()
-root.minsize(400, 0)
-root.title('Flag Finder')
-root.resizable(False, False)
-
-ttk.Style().configure('TFrame', background='light gray')
-
-ttk.Style().configure('TLabel', background='light gray')
-ttk.Style().configure('Error.TLabel', anchor='center', justify='center')
-
-header = ttk.Frame(root)
-header.columnconfigure(0, weight=0)
-header.columnconfigure(1, weight=1)
-header.pack(fill='x')
-
-body = ttk.Frame(root)
-body.pack(fill='both')
-
-footer = ttk.Frame(root)
-footer.columnconfigure(0, weight=0)
-footer.columnconfigure(1, weight=1)
-footer.pack(fill='x', side='bottom')
-
-lbl_country = ttk.Label(
-    master=header,
-    text='Choose (or type in) a country:',
-)
-lbl_country.grid(row=0, column=0, sticky='nw', padx=(5, 0))
-
-countries = ('Afghanistan',
-             'Albania',
-             'Algeria',
-             'Andorra',
-             'Angola',
-             'Antigua and Barbuda',
-             'Argentina',
-             'Armenia',
-             'Australia',
-             'Austria',
-             'Azerbaijan',
-             'Bahamas',
-             'Bahrain',
-             'Bangladesh',
-             'Barbados',
-             'Belarus',
-             'Belgium',
-             'Belize',
-             'Benin',
-             'Bhutan',
-             'Bolivia',
-             'Bosnia and Herzegovina',
-             'Botswana',
-             'Brazil',
-             'Brunei',
-             'Bulgaria',
-             'Burkina Faso',
-             'Burundi',
-             'Cambodia',
-             'Cameroon',
-             'Canada',
-             'Cape Verde',
-             'Central African Republic',
-             'Chad',
-             'Chile',
-             'China',
-             'Colombia',
-             'Comoros',
-             'Democratic Republic of the Congo',
-             'Republic of the Congo',
-             'Costa Rica',
-             'Croatia',
-             'Cuba',
-             'Cyprus',
-             'Czech Republic',
-             'Denmark',
-             'Djibouti',
-             'Dominica',
-             'Dominican Republic',
-             'East Timor',
-             'Ecuador',
-             'Egypt',
-             'El Salvador',
-             'Equatorial Guinea',
-             'Eritrea',
-             'Estonia',
-             'Eswatini',
-             'Ethiopia',
-             'Fiji',
-             'Finland',
-             'France',
-             'Gabon',
-             'Gambia',
-             'Georgia',
-             'Germany',
-             'Ghana',
-             'Greece',
-             'Grenada',
-             'Guatemala',
-             'Guinea',
-             'Guinea-Bissau',
-             'Guyana',
-             'Haiti',
-             'Honduras',
-             'Hungary',
-             'Iceland',
-             'India',
-             'Indonesia',
-             'Iran',
-             'Iraq',
-             'Ireland',
-             'Israel',
-             'Italy',
-             'Ivory Coast',
-             'Jamaica',
-             'Japan',
-             'Jordan',
-             'Kazakhstan',
-             'Kenya',
-             'Kiribati',
-             'North Korea',
-             'South Korea',
-             'Kuwait',
-             'Kyrgyzstan',
-             'Laos',
-             'Latvia',
-             'Lebanon',
-             'Lesotho',
-             'Liberia',
-             'Libya',
-             'Liechtenstein',
-             'Lithuania',
-             'Luxembourg',
-             'North Macedonia',
-             'Madagascar',
-             'Malawi',
-             'Malaysia',
-             'Maldives',
-             'Mali',
-             'Malta',
-             'Marshall Islands',
-             'Mauritania',
-             'Mauritius',
-             'Mexico',
-             'Micronesia',
-             'Moldova',
-             'Monaco',
-             'Mongolia',
-             'Montenegro',
-             'Morocco',
-             'Mozambique',
-             'Myanmar',
-             'Namibia',
-             'Nauru',
-             'Nepal',
-             'Netherlands',
-             'New Zealand',
-             'Nicaragua',
-             'Niger',
-             'Nigeria',
-             'Norway',
-             'Oman',
-             'Pakistan',
-             'Palau',
-             'Palestine',
-             'Panama',
-             'Papua New Guinea',
-             'Paraguay',
-             'Peru',
-             'Philippines',
-             'Poland',
-             'Portugal',
-             'Qatar',
-             'Romania',
-             'Russia',
-             'Rwanda',
-             'Saint Kitts and Nevis',
-             'Saint Lucia',
-             'Saint Vincent and the Grenadines',
-             'Samoa',
-             'San Marino',
-             'Sao Tome and Principe',
-             'Saudi Arabia',
-             'Senegal',
-             'Serbia',
-             'Seychelles',
-             'Sierra Leone',
-             'Singapore',
-             'Slovakia',
-             'Slovenia',
-             'Solomon Islands',
-             'Somalia',
-             'South Africa',
-             'South Sudan',
-             'Spain',
-             'Sri Lanka',
-             'Sudan',
-             'Suriname',
-             'Sweden',
-             'Switzerland',
-             'Syria',
-             'Taiwan',
-             'Tajikistan',
-             'Tanzania',
-             'Thailand',
-             'Togo',
-             'Tonga',
-             'Trinidad and Tobago',
-             'Tunisia',
-             'Turkey',
-             'Turkmenistan',
-             'Tuvalu',
-             'Uganda',
-             'Ukraine',
-             'United Arab Emirates',
-             'United Kingdom',
-             'United States',
-             'Uruguay',
-             'Uzbekistan',
-             'Vanuatu',
-             'Vatican City',
-             'Venezuela',
-             'Vietnam',
-             'Yemen',
-             'Zambia',
-             'Zimbabwe')
-mnu_countries = SearchableCombobox(master=header, values=countries)
-mnu_countries.grid(row=0, column=1, sticky='new', padx=5)
-ToolTip(master=mnu_countries,
-        text='Type a country\'s name in, or type some letters and press enter to show the countries with the typed letters in the corresponding order\n'
-             'E.g. "ez" will show Belize "B(e)li(z)e", New Zealand "N(e)w (Z)ealand", Venezuela "V(e)ne(z)uela",... (non-case sensitive)')
-
-os.makedirs(FLAGS_LOG_DIR, exist_ok=True)
-os.makedirs(FLAGS_DIR, exist_ok=True)
-
-
-def get_hash(file: str) -> str:
-    """
-    Returns SHA3-256 hex of a file, given its path
-
-    :param file: to-be-hashed file's path
-    :return: hex hash of file
-    """
-    with open(file, 'rb') as f:
-        return sha3_256(f.read()).hexdigest()
-
-
-def cache_flag(country: str, img: bytes) -> None:
-    """
-    Store image of selected countries' flags, when they were cached, and hash of stored images in %AppData%\\Roaming\\Flags
-
-    :param country: name of country's flag to be cached
-    :param img: content of img file in bytes
-    """
-    # if log file not exists | log_hash not exists | hash of log file is not equal to log_hash data: make new log file
-    if not (os.path.exists(os.path.join(FLAGS_LOG_DIR, 'log'))
-            and os.path.exists(os.path.join(FLAGS_LOG_DIR, 'log_hash'))
-            and get_hash(os.path.join(FLAGS_LOG_DIR, 'log')) == open(os.path.join(FLAGS_LOG_DIR, 'log_hash')).read()):
-        with open(os.path.join(FLAGS_LOG_DIR, 'log'), 'w') as log:
-            log.write('{}')
-
-    with open(os.path.join(FLAGS_LOG_DIR, 'log')) as log:
-        cache_log = literal_eval(log.read())
-
-    with open(os.path.join(FLAGS_DIR, f'{country}.png'), 'wb') as image:
-        image.write(img)
-
-    cache_log[country] = (int(time()), get_hash(os.path.join(FLAGS_DIR, f'{country}.png')))
-    with open(os.path.join(FLAGS_LOG_DIR, 'log'), 'w') as log:
-        log.write(str(cache_log))
-
-    with open(os.path.join(FLAGS_LOG_DIR, 'log_hash'), 'w') as log_hash:
-        log_hash.write(get_hash(os.path.join(FLAGS_LOG_DIR, 'log')))
-
-
-def get_cache(country: str) -> str | None:
-    """
-    Returns path to image in cache if available and image is less than 1 week old,
-    or returns None otherwise
-
-    :param country: name of country to return the cached flag of
-    :return: path to image in cache | None
-    """
-    # if .png of flag not exists | log file not exists | log_hash not exists | hash of log file is equal to log_hash data: None
-    if not (os.path.exists(os.path.join(FLAGS_DIR, f'{country}.png'))
-            and os.path.exists(os.path.join(FLAGS_LOG_DIR, 'log'))
-            and os.path.exists(os.path.join(FLAGS_LOG_DIR, 'log_hash'))
-            and get_hash(os.path.join(FLAGS_LOG_DIR, 'log')) == open(os.path.join(FLAGS_LOG_DIR, 'log_hash')).read()):
-        return None
-
-    with open(os.path.join(FLAGS_LOG_DIR, 'log')) as file:
-        log = literal_eval(file.read())
-
-    # if country not in cache log | flag image older than 1 week | hash of image is not equal to recorded hash: None
-    cached = log.get(country, None)
-    if not (cached
-            and int(time()) - cached[0] <= 604800
-            and get_hash(os.path.join(FLAGS_DIR, f'{country}.png')) == cached[1]):
-        return None
+class ImageCache:
+    """
+    In-memory LRU cache of decoded flag images, so switching back to a recently shown flag
+    costs no disk read, hashing or decoding. Bounded by the memory taken by the images' pixels
 
-    return os.path.normpath(os.path.join(FLAGS_DIR, f'{country}.png'))
+    :param budget: maximum memory taken by cached images (in bytes)
+    :type budget: int
+    """
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (value, cost), least recently used first
+
+    def get(self, key):
+        """
+        Returns the value cached under key and marks it as most recently used, or None if it isn't cached
+
+        :param key: e.g. (country, width)
+        :return: cached value | None
+        """
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def put(self, key, value, cost: int) -> None:
+        """
+        Caches value under key, evicting the least recently used values until all of them fit in the budget
+
+        :param key: e.g. (country, width)
+        :param value: value to cache
+        :param cost: memory taken by value (in bytes), a value costing more than the whole budget isn't cached
+        """
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+        if cost > self.budget:
+            return
 
+        self._entries[key] = (value, cost)
+        self.size += cost
+        while self.size > self.budget:
+            self.size -= self._entries.popitem(last=False)[1][1]
 
-def get_image(country: str) -> (ttk.Label, str):
+    def stats(self) -> str:
+        """
+        Returns a one-line summary of the cache's usage, to help tuning its budget
+        """
+        lookups = self.hits + self.misses
+        return (f'Image cache: {len(self._entries)} flags, {self.size / 2 ** 20:.1f}/{self.budget / 2 ** 20:.0f} MB, '
+                f'{self.hits} hits, {self.misses} misses ({self.hits / lookups if lookups else 0:.0%} hit rate)')
+
+
+class FlagFetcher:
+    """
+    Runs flag fetches on a background thread pool so the Tk main loop never blocks on network or disk,
+    and hands finished fetches back to the main thread by polling with master.after()
+    Only the latest submitted fetch is delivered: a newer submit cancels the older one if it hasn't started yet,
+    or otherwise drops its result when it finishes, so a stale flag is never shown
+
+    :param master: tk/ttk widget whose after() is used to poll for finished fetches
+    :type master: tk.Misc
+    :param max_workers: maximum number of fetches running at the same time (default: 4)
+    :type max_workers: int
+    :param poll_interval: delay between two polls for finished fetches (in milliseconds) (default: 50)
+    :type poll_interval: int
     """
-    Get image of flag of selected country from cache,
-    if none found, fetch flag from Wikimedia and cache it.
+    def __init__(self, master: tk.Misc, max_workers: int = 4, poll_interval: int = 50):
+        self.master = master
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='flag-fetch')
+        self._finished = queue.SimpleQueue()
+        self._pending = None
+        self._generation = 0
+        self._id = self.master.after(self.poll_interval, self._poll)
+
+    def submit(self, function, callback, *args) -> None:
+        """
+        Runs function(*args) on a worker thread, then callback(future) on the main thread,
+        unless another fetch has been submitted in the meantime
 
-    :param country: name of country to get flag of
-    :return: flag's image, and name of .svg file | error message, and empty string
-    """
-    img_path = get_cache(country)
-    if img_path:
-        wiki_file = f'Flag_of_{"_".join(country.split(" "))}.svg'
-        with open(img_path, 'rb') as file:
-            img = file.read()
-    else:
+        :param function: function to run in the background, must not touch any Tk object
+        :param callback: function called with the finished concurrent.futures.Future
+        :param args: arguments for function
+        """
+        self.cancel()
+        generation = self._generation
+        self._pending = self._executor.submit(function, *args)
+        self._pending.add_done_callback(lambda future: self._finished.put((generation, callback, future)))
+
+    def cancel(self) -> None:
+        """
+        Supersedes the latest submitted fetch: it is cancelled if it hasn't started yet, and its callback is never called
+        """
+        if self._pending:
+            self._pending.cancel()
+        self._pending = None
+        self._generation += 1
+
+    def shutdown(self) -> None:
+        """
+        Stops polling and drops every fetch that hasn't started yet
+        """
+        if self._id:
+            self.master.after_cancel(self._id)
+        self._id = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self):
         try:
-            img_width = 700  # flag's width, aspect ratio preserved
-            param_api = {'action': 'query',
-                         'format': 'json',
-                         'prop': 'pageimages',
-                         'titles': f'File:Flag of {country}.svg',
-                         'pithumbsize': img_width}
-            re = requests.get("https://commons.wikimedia.org/w/api.php",
-                              timeout=1,
-                              headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:96.0) Gecko/20100101 Firefox/96.0'},
-                              params=param_api)
-            re.raise_for_status()
-
-        except requests.exceptions.Timeout:
-            lbl_error_msg = ttk.Label(
-                master=body,
-                text='JSON fetch request timed out. Please retry by re-selecting the country.',
-                style='Error.TLabel'
-            )
-            return lbl_error_msg, ''
-
-        except requests.exceptions.HTTPError:
-            lbl_error_msg = ttk.Label(
-                master=body,
-                text=f'HTTP Error while fetching JSON. Code: {re.status_code}.\nMessage: {re.reason}',
-                style='Error.TLabel'
-            )
-            return lbl_error_msg, ''
+            while True:
+                try:
+                    generation, callback, future = self._finished.get_nowait()
+                except queue.Empty:
+                    break
+                if generation == self._generation and not future.cancelled():
+                    self._pending = None
+                    callback(future)
+        finally:  # a failing callback must not stop the fetches after it from being delivered
+            self._id = self.master.after(self.poll_interval, self._poll)
+
+
+class FlagGallery:
+    """
+    A window showing many flags at once as small tiles in a scrollable grid, e.g. every country matching the search bar
+    Only the tiles in view (and a row above and below them) are realized: their flags are decoded on worker threads,
+    handed back to the main thread by polling with master.after() as they are ready, and dropped once scrolled out of view,
+    so memory is bounded by the size of the window rather than by the number of flags
+
+    :param master: tk/ttk widget the gallery's window belongs to
+    :type master: tk.Misc
+    :param on_pick: function called with a country's name when its tile is clicked
+    :param tile_width: width of the flags in the tiles (in pixels) (default: 120)
+    :type tile_width: int
+    :param max_workers: maximum number of flags decoded (or fetched, if not cached) at the same time (default: 4)
+    :type max_workers: int
+    :param poll_interval: delay between two polls for decoded flags (in milliseconds) (default: 50)
+    :type poll_interval: int
+    """
+    PADDING = 8  # pixels around each tile
+    TEXT_HEIGHT = 20  # pixels below each flag for the country's name
+
+    def __init__(self, master: tk.Misc, on_pick=None, tile_width: int = 120, max_workers: int = 4, poll_interval: int = 50):
+        self.master = master
+        self.on_pick = on_pick
+        self.tile_width = tile_width
+        self.image_height = tile_width * 3 // 4  # taller flags are shrunk to fit
+        self.poll_interval = poll_interval
+        # flags not cached yet are fetched behind the one the user picks, see flag_finder.scheduler
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='flag-gallery',
+                                            initializer=set_priority, initargs=('speculative',))
+        self._finished = queue.SimpleQueue()
+        self._window = None
+        self._canvas = None
+        self._countries = []
+        self._columns = 0
+        self._tiles = {}  # index of realized tile -> [Future decoding its flag, its PhotoImage once decoded]
+        self._id = None
+
+    @property
+    def cell_width(self) -> int:
+        return self.tile_width + 2 * self.PADDING
+
+    @property
+    def cell_height(self) -> int:
+        return self.image_height + self.TEXT_HEIGHT + 2 * self.PADDING
+
+    def show(self, countries: list[str]) -> None:
+        """
+        Shows the flags of countries in the gallery's window, opening it if it isn't open yet
+
+        :param countries: names of countries, in the order their tiles are laid out
+        """
+        if self._window is None:
+            self._open()
+        self._window.lift()
+        if list(countries) == self._countries:
+            return
+        self._window.title(f'Flag gallery: {len(countries)} flags')
+        self._countries = list(countries)
+        self._clear()
+        self._canvas.yview_moveto(0)
+        self._layout()
+
+    def is_open(self) -> bool:
+        """
+        Returns whether the gallery's window is open
+        """
+        return self._window is not None
+
+    def realized(self) -> int:
+        """
+        Returns the number of tiles currently realized, i.e. holding (or decoding) a flag
+        """
+        return len(self._tiles)
+
+    def shutdown(self) -> None:
+        """
+        Stops polling and drops every decoding that hasn't started yet
+        """
+        if self._id:
+            self.master.after_cancel(self._id)
+        self._id = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _open(self) -> None:
+        self._window = tk.Toplevel(self.master, background='light gray')
+        self._window.geometry(f'{self.cell_width * 5 + 20}x{self.cell_height * 4}')
+        scrollbar = ttk.Scrollbar(self._window, orient='vertical', command=self._scroll)
+        scrollbar.pack(side='right', fill='y')
+        self._canvas = tk.Canvas(self._window, background='light gray', highlightthickness=0,
+                                 yscrollcommand=scrollbar.set)
+        self._canvas.pack(side='left', fill='both', expand=True)
+        self._canvas.bind('<Configure>', self._layout)
+        self._canvas.tag_bind('tile', '<ButtonRelease-1>', self._picked)
+        self._canvas.configure(cursor='hand2')
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self._window.bind(sequence, self._wheel)
+        self._window.bind('<Destroy>', self._closed)
+        self._id = self.master.after(self.poll_interval, self._poll)
+
+    def _closed(self, event: tk.Event) -> None:
+        if event.widget is not self._window:
+            return
+        self._clear()
+        if self._id:
+            self.master.after_cancel(self._id)
+        self._id = None
+        self._window = self._canvas = None
+        self._countries = []
+        self._columns = 0
+
+    def _scroll(self, *args) -> None:
+        self._canvas.yview(*args)
+        self._realize()
+
+    def _wheel(self, event: tk.Event) -> None:
+        # <MouseWheel> on Windows and macOS, <Button-4> (up) and <Button-5> (down) on X11
+        up = event.num == 4 or getattr(event, 'delta', 0) > 0
+        self._canvas.yview_scroll(-1 if up else 1, 'units')
+        self._realize()
+
+    def _layout(self, _=None) -> None:
+        """
+        Internally called only
+
+        Fits as many columns as the window's width allows, laying tiles out again if that changed
+        """
+        columns = max(1, self._canvas.winfo_width() // self.cell_width)
+        if columns != self._columns:
+            self._columns = columns
+            self._clear()
+        rows = -(-len(self._countries) // columns)
+        self._canvas.configure(scrollregion=(0, 0, columns * self.cell_width, rows * self.cell_height),
+                               yscrollincrement=self.cell_height // 4)
+        self._realize()
+
+    def _realize(self) -> None:
+        """
+        Internally called only
+
+        Realizes the tiles that came into view, and drops the ones that went out of it
+        """
+        top = self._canvas.canvasy(0)
+        bottom = self._canvas.canvasy(self._canvas.winfo_height())
+        first_row = max(0, int(top // self.cell_height) - 1)
+        last_row = int(bottom // self.cell_height) + 1
+        in_view = set(range(first_row * self._columns, min(len(self._countries), (last_row + 1) * self._columns)))
+
+        for index in self._tiles.keys() - in_view:
+            self._drop(index)
+        # tiles nearest the top first, so that they are decoded first
+        for index in sorted(in_view - self._tiles.keys()):
+            self._create(index)
+
+    def _create(self, index: int) -> None:
+        row, column = divmod(index, self._columns)
+        x = column * self.cell_width + self.PADDING
+        y = row * self.cell_height + self.PADDING
+        tags = ('tile', f'tile{index}')
+        self._canvas.create_rectangle(x, y, x + self.tile_width, y + self.image_height,
+                                      fill='gainsboro', outline='', tags=tags)
+        self._canvas.create_text(x + self.tile_width // 2, y + self.image_height + self.TEXT_HEIGHT // 2,
+                                 text=self._countries[index], width=self.tile_width, font=('Segoe UI', 8), tags=tags)
+
+        future = self._executor.submit(self._load, self._countries[index])
+        future.add_done_callback(lambda done: self._finished.put((index, done)))
+        self._tiles[index] = [future, None]
+
+    def _drop(self, index: int) -> None:
+        future, _ = self._tiles.pop(index)
+        future.cancel()
+        self._canvas.delete(f'tile{index}')
+
+    def _clear(self) -> None:
+        for index in list(self._tiles):
+            self._drop(index)
+
+    def _load(self, country: str) -> Image.Image:
+        """
+        Internally called only, on a worker thread
+
+        Returns the flag of country decoded at the tiles' width, shrunk to fit the tile if it is taller than it
+        """
+        from PIL import Image
+        from flag_finder.fetch import get_image
+
+        image = get_image(country, self.tile_width)[0]
+        if image.height > self.image_height:
+            image.thumbnail((self.tile_width, self.image_height), Image.LANCZOS)
+        return image
+
+    def _poll(self) -> None:
+        from PIL import ImageTk
 
         try:
-            # json dict navigating. Format:
-            # {
-            #   "batchcomplete": "",
-            #   "query": {
-            #     "pages": {
-            #       str(pageid_number): {
-            #         "pageid": pageid_number,
-            #         "ns": 6,
-            #         "title": "File:Flag of <country>.svg",
-            #         "thumbnail": {
-            #           "source": <image link>,
-            #           "width": img_width,
-            #           "height": <depends on flag aspect ratio and img_width>
-            #         },
-            #         "pageimage": <image file name on Wikimedia>
-            #       }
-            #     }
-            #   }
-            # }
-            json = re.json()
-            json = json['query']['pages'].popitem()[1]  # value of str(pageid_number): {...}
-
-            re = requests.get(json['thumbnail']['source'],
-                              timeout=1,
-                              headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:96.0) Gecko/20100101 Firefox/96.0'})
-            re.raise_for_status()
-            img = re.content
-            cache_flag(country, img)
-            wiki_file = json['pageimage']
-
-        except requests.exceptions.Timeout:
-            lbl_error_msg = ttk.Label(
-                master=body,
-                text='Image fetch request timed out. Please retry by re-selecting the country.',
-                style='Error.TLabel'
-            )
-            return lbl_error_msg, ''
-
-        except requests.exceptions.HTTPError:
-            lbl_error_msg = ttk.Label(
-                master=body,
-                text=f'HTTP Error while fetching image. Code: {re.status_code}.\nMessage: {re.reason}',
-                style='Error.TLabel'
-            )
-            return lbl_error_msg, ''
-
-    img = ImageTk.PhotoImage(file=BytesIO(img))
+            while True:
+                try:
+                    index, future = self._finished.get_nowait()
+                except queue.Empty:
+                    break
+                tile = self._tiles.get(index)
+                if tile is None or tile[0] is not future or future.cancelled():
+                    continue  # scrolled out of view, or laid out again, since
+
+                row, column = divmod(index, self._columns)
+                x = column * self.cell_width + self.PADDING + self.tile_width // 2
+                y = row * self.cell_height + self.PADDING + self.image_height // 2
+                try:
+                    tile[1] = ImageTk.PhotoImage(future.result())
+                except Exception:  # e.g. not cached and could not be fetched, or could not be decoded
+                    self._canvas.create_text(x, y, text='Not available', fill='gray', font=('Segoe UI', 8),
+                                             tags=('tile', f'tile{index}'))
+                    continue
+                self._canvas.create_image(x, y, image=tile[1], tags=('tile', f'tile{index}'))
+        finally:  # a failing tile must not stop the others from being shown
+            self._id = self.master.after(self.poll_interval, self._poll)
+
+    def _picked(self, _) -> None:
+        tags = self._canvas.gettags('current')
+        index = next(int(tag[4:]) for tag in tags if tag.startswith('tile') and tag != 'tile')
+        if self.on_pick:
+            self.on_pick(self._countries[index])
+
+
+def get_flag_label(img: ImageTk.PhotoImage, img_path: str) -> ttk.Label:
+    """
+    Returns a label showing a flag image. Must be called from the Tk main thread
+
+    :param img: flag's image
+    :param img_path: path to cached image, opened in Explorer when the flag is clicked
+    :return: flag's label
+    """
     img_flag = ttk.Label(
         master=body,
         image=img,
@@ -629,12 +663,12 @@ def get_image(country: str) -> (ttk.Label, str):
     if os.name.startswith('nt'):
         img_flag.configure(cursor='hand2')
         img_flag.bind('<ButtonRelease-1>',
-                      lambda _: run([EXPLORER_PATH, '/select,', img_path if img_path else get_cache(country)]))
+                      lambda _: run([EXPLORER_PATH, '/select,', img_path]))
         ToolTip(master=img_flag,
                 text='Click the flag to see all cached flags\n'
                      'To cache a flag, select its country from the dropdown menu')
 
-    return img_flag, wiki_file
+    return img_flag
 
 
 def get_credit(wiki_file: str) -> (ttk.Label, ttk.Label | tk.Entry):
@@ -666,19 +700,119 @@ def get_credit(wiki_file: str) -> (ttk.Label, ttk.Label | tk.Entry):
     return lbl_credit, lbl_credit_link
 
 
+def clear_flag() -> None:
+    """
+    Deletes existing credit and image (or error/loading message) if exists
+    """
+    for widget in footer.grid_slaves() + body.pack_slaves():
+        widget.destroy()
+
+
 def show_flag() -> None:
     """
-    First deletes existing credit and image (or error message) if exists,
-    then insert new image (or error message) and new credits
+    Shows the flag of the selected country right away if it was recently shown,
+    otherwise replaces existing credit and image (or error message) with a loading message,
+    then fetches the flag in the background. Selecting another country before it arrives supersedes this one
+    """
+    country = mnu_countries.get()
+    speculator.cancel()  # what was guessed is picked now, or no longer matters
+    current = Trace('show_flag', country=country, width=config.IMG_WIDTH)
+    recent = image_cache.get((country, config.IMG_WIDTH))
+    if recent:
+        fetcher.cancel()  # a fetch for a previous selection may still be running
+        img, wiki_file, img_path = recent
+        display_flag(get_flag_label(img, img_path), wiki_file)
+        current.attributes['cache'] = 'memory'
+        current.finish()
+        show_trace(current)
+        return
+
+    lbl_loading = ttk.Label(
+        master=body,
+        text=f'Loading flag of {country}...',
+        style='Error.TLabel'
+    )
+    display_flag(lbl_loading, '')
+
+    fetcher.submit(load_flag, lambda future: flag_fetched(country, current, future), current, country)
+
+
+def load_flag(current: Trace, country: str) -> (Image.Image, str, str):
+    """
+    Runs get_image on a worker thread, tracing its stages as part of showing the flag
+
+    :param current: trace of showing the flag
+    :param country: name of country to get flag of
+    :return: see get_image
     """
+    from flag_finder.fetch import get_image
+
+    with tracing(current):
+        return get_image(country, config.IMG_WIDTH)
+
+
+def flag_fetched(country: str, current: Trace, future: Future) -> None:
+    """
+    Called on the Tk main thread once the latest fetch finished,
+    keeps its image in memory for the next time the country is selected, then shows it (or error message)
+
+    :param country: name of country whose flag was fetched
+    :param current: trace of showing the flag
+    :param future: finished load_flag call
+    """
+    from PIL import ImageTk
+    from flag_finder.fetch import FetchError
+
     try:
-        footer.grid_slaves(column=0)[0].grid_forget()
-        footer.grid_slaves(column=1)[0].grid_forget()
-        body.pack_slaves()[0].pack_forget()
-    except IndexError:
-        pass
+        image, wiki_file, img_path = future.result()
+    except Exception as error:  # e.g. a cached file deleted while being read, which must not leave "Loading flag..."
+        message = str(error) if isinstance(error, FetchError) else f'Could not load flag of {country}:\n{error!r}'
+        lbl_error_msg = ttk.Label(
+            master=body,
+            text=message,
+            style='Error.TLabel'
+        )
+        display_flag(lbl_error_msg, '')
+        current.attributes['error'] = message
+        current.finish()
+        show_trace(current)
+        return
+
+    with tracing(current), span('photoimage'):
+        img = ImageTk.PhotoImage(image)
+    image_cache.put((country, config.IMG_WIDTH), (img, wiki_file, img_path), img.width() * img.height() * 4)
+    display_flag(get_flag_label(img, img_path), wiki_file)
+    current.finish()
+    show_trace(current)
+
+
+def show_trace(current: Trace) -> None:
+    """
+    Shows below the flag how long each stage of loading it took, if the debug overlay is enabled
 
-    lbl_result, wiki_file = get_image(mnu_countries.get())
+    :param current: finished trace of showing the flag
+    """
+    if not args.debug_overlay:
+        return
+    stages = ' · '.join(f'{stage} {ms:.1f}' for stage, ms in current.breakdown().items())
+    lbl_trace = ttk.Label(
+        master=footer,
+        text=f'cache {current.attributes.get("cache", "?")} · {current.duration * 1000:.1f} ms'
+             + (f': {stages}' if stages else ''),
+        font=('Consolas', 8),
+    )
+    lbl_trace.grid(row=1, column=0, columnspan=2, sticky='w', padx=5)
+
+
+def display_flag(lbl_result: ttk.Label, wiki_file: str) -> None:
+    """
+    Deletes existing credit and image (or error message) if exists,
+    then insert new image (or error message) and new credits
+
+    :param lbl_result: flag's label, or a label with a message
+    :param wiki_file: name of .svg file, or empty string if lbl_result isn't a flag
+    """
+    clear_flag()
     lbl_result.pack(fill='both')
 
     lbl_credit, lbl_credit_link = get_credit(wiki_file)
@@ -686,7 +820,240 @@ def show_flag() -> None:
     lbl_credit_link.grid(row=0, column=1, sticky='ews', pady=1)
 
 
-mnu_countries.configure(function=show_flag)
-mnu_countries.focus_set()
+def show_status(text: str) -> None:
+    """
+    Shows a message below the search bar, e.g. progress of a background task
 
-root.mainloop()
+    :param text: message to show
+    """
+    lbl_status.configure(text=text)
+    lbl_status.grid(row=1, column=0, columnspan=2, sticky='w', padx=5)
+
+
+def prefetch_all() -> None:
+    """
+    Caches flags of all countries on a background thread, showing its progress below the search bar
+    """
+    progress = queue.SimpleQueue()
+
+    def update_status() -> None:
+        result = None
+        while not progress.empty():
+            result = progress.get()
+
+        if isinstance(result, str):
+            show_status(result)
+            mnu_cache.entryconfigure('Prefetch all flags', state='normal')
+            return
+        if result:
+            done, total = result
+            show_status(f'Prefetching flags: {done}/{total} '
+                        f'({done / (perf_counter() - start):.1f} flags/sec)')
+        root.after(100, update_status)
+
+    def run_prefetch() -> None:
+        from flag_finder.fetch import prefetch_flags, prefetch_report
+
+        try:
+            progress.put(prefetch_report(*prefetch_flags(get_catalog().names(), args.workers,
+                                                         lambda *done: progress.put(done))))
+        except Exception as error:  # reported, so that the menu item is enabled again
+            progress.put(f'Prefetch failed: {error!r}')
+
+    mnu_cache.entryconfigure('Prefetch all flags', state='disabled')
+    show_status('Prefetching flags...')
+    start = perf_counter()
+    threading.Thread(target=run_prefetch, name='flag-prefetch', daemon=True).start()
+    root.after(100, update_status)
+
+
+def scrub_cache(quiet: bool = False) -> None:
+    """
+    Scrubs the on-disk cache on a background thread, showing its progress below the search bar
+
+    :param quiet: whether to only show the outcome, and only if it reclaimed anything (e.g. for a scheduled scrub)
+    """
+    progress = queue.SimpleQueue()
+
+    def update_status() -> None:
+        result = None
+        while not progress.empty():
+            result = progress.get()
+
+        if result and isinstance(result[0], str):  # (report, number of bytes reclaimed or None if it failed)
+            report, reclaimed = result
+            if not quiet or reclaimed != 0:
+                show_status(report)
+            mnu_cache.entryconfigure('Scrub disk cache', state='normal')
+            return
+        if result and not quiet:
+            checked, freed = result
+            show_status(f'Scrubbing cache: {checked} files, {freed / 2 ** 20:.1f} MiB reclaimed')
+        root.after(100, update_status)
+
+    def run_scrub() -> None:
+        from flag_finder.scrub import scrub, scrub_report
+
+        try:
+            outcome = scrub(scrub_stop, lambda *checked: progress.put(checked))
+            progress.put((scrub_report(*outcome), outcome[1]))
+        except Exception as error:  # reported, so that the menu item is enabled again
+            progress.put((f'Scrub failed: {error!r}', None))
+
+    mnu_cache.entryconfigure('Scrub disk cache', state='disabled')
+    threading.Thread(target=run_scrub, name='flag-scrub', daemon=True).start()
+    root.after(100, update_status)
+
+
+def scheduled_scrub() -> None:
+    """
+    Scrubs the on-disk cache quietly if it wasn't for config.SCRUB_INTERVAL seconds
+    """
+    from flag_finder.scrub import scrub_due
+
+    if scrub_due():
+        scrub_cache(quiet=True)
+
+
+def pick_flag(country: str) -> None:
+    """
+    Shows the flag of a country picked outside the search bar, e.g. in the gallery
+
+    :param country: name of country
+    """
+    mnu_countries.set(country)
+    show_flag()
+
+
+def close(event: tk.Event) -> None:
+    """
+    Stops background work when the window is closed
+
+    :param event: <Destroy> event, of the window or of one of its widgets
+    """
+    if event.widget is not root:
+        return
+    fetcher.shutdown()
+    speculator.shutdown()
+    gallery.shutdown()
+    scrub_stop.set()
+    if 'flag_finder.fetch' in sys.modules:  # nothing to stop if nothing was ever fetched
+        sys.modules['flag_finder.fetch'].shutdown()
+
+
+def preload() -> None:
+    """
+    Imports on a background thread what fetching and showing a flag needs, once the window is shown,
+    so that the first flag doesn't wait for it
+    """
+    def run_imports() -> None:
+        importlib.import_module('flag_finder.fetch')
+        importlib.import_module('PIL.ImageTk')
+
+    threading.Thread(target=run_imports, name='flag-preload', daemon=True).start()
+
+
+def first_window_shown() -> None:
+    """
+    Called once the window is first drawn: starts what was deferred until then, and reports startup time if asked to
+    """
+    root.update_idletasks()  # finish drawing, in case some of it is still pending
+    shown = perf_counter() - STARTED
+    if args.profile_startup:
+        from flag_finder.profiling import import_report, stop_profiling
+
+        stop_profiling()
+        print(f'First window shown {shown * 1000:.1f} ms after start (target: {FIRST_WINDOW_TARGET * 1000:.0f} ms)')
+        print(import_report())
+    preload()
+    root.after(10000, scheduled_scrub)  # once the first flags have been shown
+
+
+if __name__ == '__main__':  # not when imported, e.g. by the processes rendering .svg files (see flag_finder.raster)
+    args = parser.parse_args()
+    apply_settings(args)
+    config.SPECULATE_TOP_N = args.speculate
+    config.SPECULATE_BANDWIDTH = args.speculate_kbps * 1024
+
+    # Modes without a window, run before Tk is started so that they need no display
+    if args.build_catalog is not None:
+        from flag_finder.catalog import build_catalog
+
+        path = os.path.join(config.FLAGS_LOG_DIR, 'catalog.tsv')
+        print(f'Cataloged {build_catalog(args.build_catalog or config.CATALOG_CATEGORIES, path)} flags in {path}')
+        sys.exit()
+    if args.prefetch:
+        from flag_finder.fetch import prefetch_flags, prefetch_report, shutdown
+
+        report = prefetch_report(*prefetch_flags(get_catalog().names(),
+                                                 args.workers,
+                                                 lambda done, total: print(f'\rPrefetching flags: {done}/{total}', end='', flush=True)))
+        print(f'\n{report}')
+        shutdown()
+        sys.exit()
+
+    # Greeting window: a small window with a label and a dropdown list of countries for user to choose from
+    root = tk.Tk()
+    root.minsize(400, 0)
+    root.title('Flag Finder')
+    root.resizable(False, False)
+
+    ttk.Style().configure('TFrame', background='light gray')
+
+    ttk.Style().configure('TLabel', background='light gray')
+    ttk.Style().configure('Error.TLabel', anchor='center', justify='center')
+
+    header = ttk.Frame(root)
+    header.columnconfigure(0, weight=0)
+    header.columnconfigure(1, weight=1)
+    header.pack(fill='x')
+
+    body = ttk.Frame(root)
+    body.pack(fill='both')
+
+    footer = ttk.Frame(root)
+    footer.columnconfigure(0, weight=0)
+    footer.columnconfigure(1, weight=1)
+    footer.pack(fill='x', side='bottom')
+
+    lbl_country = ttk.Label(
+        master=header,
+        text='Choose (or type in) a country:',
+    )
+    lbl_country.grid(row=0, column=0, sticky='nw', padx=(5, 0))
+
+    mnu_countries = SearchableCombobox(master=header, values=get_catalog().names())
+    mnu_countries.grid(row=0, column=1, sticky='new', padx=5)
+    ToolTip(master=mnu_countries,
+            text='Type a country\'s name in, or type some letters and press enter to show the countries with the typed letters in the corresponding order\n'
+                 'E.g. "ez" will show Belize "B(e)li(z)e", New Zealand "N(e)w (Z)ealand", Venezuela "V(e)ne(z)uela",... (non-case sensitive)')
+
+    lbl_status = ttk.Label(header)
+
+    menubar = tk.Menu(root)
+    mnu_cache = tk.Menu(menubar, tearoff=False)
+    mnu_cache.add_command(label='Prefetch all flags', command=prefetch_all)
+    mnu_cache.add_command(label='Scrub disk cache', command=scrub_cache)
+    mnu_cache.add_command(label='Image cache statistics', command=lambda: show_status(image_cache.stats()))
+    mnu_cache.add_command(label='Fetch ahead statistics', command=lambda: show_status(speculator.stats()))
+    mnu_cache.add_command(label='Request statistics', command=lambda: show_status(get_scheduler().report()))
+    menubar.add_cascade(label='Cache', menu=mnu_cache)
+    mnu_view = tk.Menu(menubar, tearoff=False)
+    mnu_view.add_command(label='Gallery of matching flags', command=lambda: gallery.show(mnu_countries.matches()))
+    menubar.add_cascade(label='View', menu=mnu_view)
+    root.configure(menu=menubar)
+
+    image_cache = ImageCache(args.image_cache_mb * 2 ** 20)
+    fetcher = FlagFetcher(root)
+    speculator = SpeculativePrefetcher(config.IMG_WIDTH)
+    gallery = FlagGallery(root, pick_flag)
+    scrub_stop = threading.Event()
+    root.bind('<Destroy>', close)
+
+    mnu_countries.configure(function=show_flag, on_candidates=speculator.speculate)
+    # an open gallery follows what is typed
+    mnu_countries.bind('<KeyRelease>', lambda _: gallery.is_open() and gallery.show(mnu_countries.matches()), add='+')
+    mnu_countries.focus_set()
+
+    root.after_idle(first_window_shown)  # idle callbacks run after the window's first drawing
+    root.mainloop()
@@ -0,0 +1,3 @@
+"""
+Benchmarks of Flag-finder's hot paths, see __main__.py for how to run them
+"""
@@ -0,0 +1,119 @@
+"""
+Runs the benchmarks and writes their results as JSON, to be compared between versions:
+
+    python -m benchmarks --out results.json
+    python -m benchmarks --suites search --quick --compare results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from flag_finder import config
+
+from . import bench_cache, bench_fetch, bench_search
+
+
+def flatten(results: dict, path: str = '') -> dict[str, float]:
+    """
+    Returns the median durations of nested results, keyed by their path, e.g. "search/1000/search_2_letters"
+
+    :param results: results, as written by this command
+    :param path: path of results within the whole results
+    :return: path -> median duration in microseconds
+    """
+    medians = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if 'median_us' in value:
+                medians[f'{path}{key}'] = value['median_us']
+            else:
+                medians.update(flatten(value, f'{path}{key}/'))
+    return medians
+
+
+def compare(previous: dict, current: dict, threshold: float) -> list[str]:
+    """
+    Returns a line per measurement whose median changed by more than threshold between two runs
+
+    :param previous: results of the earlier run
+    :param current: results of the later run
+    :param threshold: relative change ignored, e.g. 0.1 for 10%
+    :return: lines to show to user, slowest changes first
+    """
+    before, after = flatten(previous['results']), flatten(current['results'])
+    changes = sorted(((after[path] / before[path] - 1, path) for path in before.keys() & after.keys() if before[path]),
+                     reverse=True)
+    return [f'{"SLOWER" if change > 0 else "FASTER"}\t{change:+.0%}\t{path}\t{before[path]} -> {after[path]} µs'
+            for change, path in changes if abs(change) > threshold]
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Runs the command line
+
+    :param argv: arguments, sys.argv[1:] if None
+    :return: exit status: 1 if --fail-on-regression and a measurement got slower, 0 otherwise
+    """
+    parser = argparse.ArgumentParser(prog='benchmarks', description='Benchmark search, cache and fetch of Flag-finder')
+    parser.add_argument('--suites', nargs='+', choices=('search', 'cache', 'fetch'), default=('search', 'cache', 'fetch'),
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--out', help='file to write the results to as JSON (default: standard output)')
+    parser.add_argument('--quick', action='store_true', help='run with fewer names, flags and samples, to check a change fast')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds the local Wikimedia stand-in delays every response by (default: 0.02)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='probability of the stand-in answering a request with 503 (default: 0)')
+    parser.add_argument('--compare', metavar='PATH', help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change of a median ignored by --compare (default: 0.1)')
+    parser.add_argument('--fail-on-regression', action='store_true',
+                        help='exit with status 1 if --compare finds a measurement got slower')
+    args = parser.parse_args(argv)
+
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    run = {'commit': commit.stdout.strip() or None,
+           'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'quick': args.quick,
+           'results': {}}
+
+    # Cache and fetch benchmarks fill a cache of their own, never the user's
+    with tempfile.TemporaryDirectory(prefix='flag-bench-') as cache_dir:
+        config.FLAGS_DIR = config.FLAGS_LOG_DIR = cache_dir
+        config.RETRIES = 5  # the stand-in's errors are retried, as Wikimedia's would be
+        config.UPSTREAM_RATE = 0  # the stand-in has no rate limit, what is measured is the engine
+        if 'search' in args.suites:
+            print('Benchmarking search...', file=sys.stderr)
+            run['results']['search'] = bench_search.run((200, 1000, 10000) if args.quick else (200, 1000, 10000, 100000),
+                                                        20 if args.quick else 50)
+        if 'cache' in args.suites:
+            print('Benchmarking cache...', file=sys.stderr)
+            run['results']['cache'] = bench_cache.run((10, 100, 500) if args.quick else (10, 100, 1000, 5000),
+                                                      50 if args.quick else 200)
+        if 'fetch' in args.suites:
+            print('Benchmarking fetch...', file=sys.stderr)
+            run['results']['fetch'] = bench_fetch.run(10 if args.quick else 50, args.latency, args.error_rate)
+
+    output = json.dumps(run, indent=2)
+    if args.out:
+        with open(args.out, 'w') as out:
+            out.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            changes = compare(json.load(previous), run, args.threshold)
+        print('\n'.join(changes) or 'No change beyond the threshold', file=sys.stderr)
+        if args.fail_on_regression and any(change.startswith('SLOWER') for change in changes):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
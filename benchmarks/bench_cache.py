@@ -0,0 +1,65 @@
+"""
+Benchmarks of the on-disk cache as it fills up: writing a flag, and looking one up
+"""
+import random
+from io import BytesIO
+
+from PIL import Image
+
+from flag_finder import config
+from flag_finder.cache import cache_flag, get_cache
+
+from .timing import measure, summary
+
+
+def sample_flag(width: int) -> bytes:
+    """
+    Returns a PNG the size of a cached flag
+
+    :param width: flag's width
+    :return: content of the PNG
+    """
+    image = Image.new('RGB', (width, width * 2 // 3), (200, 16, 46))
+    image.paste((255, 255, 255), (0, width // 3, width, width * 2 // 3))
+    png = BytesIO()
+    image.save(png, 'PNG')
+    return png.getvalue()
+
+
+def run(sizes: tuple[int, ...] = (10, 100, 1000, 5000), samples: int = 200, width: int = 700, seed: int = 0) -> dict:
+    """
+    Fills the cache up to each size in turn with made-up flags, then times at that size:
+    cache_flag of a new flag, get_cache of a cached flag (a stat, and a hash when it is due for verification),
+    and get_cache of a flag that isn't cached.
+    Must run with config.FLAGS_DIR and config.FLAGS_LOG_DIR pointing to empty directories
+
+    :param sizes: numbers of cached flags to benchmark at, increasing
+    :param samples: number of calls timed per measurement
+    :param width: width of the made-up flags
+    :param seed: seed of which flags are looked up
+    :return: number of cached flags -> measurement -> statistics
+    """
+    rng = random.Random(seed)
+    img = sample_flag(width)
+    verify_interval = config.VERIFY_INTERVAL
+    results = {}
+    cached = 0
+    for size in sizes:
+        for i in range(cached, size):
+            cache_flag(f'Bench {i:06}', img)
+        cached = max(cached, size)
+
+        result = {}
+        result['cache_flag'] = summary([measure(cache_flag, f'Bench {i:06}', img) for i in range(cached, cached + samples)])
+        cached += samples
+        result['get_cache_hit'] = summary([measure(get_cache, f'Bench {rng.randrange(size):06}') for _ in range(samples)])
+        config.VERIFY_INTERVAL = 0
+        try:
+            result['get_cache_hit_verified'] = summary([measure(get_cache, f'Bench {rng.randrange(size):06}')
+                                                        for _ in range(samples)])
+        finally:
+            config.VERIFY_INTERVAL = verify_interval
+        result['get_cache_miss'] = summary([measure(get_cache, f'Missing {i}') for i in range(samples)])
+
+        results[str(size)] = result
+    return results
@@ -0,0 +1,68 @@
+"""
+End-to-end benchmarks of getting a flag, from the API query to the decoded image, against the local stand-in
+"""
+from time import perf_counter
+
+from flag_finder import config
+from flag_finder.cache import get_manifest
+from flag_finder.fetch import FetchError, fetch_flag, get_image, prefetch_flags
+
+from .standin import StandIn
+from .timing import measure, summary
+
+
+def run(countries: int = 50, latency: float = 0.02, error_rate: float = 0, workers: int = 8, seed: int = 0) -> dict:
+    """
+    Times get_image of flags not cached yet (cold: API query, download, decode), then of the same flags again
+    (warm: cache lookup and decode), fetch_flag of the same flags once expired (revalidate: conditional API query
+    and download, both answered 304), and the throughput of prefetch_flags over as many other flags.
+    Must run with config.FLAGS_DIR and config.FLAGS_LOG_DIR pointing to empty directories, before anything is fetched
+
+    :param countries: number of flags fetched by each measurement
+    :param latency: seconds the stand-in delays every response by
+    :param error_rate: probability of the stand-in answering a request with 503, which fetches retry
+    :param workers: number of flags prefetched in parallel
+    :param seed: seed of which requests the stand-in fails
+    :return: measurement -> statistics, and requests the stand-in received
+    """
+    with StandIn(latency, error_rate, seed) as stand_in:
+        config.API_URL = stand_in.api_url
+        result = {'latency_s': latency, 'error_rate': error_rate}
+
+        for temperature in ('cold', 'warm'):
+            samples, failed = [], 0
+            for i in range(countries):
+                try:
+                    samples.append(measure(get_image, f'Fetch bench {i:04}', config.IMG_WIDTH))
+                except FetchError:
+                    failed += 1
+            result[f'get_image_{temperature}'] = summary(samples) if samples else {}
+            result[f'get_image_{temperature}']['failed'] = failed
+
+        manifest = get_manifest()
+        samples, failed = [], 0
+        for i in range(countries):
+            country = f'Fetch bench {i:04}'
+            resolution = manifest.get_resolution(country)
+            if not (manifest.get(country) and resolution):
+                continue  # failed cold
+            manifest.put(country, cached=0)
+            manifest.put_resolution(**{**resolution, 'resolved': 0})
+            try:
+                samples.append(measure(fetch_flag, country))
+            except FetchError:
+                failed += 1
+        result['revalidate'] = summary(samples) if samples else {}
+        result['revalidate']['failed'] = failed
+
+        start = perf_counter()
+        cached, failed, _ = prefetch_flags([f'Prefetch bench {i:04}' for i in range(countries)], workers)
+        elapsed = perf_counter() - start
+        result['prefetch'] = {'flags': countries,
+                              'workers': workers,
+                              'failed': len(failed),
+                              'seconds': round(elapsed, 3),
+                              'flags_per_second': round(cached / elapsed, 1)}
+
+        result['requests'] = dict(stand_in.requests)
+    return result
@@ -0,0 +1,80 @@
+"""
+Benchmarks of the search bar's indexes: what SearchableCombobox runs on every keystroke
+"""
+import random
+
+from flag_finder.search import PrefixIndex, SubsequenceIndex
+
+from .timing import measure, summary
+
+SYLLABLES = ('an', 'bar', 'bu', 'ca', 'do', 'el', 'fi', 'ga', 'ho', 'is', 'ja', 'ke', 'la', 'mo', 'ni', 'or',
+             'pa', 'qu', 'ri', 'sa', 'ta', 'u', 've', 'wa', 'xi', 'ya', 'zu')
+
+
+def synthetic_names(count: int, seed: int = 0) -> list[str]:
+    """
+    Returns distinct made-up country names of one to three words, e.g. "Kelamo Tani"
+
+    :param count: number of names
+    :param seed: seed of the names' randomness, the same seed gives the same names
+    :return: names, in no particular order
+    """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        words = (''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize() for _ in range(rng.randint(1, 3)))
+        names.add(' '.join(words))
+    return sorted(names, key=lambda _: rng.random())
+
+
+def subsequence_query(name: str, length: int, rng: random.Random) -> str:
+    """
+    Returns letters picked in order from name, the kind of query a user types to find it
+
+    :param name: name to pick letters from
+    :param length: number of letters
+    :param rng: randomness of the picks
+    :return: query
+    """
+    letters = [char for char in name.lower() if char != ' ']
+    return ''.join(letters[i] for i in sorted(rng.sample(range(len(letters)), min(length, len(letters)))))
+
+
+def run(sizes: tuple[int, ...] = (200, 1000, 10000, 100000), queries: int = 50, seed: int = 0) -> dict:
+    """
+    Times building the indexes, subsequence search for queries of 1 to 5 letters and a query matching nothing,
+    and completion on every keystroke of typing names letter by letter then deleting them back
+
+    :param sizes: numbers of names to benchmark with
+    :param queries: number of queries (and of names typed) per measurement
+    :param seed: seed of the names and queries
+    :return: number of names -> measurement -> statistics
+    """
+    results = {}
+    for size in sizes:
+        rng = random.Random(seed)
+        names = synthetic_names(size, seed)
+        result = {}
+
+        result['build_subsequence_index'] = summary([measure(SubsequenceIndex, names) for _ in range(3)])
+        result['build_prefix_index'] = summary([measure(PrefixIndex, names) for _ in range(3)])
+
+        index = SubsequenceIndex(names)
+        for length in (1, 2, 3, 5):
+            result[f'search_{length}_letters'] = summary([measure(index.search, subsequence_query(rng.choice(names), length, rng))
+                                                         for _ in range(queries)])
+        # letters every name is made of, in an order no name has them in: every candidate is checked, none matches
+        result['search_no_match'] = summary([measure(index.search, 'xqzxqzxq') for _ in range(queries)])
+
+        prefixes = PrefixIndex(names)
+        typing, deleting = [], []
+        for name in rng.sample(names, min(queries, size)):
+            for end in range(1, len(name) + 1):
+                typing.append(measure(prefixes.complete, name[:end]))
+            for end in range(len(name) - 1, -1, -1):
+                deleting.append(measure(prefixes.rewind, name[:end]))
+        result['complete_keystroke'] = summary(typing)
+        result['rewind_backspace'] = summary(deleting)
+
+        results[str(size)] = result
+    return results
@@ -0,0 +1,146 @@
+"""
+Local stand-in for Wikimedia Commons, so fetches can be benchmarked without the network:
+answers api.php?prop=pageimages like the MediaWiki API and serves the thumbnails it links to,
+with a configurable latency and rate of errors
+"""
+import hashlib
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from time import sleep
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+from PIL import Image
+
+
+class StandIn:
+    """
+    HTTP server on 127.0.0.1 emulating the parts of Wikimedia Commons Flag-finder uses:
+    - /w/api.php?action=query&prop=pageimages&titles=...&pithumbsize=... , titles containing "Missing" have no image
+    - /thumb/<file>/<width>px-<file>.png , a PNG of that width, with an ETag honored by If-None-Match
+    Every response is delayed by latency seconds, and answered 503 instead with probability error_rate
+
+    :param latency: seconds every response is delayed by
+    :type latency: float
+    :param error_rate: probability of a response being 503 Service Unavailable, between 0 and 1
+    :type error_rate: float
+    :param seed: seed of the errors' randomness, so that runs with the same settings fail the same requests
+    :type seed: int
+    """
+    def __init__(self, latency: float = 0, error_rate: float = 0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = {'api': 0, 'thumb': 0, 'not_modified': 0, 'error': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thumbnails = {}  # (file, width) -> PNG, flags are drawn once
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.url}/w/api.php'
+
+    def start(self) -> 'StandIn':
+        threading.Thread(target=self._server.serve_forever, name='stand-in', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StandIn':
+        return self.start()
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+    def _count(self, kind: str) -> None:
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _fails(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _thumbnail(self, file: str, width: int) -> bytes:
+        with self._lock:
+            if (file, width) in self._thumbnails:
+                return self._thumbnails[file, width]
+
+        # Each flag gets its own colors, with a stripe so that it compresses like a flag rather than a solid color
+        digest = hashlib.sha3_256(file.encode()).digest()
+        image = Image.new('RGB', (width, width * 2 // 3), tuple(digest[:3]))
+        image.paste(tuple(digest[3:6]), (0, 0, width // 3, width * 2 // 3))
+        png = BytesIO()
+        image.save(png, 'PNG')
+        with self._lock:
+            self._thumbnails[file, width] = png.getvalue()
+        return png.getvalue()
+
+    def _pageimages(self, query: dict) -> dict:
+        width = int(query.get('pithumbsize', ['50'])[0])
+        pages = {}
+        for i, title in enumerate(query.get('titles', [''])[0].split('|'), start=1):
+            if 'Missing' in title:
+                pages[str(-i)] = {'ns': 6, 'title': title, 'missing': ''}
+                continue
+            file = title.removeprefix('File:').replace(' ', '_')
+            pages[str(i)] = {'pageid': i,
+                             'ns': 6,
+                             'title': title,
+                             'thumbnail': {'source': f'{self.url}/thumb/{quote(file)}/{width}px-{quote(file)}.png',
+                                           'width': width,
+                                           'height': width * 2 // 3},
+                             'pageimage': file}
+        return {'batchcomplete': '', 'query': {'pages': pages}}
+
+    def _handler(self) -> type:
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *_) -> None:
+                pass
+
+            def reply(self, status: int, body: bytes = b'', content_type: str | None = None) -> None:
+                etag = f'"{hashlib.md5(body).hexdigest()}"' if body else None
+                if etag and self.headers.get('If-None-Match') == etag:
+                    stand_in._count('not_modified')
+                    self.send_response(304)  # the only status line of the response
+                    self.end_headers()
+                    return
+
+                self.send_response(status)
+                if status == 503:
+                    self.send_header('Retry-After', '0')
+                if body:
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                sleep(stand_in.latency)
+                if stand_in._fails():
+                    stand_in._count('error')
+                    self.reply(503)
+                elif url.path == '/w/api.php':
+                    stand_in._count('api')
+                    self.reply(200, json.dumps(stand_in._pageimages(parse_qs(url.query))).encode(), 'application/json')
+                elif url.path.startswith('/thumb/'):
+                    stand_in._count('thumb')
+                    *_, file, thumbnail = url.path.split('/')
+                    width = int(thumbnail.split('px-')[0])
+                    self.reply(200, stand_in._thumbnail(unquote(file), width), 'image/png')
+                else:
+                    self.reply(404)
+
+        return Handler
@@ -0,0 +1,34 @@
+"""
+Timing helpers shared by the benchmarks
+"""
+from statistics import mean, median
+from time import perf_counter
+
+
+def measure(function, *args) -> float:
+    """
+    Returns how long function(*args) took, in microseconds
+
+    :param function: function to time
+    :param args: arguments for function
+    :return: duration in microseconds
+    """
+    start = perf_counter()
+    function(*args)
+    return (perf_counter() - start) * 1e6
+
+
+def summary(samples: list[float]) -> dict[str, float]:
+    """
+    Returns statistics of durations, rounded to 0.1 µs
+
+    :param samples: durations in microseconds
+    :return: number of samples, and min, median, p95, mean and max duration in microseconds
+    """
+    ordered = sorted(samples)
+    return {'samples': len(ordered),
+            'min_us': round(ordered[0], 1),
+            'median_us': round(median(ordered), 1),
+            'p95_us': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+            'mean_us': round(mean(ordered), 1),
+            'max_us': round(ordered[-1], 1)}
@@ -0,0 +1,41 @@
+"""
+Fetch and cache engine of Flag-finder, usable without Tk (see flag_finder.cli for its command line).
+Submodules are only imported when one of their names is first used, e.g. flag_finder.get_image imports
+requests and Pillow, while `from flag_finder import config` imports neither, so a window can show before they load
+"""
+import importlib
+
+# name -> submodule defining it. scrub() and trace() are left out, they would shadow their own submodules
+_EXPORTS = {
+    'batch': ('fetch_batch',),
+    'cache': ('cache_flag', 'delete_flag', 'get_cache', 'get_hash', 'get_manifest', 'get_variant', 'install_flag',
+              'make_room'),
+    'catalog': ('FlagCatalog', 'build_catalog', 'commons_title', 'get_catalog', 'valid_name'),
+    'daemon': ('HotFlags', 'fetch_from_daemon', 'prefetch_on_daemon', 'serve'),
+    'export': ('export_flag', 'export_flags'),
+    'fetch': ('FetchError', 'fetch_flag', 'get_flag', 'get_image', 'prefetch_flags', 'prefetch_report', 'query_flags'),
+    'flight': ('KeyedLock', 'SingleFlight'),
+    'manifest': ('CacheManifest',),
+    'pack': ('FlagPack', 'build_pack', 'get_pack'),
+    'scrub': ('scrub_due', 'scrub_report'),
+    'raster': ('RasterError', 'original_source', 'rasterize'),
+    'scheduler': ('UpstreamScheduler', 'get_scheduler', 'priority', 'set_priority'),
+    'search': ('PrefixIndex', 'SubsequenceIndex'),
+    'session': ('get_session', 'make_session'),
+    'trace': ('Trace', 'annotate', 'metrics', 'serve_metrics', 'span', 'tracing'),
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name: str):
+    if name in _MODULES:
+        value = getattr(importlib.import_module(f'.{_MODULES[name]}', __name__), name)
+        globals()[name] = value  # found directly next time
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_MODULES))
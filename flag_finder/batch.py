@@ -0,0 +1,267 @@
+"""
+Fetching many flags at once (e.g. exporting or prefetching thousands of them) on an asyncio event loop, with httpx:
+API calls and downloads share a few connections per host, multiplexed over HTTP/2 if h2 is installed too,
+and images are streamed into their cache file instead of being held in memory whole.
+The cache and its manifest end up exactly as flag_finder.fetch leaves them, requests wait their turn in the same
+scheduler (see flag_finder.scheduler). httpx isn't a required dependency, without it batches are fetched on threads
+"""
+import asyncio
+import importlib.util
+import json
+import os
+from hashlib import sha3_256
+from math import inf
+from time import perf_counter, time
+from urllib.parse import urlparse
+
+import requests
+
+from . import config, raster
+from .cache import get_cache, get_manifest, install_flag, make_room, temporary_path
+from .catalog import commons_title, valid_name
+from .fetch import _in_flight, conditional_headers, download_resolved, query_params, record_query, thumbnail_source
+from .scheduler import current_priority, get_scheduler, priority, retry_after
+from .trace import span
+
+try:
+    import httpx
+except ImportError:  # optional, see available()
+    httpx = None
+
+
+RETRY_STATUSES = (500, 502, 503, 504)  # retried with exponential backoff, as flag_finder.session does
+
+
+def available() -> bool:
+    """
+    Returns whether batches are fetched here: config.ASYNC_BATCHES is set and httpx is installed
+    """
+    return config.ASYNC_BATCHES and httpx is not None
+
+
+def fetch_batch(countries: list[str] | tuple[str, ...], concurrency: int = 8, progress=None) -> (int, dict[str, str], float):
+    """
+    Warm the cache with the flags of all given countries that aren't cached yet, see flag_finder.fetch.prefetch_flags.
+    Runs an event loop on this thread until every flag is cached or failed, its requests are of this thread's priority
+
+    :param countries: names of countries to cache flag of
+    :param concurrency: maximum number of API calls and downloads in flight at the same time
+    :param progress: called with (number of flags processed so far, number of flags to fetch) after each flag
+    :return: number of flags cached, name of country -> error message (to show to user) for the flags that could not
+             be fetched, and elapsed time in seconds
+    """
+    start = perf_counter()
+    invalid = {country: f'Invalid name: {country}' for country in countries if not valid_name(country)}
+    missing = [country for country in dict.fromkeys(countries) if country not in invalid and not get_cache(country)]
+    failed = asyncio.run(_fetch_all(missing, concurrency, progress))
+    return len(missing) - len(failed), invalid | failed, perf_counter() - start
+
+
+async def _fetch_all(missing: list[str], concurrency: int, progress) -> dict[str, str]:
+    failed = {}
+    done = 0
+    limit = asyncio.Semaphore(concurrency)
+    downloads = []
+    name = current_priority()
+
+    def finished(country: str, error: str | None = None) -> None:
+        nonlocal done
+        if error:
+            failed[country] = error
+        done += 1
+        if progress:
+            progress(done, len(missing))
+
+    async def download_once(country: str, resolution: dict) -> None:
+        if raster.enabled():
+            # rendered in the rasterizing processes anyway, downloading the .svg file on a thread costs little
+            await asyncio.to_thread(_in_priority, name, download_resolved, country, resolution)
+        else:
+            source = thumbnail_source(resolution)
+            # shared with a window or a thread downloading the same thumbnail, see flag_finder.fetch.download_flag
+            await _in_flight.ado(('download', country, source), _download_flag, client, country, source)
+
+    async def download(country: str, resolution: dict) -> None:
+        async with limit:
+            try:
+                try:
+                    await download_once(country, resolution)
+                except (httpx.HTTPStatusError, requests.exceptions.HTTPError) as error:
+                    if error.response.status_code != 404:
+                        raise
+                    # The file may have been renamed or deleted since it was resolved, see flag_finder.fetch.fetch_flag
+                    refreshed = (await _query(client, [country])).get(country)
+                    if refreshed is None or refreshed['template'] == resolution['template']:
+                        raise
+                    await download_once(country, refreshed)
+            except (httpx.HTTPError, requests.exceptions.RequestException, OSError, ValueError, KeyError) as error:
+                finished(country, _error_message(error))
+                return
+        finished(country)
+
+    async def resolve(batch: list[str]) -> None:
+        async with limit:
+            try:
+                resolutions = await _query(client, batch)
+                error = None
+            except (httpx.HTTPError, ValueError, KeyError) as query_error:
+                resolutions = {}
+                error = _error_message(query_error)
+        for country in batch:
+            if country in resolutions:
+                downloads.append(asyncio.create_task(download(country, resolutions[country])))
+            else:
+                finished(country, error or f'No flag of {country} was found on Wikimedia Commons.')
+
+    async with httpx.AsyncClient(http2=config.HTTP2 and importlib.util.find_spec('h2') is not None,
+                                 headers=config.HEADERS,
+                                 limits=httpx.Limits(max_connections=concurrency,
+                                                     max_keepalive_connections=concurrency),
+                                 # waiting for a connection is bounded by concurrency, not by a timeout
+                                 timeout=httpx.Timeout(config.READ_TIMEOUT, connect=config.CONNECT_TIMEOUT, pool=None)) \
+            as client:
+        unresolved = []
+        for country in missing:
+            resolution = get_manifest().get_resolution(country)
+            if resolution and time() - resolution['resolved'] < config.RESOLUTION_EXPIRY:
+                downloads.append(asyncio.create_task(download(country, resolution)))
+            else:
+                unresolved.append(country)
+
+        await asyncio.gather(*(resolve(unresolved[i:i + config.API_TITLES_LIMIT])
+                               for i in range(0, len(unresolved), config.API_TITLES_LIMIT)))
+        await asyncio.gather(*downloads)  # every download has been started once every batch was resolved
+    return failed
+
+
+async def _send(client: 'httpx.AsyncClient', url: str, headers: dict | None = None,
+                params: dict | None = None) -> 'httpx.Response':
+    """
+    Internally called only
+
+    Sends a GET request once the scheduler admits it, and retries it as flag_finder.session does: timed out requests and
+    5xx responses with exponential backoff (waiting for Retry-After if sent), 429 responses once the scheduler slowed down.
+    The response's body is left to be streamed, the response must be closed
+    """
+    host = urlparse(url).hostname
+    scheduler = get_scheduler()
+    request = client.build_request('GET', url, headers=headers, params=params)
+    for attempt in range(config.RETRIES + 1):
+        backoff = 0.5 * 2 ** attempt if attempt else 0  # 0s, 1s, 2s, 4s...
+        try:
+            async with scheduler.aslot(host):
+                response = await client.send(request, stream=True)
+        except httpx.TransportError:  # timed out, or could not connect
+            if attempt == config.RETRIES:
+                raise
+            await asyncio.sleep(backoff)
+            continue
+
+        if response.status_code == 429:
+            scheduler.throttle(host, retry_after(response.headers.get('Retry-After')))
+            backoff = 0
+        elif response.status_code in RETRY_STATUSES:
+            backoff = retry_after(response.headers.get('Retry-After')) or backoff
+        else:
+            scheduler.succeeded()
+            return response
+        if attempt == config.RETRIES:
+            return response  # the last error, so raise_for_status() can report it
+        await response.aclose()
+        await asyncio.sleep(backoff)
+
+
+async def _query(client: 'httpx.AsyncClient', countries: list[str]) -> dict[str, dict]:
+    """
+    Internally called only, see flag_finder.fetch.query_flags
+    """
+    titles = {commons_title(country): country for country in countries}
+    response = await _send(client, config.API_URL, params=query_params(titles))
+    try:
+        response.raise_for_status()
+        return record_query(titles, json.loads(await response.aread()))
+    finally:
+        await response.aclose()
+
+
+async def _download_flag(client: 'httpx.AsyncClient', country: str, source: str) -> None:
+    """
+    Internally called only, see flag_finder.fetch.download_flag
+
+    The image is hashed and written into a temporary file chunk by chunk as it arrives, then swapped in
+    """
+    cached = get_manifest().get(country)
+    headers = {}
+    if cached and cached['source'] == source and get_cache(country, max_age=inf):
+        headers = conditional_headers(cached['img_etag'], cached['img_modified'])
+
+    with span('fetch.download', conditional=bool(headers)):
+        response = await _send(client, source, headers)
+    try:
+        if response.status_code == 304:
+            get_manifest().put(country, cached=int(time()))
+            return
+        response.raise_for_status()
+
+        expected = int(response.headers.get('Content-Length', 0))  # only known beforehand if the server sent it
+        if expected:
+            with span('cache.evict'):
+                await asyncio.to_thread(make_room, expected, country)
+        img_path = os.path.join(config.FLAGS_DIR, f'{country}.png')
+        tmp_path = temporary_path(img_path)  # a batch never fetches the same country twice at once
+        img_hash = sha3_256()
+        size = 0
+        with open(tmp_path, 'wb') as image:
+            try:
+                with span('fetch.stream'):
+                    async for chunk in response.aiter_bytes(config.STREAM_CHUNK_SIZE):
+                        img_hash.update(chunk)
+                        image.write(chunk)
+                        size += len(chunk)
+            except BaseException:
+                image.close()  # an open file can't be deleted on Windows
+                os.remove(tmp_path)
+                raise
+    finally:
+        await response.aclose()
+
+    if size != expected:  # no Content-Length, or the image was sent compressed: room is made for what was written
+        try:
+            with span('cache.evict'):
+                await asyncio.to_thread(make_room, size, country)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    await asyncio.to_thread(install_flag,
+                            country,
+                            tmp_path,
+                            img_hash.hexdigest(),
+                            source=source,
+                            img_etag=response.headers.get('ETag'),
+                            img_modified=response.headers.get('Last-Modified'))
+
+
+def _in_priority(name: str, function, *args):
+    """
+    Internally called only, on a thread of asyncio.to_thread: runs function(*args) at the priority of the batch
+    """
+    with priority(name):
+        return function(*args)
+
+
+def _error_message(error: Exception) -> str:
+    """
+    Internally called only: returns the message of a flag that could not be fetched, meant to be shown to user
+    """
+    if isinstance(error, (httpx.TimeoutException, requests.exceptions.Timeout)):
+        return 'Fetch request timed out.'
+    if isinstance(error, httpx.HTTPStatusError):
+        return (f'HTTP Error while fetching. Code: {error.response.status_code}.\n'
+                f'Message: {error.response.reason_phrase}')
+    if isinstance(error, requests.exceptions.HTTPError):
+        return f'HTTP Error while fetching. Code: {error.response.status_code}.\nMessage: {error.response.reason}'
+    if isinstance(error, (httpx.TransportError, requests.exceptions.ConnectionError)):
+        return 'Could not connect to Wikimedia. Please check your connection.'
+    if isinstance(error, (ValueError, KeyError)):
+        return f'Unexpected answer from Wikimedia: {error!r}'
+    return f'Could not cache flag: {error}'
@@ -0,0 +1,368 @@
+"""
+On-disk cache of flags: images in FLAGS_DIR, indexed by the cache manifest in FLAGS_LOG_DIR.
+Each flag is cached once at config.MASTER_WIDTH as FLAGS_DIR/<country>.png (its master),
+other widths are downscaled from it into FLAGS_DIR/<width>/<country>.png when first asked for.
+Flags rendered locally (see flag_finder.raster) also keep their original as FLAGS_DIR/svg/<country>.svg,
+their other widths are rendered from it instead
+"""
+import os
+import shutil
+import threading
+from ast import literal_eval
+from hashlib import sha3_256
+from time import time
+
+from PIL import Image
+
+from . import config
+from .flight import KeyedLock
+from .manifest import CacheManifest
+from .raster import RasterError, enabled as rasterizing, rasterize
+from .trace import span
+
+
+cache_locks = KeyedLock()  # files of one flag are written by one thread at a time, different flags at once
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest() -> CacheManifest:
+    """
+    Returns the cache manifest, opening it (and creating the cache directories) on first use.
+    A log file left by Flag-finder 1.2.0 and older is migrated into it then
+
+    :return: shared cache manifest
+    """
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            os.makedirs(config.FLAGS_LOG_DIR, exist_ok=True)
+            os.makedirs(config.FLAGS_DIR, exist_ok=True)
+            _manifest = CacheManifest(os.path.join(config.FLAGS_LOG_DIR, 'manifest.sqlite3'))
+            migrate_log(_manifest)
+    return _manifest
+
+
+def get_hash(file: str) -> str:
+    """
+    Returns SHA3-256 hex of a file, given its path. The file is read in chunks, never whole
+
+    :param file: to-be-hashed file's path
+    :return: hex hash of file
+    """
+    file_hash = sha3_256()
+    with span('cache.hash'), open(file, 'rb') as f:
+        while chunk := f.read(config.HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def migrate_log(manifest: CacheManifest) -> None:
+    """
+    Moves the records of a log file, written by Flag-finder 1.2.0 and older, into the cache manifest,
+    then deletes it. Records of a log file whose hash doesn't match log_hash are dropped, as they were before
+
+    :param manifest: cache manifest being opened
+    """
+    log_path = os.path.join(config.FLAGS_LOG_DIR, 'log')
+    log_hash_path = os.path.join(config.FLAGS_LOG_DIR, 'log_hash')
+    if not os.path.exists(log_path):
+        return
+
+    if os.path.exists(log_hash_path):
+        with open(log_hash_path) as log_hash:
+            intact = get_hash(log_path) == log_hash.read()
+        if intact:
+            with span('cache.migrate_log'), open(log_path) as log:
+                for country, (cached, img_hash) in literal_eval(log.read()).items():
+                    if os.path.exists(os.path.join(config.FLAGS_DIR, f'{country}.png')):
+                        manifest.put(country, cached=cached, hash=img_hash)
+        os.remove(log_hash_path)
+    os.remove(log_path)
+
+
+def cache_flag(country: str, img: bytes, **metadata) -> None:
+    """
+    Store image of selected countries' flags in %AppData%\\Roaming\\Flags,
+    and record when they were cached and hash of stored images in the cache manifest
+
+    :param country: name of country's flag to be cached
+    :param img: content of img file in bytes
+    :param metadata: other fields to record in the cache manifest, e.g. where and with which validators img was fetched
+    """
+    get_manifest()  # opened first, as it creates the cache directories
+    with span('cache.evict'):
+        make_room(len(img), keep=country)
+    img_path = os.path.join(config.FLAGS_DIR, f'{country}.png')
+    # write next to the real file then swap it in, so a reader never sees a half-written image
+    tmp_path = temporary_path(img_path)
+    with span('cache.write', bytes=len(img)), open(tmp_path, 'wb') as image:
+        image.write(img)
+
+    with span('cache.hash'):
+        img_hash = sha3_256(img).hexdigest()
+    install_flag(country, tmp_path, img_hash, **metadata)
+
+
+def install_flag(country: str, tmp_path: str, img_hash: str, **metadata) -> None:
+    """
+    Swaps an image written next to a country's cached flag (see temporary_path) in for it,
+    and records it in the cache manifest, see cache_flag. Downscaled copies of a flag that changed are deleted
+
+    :param country: name of country's flag to be cached
+    :param tmp_path: path to the image, room for it must have been made (see make_room)
+    :param img_hash: SHA3-256 hex of the image
+    :param metadata: other fields to record in the cache manifest, e.g. where and with which validators img was fetched
+    """
+    manifest = get_manifest()
+    img_path = os.path.join(config.FLAGS_DIR, f'{country}.png')
+    with span('cache.manifest'), cache_locks(country):
+        os.replace(tmp_path, img_path)
+        stat = os.stat(img_path)
+        previous = manifest.get(country)
+        manifest.put(country,
+                     cached=int(time()),
+                     hash=img_hash,
+                     size=stat.st_size,
+                     mtime=stat.st_mtime_ns,
+                     verified=int(time()),
+                     **metadata)
+        if previous and previous['hash'] != img_hash:
+            for variant in manifest.variants(country):
+                delete_variant(country, variant['width'])
+
+
+def temporary_path(path: str) -> str:
+    """
+    Returns where to write a file of the cache before swapping it in at path: unique to this process and thread,
+    as the daemon and every instance on this host share the cache
+
+    :param path: path to the file once written
+    :return: path to write it to, <path>.<pid>.<thread id>.tmp
+    """
+    return f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+
+def original_path(country: str) -> str:
+    """
+    Returns where the original .svg file of a country's flag is cached
+
+    :param country: name of country
+    :return: path to the original, which may not exist
+    """
+    return os.path.normpath(os.path.join(config.FLAGS_DIR, 'svg', f'{country}.svg'))
+
+
+def cache_original(country: str, svg: bytes, source: str, **validators) -> None:
+    """
+    Store the original .svg file of a country's flag, and record it in the cache manifest
+
+    :param country: name of country's flag
+    :param svg: content of the .svg file
+    :param source: link the file was downloaded from
+    :param validators: etag and modified, headers of the download
+    """
+    manifest = get_manifest()
+    make_room(len(svg), keep=country)
+    svg_path = original_path(country)
+    os.makedirs(os.path.dirname(svg_path), exist_ok=True)
+    tmp_path = temporary_path(svg_path)
+    with open(tmp_path, 'wb') as file:
+        file.write(svg)
+    with cache_locks(country):
+        os.replace(tmp_path, svg_path)
+        manifest.put_original(country, source, sha3_256(svg).hexdigest(), len(svg), int(time()), **validators)
+
+
+def delete_original(country: str) -> int:
+    """
+    Deletes the original .svg file of a country's flag and its record
+
+    :param country: name of country
+    :return: number of bytes freed
+    """
+    svg_path = original_path(country)
+    with cache_locks(country):
+        try:
+            freed = os.stat(svg_path).st_size
+            os.remove(svg_path)
+        except FileNotFoundError:
+            freed = 0
+        get_manifest().delete_original(country)
+    return freed
+
+
+def get_cache(country: str, max_age: float | None = None) -> str | None:
+    """
+    Returns path to image in cache if available and image is less than max_age seconds old,
+    or returns None otherwise.
+    The image is only hashed again if its size or modification time changed since it was last hashed,
+    or if that was more than config.VERIFY_INTERVAL seconds ago, otherwise checking it costs a single stat
+
+    :param country: name of country to return the cached flag of
+    :param max_age: maximum age of image (in seconds), config.CACHE_EXPIRY if None, math.inf to return it however old it is
+    :return: path to image in cache | None
+    """
+    img_path = os.path.join(config.FLAGS_DIR, f'{country}.png')
+
+    # if country not in cache manifest | flag image older than max_age | .png of flag not exists: None
+    with span('cache.lookup'):
+        cached = get_manifest().get(country)
+    if max_age is None:
+        max_age = config.CACHE_EXPIRY
+    if not (cached and int(time()) - cached['cached'] <= max_age):
+        return None
+    try:
+        stat = os.stat(img_path)
+    except FileNotFoundError:
+        return None
+
+    # if .png of flag changed or is due for verification, and hash of image is not equal to recorded hash: None
+    if (stat.st_size, stat.st_mtime_ns) != (cached['size'], cached['mtime']) \
+            or int(time()) - (cached['verified'] or 0) >= config.VERIFY_INTERVAL:
+        if get_hash(img_path) != cached['hash']:
+            return None
+        get_manifest().put(country, size=stat.st_size, mtime=stat.st_mtime_ns, verified=int(time()))
+
+    return os.path.normpath(img_path)
+
+
+def variant_path(country: str, width: int) -> str:
+    """
+    Returns where the copy of a country's flag downscaled to width is cached
+
+    :param country: name of country
+    :param width: width of the copy
+    :return: path to the copy, which may not exist
+    """
+    return os.path.normpath(os.path.join(config.FLAGS_DIR, str(width), f'{country}.png'))
+
+
+def get_variant(country: str, width: int, master_path: str, use: bool = True) -> str:
+    """
+    Returns path to the flag of a country at the given width, downscaling its master if no such copy is cached yet.
+    A copy is made again if the master changed since, or if its file changed size.
+    Flags are never upscaled: if the master isn't wider than width, the master itself is returned.
+    A flag with a cached original .svg is rendered from it at width instead, wider than its master if need be
+
+    :param country: name of country
+    :param width: wanted width, aspect ratio preserved
+    :param master_path: path to the country's master, as returned by get_cache
+    :param use: whether the copy counts as used for eviction
+    :return: path to cached image
+    :raises OSError: if the master could not be read or the copy could not be written
+    """
+    manifest = get_manifest()
+    master = manifest.get(country)
+    variant = manifest.get_variant(country, width)
+    img_path = variant_path(country, width)
+    if master and variant and variant['master_hash'] == master['hash']:
+        try:
+            if os.stat(img_path).st_size == variant['size']:
+                if use:
+                    manifest.touch(country, width)
+                return img_path
+        except FileNotFoundError:
+            pass
+
+    rendered = None
+    if rasterizing() and manifest.get_original(country):
+        try:
+            with open(original_path(country), 'rb') as file:
+                svg = file.read()
+            with span('variant.rasterize', width=width):
+                rendered = rasterize(svg, width)
+        except (OSError, RasterError):
+            pass  # downscaled from the master instead
+
+    if rendered is None:
+        with span('variant.downscale', width=width), Image.open(master_path) as image:
+            if width >= image.width:
+                return master_path
+            variant_img = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+
+    # rough upper bound of the PNG's size, never needs to be exact
+    make_room(len(rendered) if rendered else variant_img.width * variant_img.height, keep=country)
+    os.makedirs(os.path.dirname(img_path), exist_ok=True)
+    tmp_path = temporary_path(img_path)
+    with span('variant.write', width=width):
+        if rendered:
+            with open(tmp_path, 'wb') as file:
+                file.write(rendered)
+        else:
+            variant_img.save(tmp_path, 'PNG')
+    with cache_locks(country):
+        os.replace(tmp_path, img_path)
+        manifest.put_variant(country, width, master['hash'] if master else '', os.stat(img_path).st_size, int(time()))
+    return img_path
+
+
+def delete_variant(country: str, width: int) -> int:
+    """
+    Deletes a downscaled copy of a country's flag and its record
+
+    :param country: name of country
+    :param width: width of the copy
+    :return: number of bytes freed
+    """
+    img_path = variant_path(country, width)
+    with cache_locks(country):  # not while the copy is being swapped in
+        try:
+            freed = os.stat(img_path).st_size
+            os.remove(img_path)
+        except FileNotFoundError:
+            freed = 0
+        get_manifest().delete_variant(country, width)
+    return freed
+
+
+def delete_flag(country: str) -> int:
+    """
+    Deletes a country's cached flag, its downscaled copies, its original and their records
+
+    :param country: name of country
+    :return: number of bytes freed
+    """
+    manifest = get_manifest()
+    img_path = os.path.join(config.FLAGS_DIR, f'{country}.png')
+    with cache_locks(country):
+        freed = sum(delete_variant(country, variant['width']) for variant in manifest.variants(country))
+        freed += delete_original(country)
+        try:
+            freed += os.stat(img_path).st_size
+            os.remove(img_path)
+        except FileNotFoundError:
+            pass
+        manifest.delete(country)
+    return freed
+
+
+def make_room(needed: int, keep: str | None = None) -> int:
+    """
+    Evicts what is least worth keeping (see config.EVICTION_POLICY) until needed more bytes fit in both
+    config.DISK_BUDGET and the disk space left above config.MIN_FREE_SPACE.
+    Downscaled copies go first, as they are made again from their master for free, while a master has to be fetched again.
+    Masters are only evicted to stay within the budget, running out of disk space is not the cache's fault
+
+    :param needed: number of bytes about to be written
+    :param keep: name of country whose flag is being written, never evicted
+    :return: number of bytes freed
+    """
+    manifest = get_manifest()
+    over_budget = manifest.total_size() + needed - config.DISK_BUDGET if config.DISK_BUDGET else 0
+    shortfall = max(over_budget, needed + config.MIN_FREE_SPACE - shutil.disk_usage(config.FLAGS_DIR).free)
+    freed = 0
+    if shortfall <= 0:
+        return freed
+
+    for variant in manifest.variants(policy=config.EVICTION_POLICY):
+        if freed >= shortfall:
+            return freed
+        freed += delete_variant(variant['country'], variant['width'])
+
+    for record in manifest.records(config.EVICTION_POLICY):
+        if freed >= over_budget:
+            break
+        if record['country'] != keep:
+            freed += delete_flag(record['country'])
+    return freed
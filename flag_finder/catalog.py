@@ -0,0 +1,149 @@
+"""
+Catalog of flags that can be fetched, mapping their names to their files on Wikimedia Commons
+"""
+import mmap
+import os
+import threading
+
+from . import config
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+class FlagCatalog:
+    """
+    Catalog of flags that can be looked up: display name -> title of its file on Wikimedia Commons.
+    Read from a UTF-8 file with one "name<TAB>title" line per flag, sorted by bytes, memory-mapped on first use:
+    looking up a title is a binary search through the mapped file, so nothing is parsed or loaded at startup
+    however many flags the catalog holds
+
+    :param paths: catalog files, the first one that exists is used
+    :type paths: str
+    """
+    def __init__(self, *paths: str):
+        self.paths = paths
+        self._map = None
+        self._lock = threading.Lock()
+
+    def names(self) -> list[str]:
+        """
+        Returns names of all flags in the catalog
+        """
+        return [line.split(b'\t', 1)[0].decode() for line in self._mapped()[:].splitlines() if line]
+
+    def title(self, name: str) -> str | None:
+        """
+        Returns title of the file of a flag on Wikimedia Commons, or None if the catalog doesn't have it
+
+        :param name: name of flag
+        :return: e.g. 'File:Flag of the Bahamas.svg' | None
+        """
+        mapped = self._mapped()
+        key = f'{name}\t'.encode()
+        start, end = 0, len(mapped)
+        while start < end:
+            middle = (start + end) // 2
+            line_start = mapped.rfind(b'\n', 0, middle) + 1
+            line_end = mapped.find(b'\n', middle)
+            if line_end < 0:
+                line_end = len(mapped)
+
+            line = mapped[line_start:line_end]
+            if line.startswith(key):
+                return line[len(key):].rstrip(b'\r').decode()
+            if line < key:
+                start = line_end + 1
+            else:
+                end = line_start
+        return None
+
+    def _mapped(self) -> mmap.mmap | bytes:
+        with self._lock:
+            if self._map is None:
+                path = next(path for path in self.paths if os.path.exists(path))
+                with open(path, 'rb') as file:
+                    # an empty file can't be mapped
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+            return self._map
+
+
+def get_catalog() -> FlagCatalog:
+    """
+    Returns the catalog of flags: the one rebuilt by build_catalog if there is one, or the one shipped with the package
+
+    :return: shared catalog
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = FlagCatalog(os.path.join(config.FLAGS_LOG_DIR, 'catalog.tsv'), config.CATALOG_PATH)
+    return _catalog
+
+
+def commons_title(country: str) -> str:
+    """
+    Returns title of the file of a country's flag on Wikimedia Commons
+
+    :param country: name of country (or any flag in the catalog)
+    :return: title from the catalog, or 'File:Flag of <country>.svg' if the catalog doesn't have it
+    """
+    return get_catalog().title(country) or f'File:Flag of {country}.svg'
+
+
+def valid_name(name: str) -> bool:
+    """
+    Returns whether a name can be the name of a flag: names are also names of cached and exported images,
+    so they can't have characters forbidden in file names, nor lead out of the directory they are written into
+
+    :param name: name of flag
+    """
+    return bool(name) and name not in ('.', '..') and not any(char in name for char in '<>:"/\\|?*\t')
+
+
+def build_catalog(categories: list[str] | tuple[str, ...], path: str) -> int:
+    """
+    Rebuild the catalog of flags from the files in Wikimedia Commons categories (not their subcategories).
+    A file's name in the catalog is its title without "File:", "Flag of" and "the", e.g. 'File:Flag of The Gambia.svg' -> 'Gambia'
+
+    :param categories: titles of categories, e.g. 'Category:SVG sovereign state flags'
+    :param path: where to write the catalog
+    :return: number of flags in the catalog
+    :raises requests.exceptions.RequestException: if an API call failed
+    """
+    from .scheduler import priority
+    from .session import get_session  # imports requests, which looking flags up in the catalog never needs
+
+    titles = {}
+    with priority('maintenance'):  # behind flags shown in a window, see flag_finder.scheduler
+        for category in categories:
+            param_api = {'action': 'query',
+                         'format': 'json',
+                         'list': 'categorymembers',
+                         'cmtitle': category,
+                         'cmtype': 'file',
+                         'cmlimit': 'max'}
+            while True:
+                re = get_session().get(config.API_URL,
+                                       timeout=(config.CONNECT_TIMEOUT, config.READ_TIMEOUT),
+                                       params=param_api)
+                re.raise_for_status()
+                json = re.json()
+
+                for member in json['query']['categorymembers']:
+                    name = member['title'].removeprefix('File:').rsplit('.', 1)[0].removeprefix('Flag of ')
+                    name = name.removeprefix('the ').removeprefix('The ')
+                    if valid_name(name):
+                        titles.setdefault(name, member['title'])
+
+                if 'continue' not in json:
+                    break
+                param_api.update(json['continue'])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.writelines(sorted(f'{name}\t{title}\n'.encode() for name, title in titles.items()))
+    os.replace(tmp_path, path)
+    return len(titles)
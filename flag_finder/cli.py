@@ -0,0 +1,159 @@
+"""
+Command line of the fetch and cache engine, usable without a display:
+
+    python -m flag_finder export --countries France Japan --out flags --size 320
+    python -m flag_finder prefetch
+    python -m flag_finder catalog [CATEGORY ...]
+    python -m flag_finder scrub
+    python -m flag_finder pack --out flags.pack --size 700
+    python -m flag_finder serve
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from time import perf_counter
+
+from . import config
+from .catalog import build_catalog, get_catalog, valid_name
+from .daemon import serve
+from .export import export_flags
+from .fetch import prefetch_flags, prefetch_report, shutdown
+from .pack import build_pack
+from .scrub import scrub, scrub_report
+from .settings import apply_settings, settings_parser
+
+
+def country_name(name: str) -> str:
+    """
+    Type of arguments that are names of countries, see flag_finder.catalog.valid_name
+
+    :param name: argument
+    :return: name
+    :raises argparse.ArgumentTypeError: if the name can't be the name of a flag
+    """
+    if not valid_name(name):
+        raise argparse.ArgumentTypeError(f'invalid name: {name!r}')
+    return name
+
+
+def export(args: argparse.Namespace) -> int:
+    """
+    Exports flags into a directory, printing one "OK|FAILED<TAB>country<TAB>path|error" line per flag as it finishes
+
+    :param args: parsed arguments of the export command
+    :return: exit status: 0 if every flag was exported, 1 otherwise
+    """
+    countries = get_catalog().names() if args.all else args.countries
+    statuses = []
+    start = perf_counter()
+    for country, path, error in export_flags(countries, args.out, args.size, args.workers):
+        statuses.append({'country': country, 'status': 'failed' if error else 'ok', 'path': path, 'error': error})
+        print(f'{"FAILED" if error else "OK"}\t{country}\t{error or path}', flush=True)
+
+    elapsed = perf_counter() - start
+    exported = sum(status['status'] == 'ok' for status in statuses)
+    print(f'Exported {exported}/{len(statuses)} flags in {elapsed:.1f}s '
+          f'({exported / elapsed if elapsed else 0:.1f} flags/sec)', file=sys.stderr)
+
+    if args.report:
+        with open(args.report, 'w') as report:
+            json.dump(statuses, report, indent=2)
+    return 0 if exported == len(statuses) else 1
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    Runs the command line
+
+    :param argv: arguments, sys.argv[1:] if None
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(prog='flag-finder',
+                                     description='Fetch flags from Wikimedia Commons into a local cache, without a window')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_export = commands.add_parser('export', parents=[settings_parser()],
+                                        help='write flags into a directory, fetching the ones not cached yet')
+    countries = parser_export.add_mutually_exclusive_group(required=True)
+    countries.add_argument('--countries', nargs='+', type=country_name, metavar='NAME', help='names of flags to export, as in the catalog')
+    countries.add_argument('--all', action='store_true', help='export every flag in the catalog')
+    parser_export.add_argument('--out', required=True, help='directory to write flags into')
+    parser_export.add_argument('--size', type=int, help=f'flags\' width in pixels (default: {config.MASTER_WIDTH}, as cached)')
+    parser_export.add_argument('--report', metavar='PATH', help='also write the per-flag status report as JSON')
+
+    commands.add_parser('prefetch', parents=[settings_parser()], help='cache flags of every flag in the catalog')
+
+    parser_catalog = commands.add_parser('catalog', parents=[settings_parser()],
+                                         help='rebuild the catalog of flags from Wikimedia Commons categories')
+    parser_catalog.add_argument('categories', nargs='*', metavar='CATEGORY', default=config.CATALOG_CATEGORIES,
+                                help=f'titles of categories (default: {", ".join(config.CATALOG_CATEGORIES)})')
+
+    parser_scrub = commands.add_parser('scrub', parents=[settings_parser()],
+                                       help='check every cached flag, delete corrupt, orphaned and idle files, '
+                                            'evict flags beyond the disk budget')
+    parser_scrub.add_argument('--pause', type=float, default=config.SCRUB_PAUSE,
+                              help=f'seconds to sleep after each file (default: {config.SCRUB_PAUSE})')
+
+    parser_pack = commands.add_parser('pack', parents=[settings_parser()],
+                                      help='build a flag pack out of every flag in the cache, e.g. after prefetch')
+    parser_pack.add_argument('--out', metavar='PATH', help='where to write the pack (default: the --pack path)')
+    parser_pack.add_argument('--size', type=int, help=f'flags\' width in pixels (default: {config.MASTER_WIDTH}, as cached)')
+
+    parser_serve = commands.add_parser('serve', parents=[settings_parser()],
+                                       help='serve the cache to every instance on this host until interrupted')
+    parser_serve.add_argument('--port', type=int, default=0, help='port to listen on (default: any free port)')
+    parser_serve.add_argument('--hot-cache-mb', type=int, default=config.DAEMON_HOT_CACHE // 2 ** 20,
+                              help='memory kept for recently served flags '
+                                   f'(default: {config.DAEMON_HOT_CACHE // 2 ** 20})')
+
+    args = parser.parse_args(argv)
+    apply_settings(args)
+    try:
+        if args.command == 'export':
+            return export(args)
+
+        if args.command == 'prefetch':
+            report = prefetch_report(*prefetch_flags(get_catalog().names(),
+                                                     args.workers,
+                                                     lambda done, total: print(f'\rPrefetching flags: {done}/{total}',
+                                                                               end='', flush=True)))
+            print(f'\n{report}')
+            return 0
+
+        if args.command == 'scrub':
+            config.SCRUB_PAUSE = args.pause
+            report = scrub_report(*scrub(progress=lambda checked, reclaimed: print(f'\rScrubbing cache: {checked} files',
+                                                                                   end='', flush=True)))
+            print(f'\n{report}')
+            return 0
+
+        if args.command == 'pack':
+            path = args.out or config.PACK_PATH
+            packed, size = build_pack(path,
+                                      args.size,
+                                      lambda done, total: print(f'\rPacking flags: {done}/{total}', end='', flush=True))
+            print(f'\nPacked {packed} flags ({size / 2 ** 20:.1f} MB) in {path}')
+            return 0
+
+        if args.command == 'serve':
+            try:
+                server = serve(args.port, args.hot_cache_mb * 2 ** 20)
+            except RuntimeError as error:
+                print(error, file=sys.stderr)
+                return 1
+            try:
+                print(f'Serving the cache at http://127.0.0.1:{server.server_address[1]}, press Ctrl+C to stop', flush=True)
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.stop()
+            return 0
+
+        path = os.path.join(config.FLAGS_LOG_DIR, 'catalog.tsv')
+        print(f'Cataloged {build_catalog(args.categories, path)} flags in {path}')
+        return 0
+    finally:
+        shutdown()
@@ -0,0 +1,57 @@
+"""
+Settings of the fetch and cache engine
+Every setting is a module attribute read when it is needed, not when the package is imported,
+so a caller (e.g. the command line) can change them before the first fetch
+"""
+import os
+
+
+# Where cached flags and their metadata are stored. The environment variables only exist on Windows,
+# other systems (e.g. headless render nodes) get the usual per-user cache directories
+FLAGS_LOG_DIR = os.path.join(os.getenv('LocalAppData') or os.path.expanduser(os.path.join('~', '.cache')), 'Flags')
+FLAGS_DIR = os.path.join(os.getenv('AppData') or os.path.expanduser(os.path.join('~', '.local', 'share')), 'Flags')
+
+API_URL = 'https://commons.wikimedia.org/w/api.php'
+API_TITLES_LIMIT = 50  # maximum number of titles in one query accepted by MediaWiki API
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:96.0) Gecko/20100101 Firefox/96.0'}
+IMG_WIDTH = 700  # width flags are shown at, aspect ratio preserved
+MASTER_WIDTH = 1920  # width flags are fetched and cached at, every smaller width is downscaled locally from it
+SVG_MASTERS = False  # whether flags are downloaded as .svg and rendered locally (needs cairosvg), see flag_finder.raster
+RASTER_WORKERS = 0  # processes rendering .svg files, 0 for one per CPU
+HASH_CHUNK_SIZE = 2 ** 20  # files are hashed this many bytes at a time
+CACHE_EXPIRY = 604800  # seconds after which a cached flag is revalidated with Wikimedia
+RESOLUTION_EXPIRY = 2592000  # seconds after which a flag's file and thumbnail link are looked up again with the API
+
+# flag pack read before the cache and the network if it exists, see flag_finder.pack
+PACK_PATH = os.path.join(FLAGS_LOG_DIR, 'flags.pack')
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.tsv')
+CATALOG_CATEGORIES = ('Category:SVG sovereign state flags',
+                      'Category:SVG flags of dependent territories',
+                      'Category:SVG historical flags')
+
+CONNECT_TIMEOUT = 3.05  # seconds to wait for a connection to Wikimedia
+READ_TIMEOUT = 5  # seconds to wait for Wikimedia to send data once connected
+RETRIES = 3  # times a timed out or failed (429, 5xx) request to Wikimedia is retried
+UPSTREAM_RATE = 10  # requests per second sent to Wikimedia at most, lowered for a while by 429 responses, 0 for no limit
+UPSTREAM_BURST = 10  # requests that may be sent at once after an idle period
+HOST_CONCURRENCY = 6  # requests in flight per Wikimedia host at most
+ASYNC_BATCHES = True  # whether batches of flags are fetched on an asyncio event loop if httpx is installed, see flag_finder.batch
+HTTP2 = True  # whether batches are fetched over HTTP/2 if h2 is installed too
+STREAM_CHUNK_SIZE = 2 ** 16  # bytes of a streamed image written to its cache file at a time
+POOL_SIZE = 12  # connections kept alive per host, should be at least the number of threads fetching at once
+VERIFY_INTERVAL = 86400  # seconds after which a cached flag is hashed again even if its size and mtime are unchanged
+MIN_FREE_SPACE = 2 ** 28  # bytes of disk space kept free by deleting downscaled flags before writing one
+DISK_BUDGET = 2 ** 30  # bytes the cache may take, least worth keeping flags are evicted beyond it, 0 for no limit
+EVICTION_POLICY = 'lru'  # which flags are least worth keeping: 'lru' least recently used, 'lfu' least frequently used
+MAX_IDLE = 7776000  # seconds after which a flag not used since is deleted by the scrubber, 0 to keep it
+SCRUB_INTERVAL = 86400  # seconds between two scrubs of the cache started by the window
+SCRUB_PAUSE = 0.005  # seconds the scrubber sleeps after each file, so it never competes with fetches for the disk
+SPECULATE_MATCHES = 5  # flags are fetched ahead once what is typed matches at most this many of them
+SPECULATE_TOP_N = 3  # number of best matches fetched ahead, 0 to never fetch ahead
+SPECULATE_BANDWIDTH = 2 ** 18  # bytes per second fetching ahead may download at most, averaged over each flag
+USE_DAEMON = True  # whether flags are got from the cache daemon running on this host, if any, see flag_finder.daemon
+DAEMON_TIMEOUT = 60  # seconds to wait for the daemon, which may be fetching the flag from Wikimedia
+DAEMON_RETRY = 30  # seconds flags are got without the daemon after it could not be reached
+DAEMON_HOT_CACHE = 2 ** 26  # bytes of recently served flags the daemon keeps in memory
+TRACE_LOG = None  # path of a file every traced operation (e.g. showing a flag) is appended to as a line of JSON, if set
@@ -0,0 +1,346 @@
+"""
+Cache daemon: one process per host owning the cache, serving flags to every instance over HTTP on 127.0.0.1,
+so that a flag is fetched from Wikimedia once per host and hot flags stay in memory for every client.
+Instances get flags, fetch them ahead, revalidate and prefetch them through the daemon while it runs.
+A running daemon is found through its discovery file, FLAGS_LOG_DIR/daemon.json:
+
+    GET /flag/<country>?width=<width>&priority=<priority>&use=0|1
+                                        PNG of the flag, its .svg file's name in X-Wiki-File and its path in X-Path
+    POST /prefetch                      JSON {"countries": [...], "workers": n}, answered with a line of JSON
+                                        {"done", "total"} per flag processed, then {"cached", "failed", "elapsed"}
+    GET /status                         JSON: pid, port, hot flags and their hit rate, requests to Wikimedia
+    GET /metrics                        JSON: see flag_finder.trace.metrics
+"""
+import http.client
+import json
+import os
+import threading
+from collections import OrderedDict
+from time import time
+from urllib.parse import parse_qs, quote, unquote, urlencode, urlparse
+
+from . import config
+
+
+_down_until = 0  # when to look for the daemon again after it could not be reached
+_serving = False  # whether this process is the daemon, which never asks itself
+
+
+class DaemonError(Exception):
+    """
+    Raised when a daemon couldn't get a flag, the message is meant to be shown to user
+    """
+
+
+class HotFlags:
+    """
+    In-memory LRU cache of flags' PNGs, bounded by their size
+
+    :param budget: maximum memory taken by cached PNGs (in bytes)
+    :type budget: int
+    """
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # (country, width) -> (PNG, name of .svg file, path, when the flag was cached), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> tuple | None:
+        """
+        Returns the flag cached under key and marks it as most recently used, or None if it isn't cached
+
+        :param key: (country, width)
+        :return: PNG, name of .svg file, path to cached image and when it was cached | None
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: tuple, value: tuple) -> None:
+        """
+        Caches a flag under key, evicting the least recently used flags until all of them fit in the budget
+
+        :param key: (country, width)
+        :param value: PNG, name of .svg file, path to cached image and when it was cached,
+                      a PNG larger than the whole budget isn't cached
+        """
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key)[0])
+            if len(value[0]) > self.budget:
+                return
+            self._entries[key] = value
+            self.size += len(value[0])
+            while self.size > self.budget:
+                self.size -= len(self._entries.popitem(last=False)[1][0])
+
+    def stats(self) -> dict:
+        """
+        Returns the cache's usage
+
+        :return: number of flags, bytes taken, budget, hits and misses
+        """
+        with self._lock:
+            return {'flags': len(self._entries), 'bytes': self.size, 'budget': self.budget,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def discovery_path() -> str:
+    """
+    Returns the path of the file a running daemon advertises its port in
+    """
+    return os.path.join(config.FLAGS_LOG_DIR, 'daemon.json')
+
+
+def daemon_port() -> int | None:
+    """
+    Returns the port of the daemon running on this host, if any and if config.USE_DAEMON, unless this process is it
+
+    :return: port | None
+    """
+    if not config.USE_DAEMON or _serving or time() < _down_until:
+        return None
+    try:
+        with open(discovery_path()) as file:
+            return json.load(file)['port']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def fetch_from_daemon(country: str, width: int | None = None, use: bool = True) -> tuple[bytes, str, str] | None:
+    """
+    Gets a flag from the daemon running on this host, see flag_finder.fetch.get_flag.
+    The daemon fetches it (if need be) at the priority of this thread
+
+    :param country: name of country to get flag of
+    :param width: flag's width (aspect ratio preserved), or None for the widest one cached
+    :param use: whether the flag counts as used for eviction, False when it is only warmed up in case it gets used
+    :return: PNG, name of .svg file and path to cached image, or None if no daemon could be reached
+    :raises DaemonError: if the daemon couldn't get the flag, with a message to show to user
+    """
+    from .scheduler import current_priority
+
+    global _down_until
+    port = daemon_port()
+    if port is None:
+        return None
+
+    query = {'priority': current_priority(), 'use': int(use)}
+    if width is not None:
+        query['width'] = width
+    path = f'/flag/{quote(country)}?{urlencode(query)}'
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=config.DAEMON_TIMEOUT)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        body = response.read()
+    except OSError:
+        # The daemon stopped without removing its discovery file, or is stuck: get flags without it for a while
+        _down_until = time() + config.DAEMON_RETRY
+        return None
+    finally:
+        connection.close()
+
+    if response.status != 200:
+        raise DaemonError(body.decode(errors='replace'))
+    return body, unquote(response.getheader('X-Wiki-File', '')), unquote(response.getheader('X-Path', ''))
+
+
+def prefetch_on_daemon(countries: list[str] | tuple[str, ...], max_workers: int = 8,
+                       progress=None) -> tuple[int, list[str], float] | None:
+    """
+    Has the daemon running on this host warm the cache with the flags of countries, see flag_finder.fetch.prefetch_flags
+
+    :param countries: names of countries to cache flag of
+    :param max_workers: maximum number of flags the daemon downloads at the same time
+    :param progress: called with (number of flags processed so far, number of flags to fetch) after each flag
+    :return: number of flags cached, names of countries whose flag could not be fetched, and elapsed time in seconds,
+             or None if no daemon could be reached (or it stopped before it was done)
+    :raises DaemonError: if the daemon refused the prefetch, with a message to show to user
+    """
+    global _down_until
+    port = daemon_port()
+    if port is None:
+        return None
+
+    body = json.dumps({'countries': list(countries), 'workers': max_workers}).encode()
+    # the timeout applies to each line, and a line is sent as each flag is processed
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=config.DAEMON_TIMEOUT)
+    try:
+        connection.request('POST', '/prefetch', body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        if response.status != 200:
+            raise DaemonError(response.read().decode(errors='replace'))
+        for line in response:
+            message = json.loads(line)
+            if 'done' in message:
+                if progress:
+                    progress(message['done'], message['total'])
+            else:
+                return message['cached'], message['failed'], message['elapsed']
+    except (OSError, ValueError):
+        _down_until = time() + config.DAEMON_RETRY
+    finally:
+        connection.close()
+    return None  # the flags it didn't get to are prefetched without it
+
+
+def serve(port: int = 0, hot_bytes: int | None = None) -> 'ThreadingHTTPServer':
+    """
+    Starts serving the cache on 127.0.0.1, on a background thread, and advertises it in the discovery file.
+    Call stop() on the returned server to stop serving and remove the discovery file
+
+    :param port: port to listen on, 0 for any free port
+    :param hot_bytes: memory kept for the PNGs of recently served flags (in bytes), config.DAEMON_HOT_CACHE if None
+    :return: the server, whose server_address holds the port actually listened on
+    :raises RuntimeError: if a daemon is already serving this host's cache
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # slow to import, and only needed here
+
+    from .cache import get_manifest
+    from .catalog import valid_name
+    from .fetch import FetchError, get_flag, prefetch_flags
+    from .scheduler import PRIORITIES, get_scheduler, priority
+    from .trace import metrics
+
+    if (running := daemon_port()) is not None:
+        connection = http.client.HTTPConnection('127.0.0.1', running, timeout=1)
+        try:
+            connection.request('GET', '/status')
+            if connection.getresponse().status == 200:
+                raise RuntimeError(f'A daemon is already serving the cache on port {running}')
+        except OSError:
+            pass  # left behind by a daemon that didn't stop cleanly
+        finally:
+            connection.close()
+
+    hot = HotFlags(config.DAEMON_HOT_CACHE if hot_bytes is None else hot_bytes)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *_) -> None:
+            pass
+
+        def reply(self, status: int, body: bytes, content_type: str, **headers) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name.replace('_', '-'), value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            if url.path == '/status':
+                status = {'pid': os.getpid(), 'port': server.server_address[1], 'hot': hot.stats(),
+                          'upstream': get_scheduler().stats()}
+                self.reply(200, json.dumps(status).encode(), 'application/json')
+            elif url.path == '/metrics':
+                self.reply(200, json.dumps(metrics(), indent=2).encode(), 'application/json')
+            elif url.path.startswith('/flag/'):
+                query = parse_qs(url.query)
+                self.flag(unquote(url.path.removeprefix('/flag/')),
+                          query.get('width', [None])[0],
+                          query.get('priority', [PRIORITIES[0]])[0],
+                          query.get('use', ['1'])[0] != '0')
+            else:
+                self.reply(404, b'Not found', 'text/plain')
+
+        def do_POST(self) -> None:
+            if urlparse(self.path).path != '/prefetch':
+                self.reply(404, b'Not found', 'text/plain')
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                countries, workers = request['countries'], int(request.get('workers', 8))
+            except (ValueError, KeyError, TypeError):
+                self.reply(400, b'Expected {"countries": [...], "workers": n}', 'text/plain')
+                return
+            if invalid := next((country for country in countries if not valid_name(country)), None):
+                self.reply(400, f'Invalid name: {invalid}'.encode(), 'text/plain')
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()  # no Content-Length: the body ends when the connection closes
+
+            def send(message: dict) -> None:
+                try:
+                    self.wfile.write(json.dumps(message).encode() + b'\n')
+                    self.wfile.flush()
+                except OSError:
+                    pass  # the client is gone, the flags are still worth caching
+
+            with priority('maintenance'):
+                cached, failed, elapsed = prefetch_flags(countries, workers,
+                                                         lambda done, total: send({'done': done, 'total': total}))
+            send({'cached': cached, 'failed': failed, 'elapsed': elapsed})
+
+        def flag(self, country: str, width: str | None, name: str, use: bool) -> None:
+            if not valid_name(country):
+                self.reply(400, f'Invalid name: {country}'.encode(), 'text/plain')
+                return
+            try:
+                width = int(width) if width is not None else None
+            except ValueError:
+                self.reply(400, f'Invalid width: {width}'.encode(), 'text/plain')
+                return
+            if name not in PRIORITIES:
+                self.reply(400, f'Invalid priority: {name}'.encode(), 'text/plain')
+                return
+
+            cached = hot.get((country, width))
+            if cached and time() - cached[3] > config.CACHE_EXPIRY:
+                cached = None  # get_flag serves it while it is revalidated, and reads it again once it was
+            elif cached and use:
+                get_manifest().touch(country, width)
+            if cached is None:
+                try:
+                    with priority(name):
+                        img_path, wiki_file = get_flag(country, width, use)
+                    with open(img_path, 'rb') as file:
+                        img = file.read()
+                    record = get_manifest().get(country)
+                    cached = (img, wiki_file, img_path, record['cached'] if record else 0)
+                except (FetchError, OSError) as error:
+                    self.reply(502, str(error).encode(), 'text/plain; charset=utf-8')
+                    return
+                hot.put((country, width), cached)
+
+            img, wiki_file, img_path, _ = cached
+            self.reply(200, img, 'image/png', X_Wiki_File=quote(wiki_file), X_Path=quote(img_path))
+
+    global _serving
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    _serving = True
+
+    os.makedirs(config.FLAGS_LOG_DIR, exist_ok=True)
+    tmp_path = f'{discovery_path()}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'port': server.server_address[1], 'pid': os.getpid(), 'started': int(time())}, file)
+    os.replace(tmp_path, discovery_path())
+
+    def stop() -> None:
+        global _serving
+        server.shutdown()
+        server.server_close()
+        _serving = False
+        try:
+            with open(discovery_path()) as file:
+                advertised = json.load(file)['pid'] == os.getpid()
+            if advertised:  # unless another daemon took over since
+                os.remove(discovery_path())
+        except (OSError, ValueError, KeyError):
+            pass
+
+    server.stop = stop
+    threading.Thread(target=server.serve_forever, name='flag-daemon', daemon=True).start()
+    return server
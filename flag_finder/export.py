@@ -0,0 +1,69 @@
+"""
+Exporting flags from the cache into a directory, fetching the ones that aren't cached yet
+"""
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .batch import available, fetch_batch
+from .catalog import valid_name
+from .fetch import FetchError, get_flag
+from .scheduler import priority, set_priority
+from .trace import span, trace
+
+
+def export_flag(country: str, out_dir: str, size: int | None = None) -> str:
+    """
+    Writes flag of a country into out_dir as <country>.png
+
+    :param country: name of country to export flag of
+    :param out_dir: directory to write flag into, must exist
+    :param size: flag's width (aspect ratio preserved), or None to keep the cached width. Flags are never upscaled
+    :return: path to exported image
+    :raises FetchError: if the flag could not be fetched, with a message to show to user
+    """
+    with trace('export_flag', country=country, width=size):
+        img_path, _ = get_flag(country, size)
+        out_path = os.path.join(out_dir, f'{country}.png')
+        with span('export.copy'):
+            shutil.copyfile(img_path, out_path)
+    return out_path
+
+
+def export_flags(countries: list[str] | tuple[str, ...], out_dir: str, size: int | None = None, max_workers: int = 8):
+    """
+    Exports flags of many countries at once on a pool of max_workers threads, see export_flag.
+    Their requests are of the 'maintenance' priority, behind flags shown in a window (see flag_finder.scheduler).
+    Yields the outcome of each flag as soon as it is exported (in no particular order), a failed flag doesn't stop the others.
+    If httpx is installed, flags not cached yet are all fetched first on an asyncio event loop (see flag_finder.batch),
+    the pool then only copies (or downscales) cached flags
+
+    :param countries: names of countries to export flag of
+    :param out_dir: directory to write flags into, created if it doesn't exist
+    :param size: flags' width (aspect ratio preserved), or None to keep the cached width
+    :param max_workers: maximum number of flags exported at the same time
+    :return: generator of (country, path to exported image, None) | (country, None, error message)
+    """
+    for country in countries:
+        if not valid_name(country):  # would be written outside out_dir
+            yield country, None, f'Invalid name: {country}'
+    countries = [country for country in countries if valid_name(country)]
+
+    os.makedirs(out_dir, exist_ok=True)
+    if available():
+        with priority('maintenance'):
+            failed = fetch_batch(countries, max_workers)[1]
+        for country, error in failed.items():
+            yield country, None, error
+        countries = [country for country in countries if country not in failed]
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='flag-export',
+                            initializer=set_priority, initargs=('maintenance',)) as executor:
+        exports = {executor.submit(export_flag, country, out_dir, size): country for country in countries}
+        for future in as_completed(exports):
+            try:
+                yield exports[future], future.result(), None
+            except FetchError as error:
+                yield exports[future], None, str(error)
+            except OSError as error:
+                yield exports[future], None, f'Could not export image: {error}'
@@ -0,0 +1,578 @@
+"""
+Fetching flags from Wikimedia Commons into the cache
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+from math import inf
+from time import time, perf_counter
+
+import requests
+from PIL import Image
+
+from . import config, raster
+from .cache import get_cache, cache_flag, cache_original, get_manifest, get_variant, original_path
+from .catalog import commons_title, valid_name
+from .daemon import DaemonError, fetch_from_daemon, prefetch_on_daemon
+from .flight import SingleFlight
+from .pack import get_pack
+from .scheduler import priority, set_priority
+from .session import get_session
+from .trace import annotate, span
+
+
+_revalidator = None  # runs revalidations of expired flags, made on first use
+_revalidating = set()  # countries whose expired flag is being revalidated
+_revalidating_lock = threading.Lock()
+_in_flight = SingleFlight()  # concurrent fetches of the same flag share one request
+
+
+class FetchError(Exception):
+    """
+    Raised when a flag could not be fetched, the message is meant to be shown to user
+    """
+
+
+def shutdown() -> None:
+    """
+    Drops every revalidation that hasn't started yet and stops the rasterizing processes, e.g. when the program is closing
+    """
+    if _revalidator:
+        _revalidator.shutdown(wait=False, cancel_futures=True)
+    raster.shutdown()
+
+
+def conditional_headers(etag: str | None, last_modified: str | None) -> dict[str, str]:
+    """
+    Returns headers asking the server to answer 304 Not Modified instead of resending a response that hasn't changed
+
+    :param etag: ETag header of the cached response, if it had one
+    :param last_modified: Last-Modified header of the cached response, if it had one
+    :return: If-None-Match and If-Modified-Since headers
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def download_flag(country: str, source: str, **metadata) -> None:
+    """
+    Download a flag's thumbnail into the cache. If the cached image came from the same thumbnail,
+    it is revalidated instead: an unchanged thumbnail (304 Not Modified) only refreshes when it was cached.
+    Callers downloading the same thumbnail at the same time share a single download
+
+    :param country: name of country's flag to be downloaded
+    :param source: thumbnail's link
+    :param metadata: other fields to record in the cache manifest
+    :raises requests.exceptions.RequestException: if the download failed
+    """
+    _in_flight.do(('download', country, source), _download_flag, country, source, metadata)
+
+
+def _download_flag(country: str, source: str, metadata: dict) -> None:
+    cached = get_manifest().get(country)
+    headers = {}
+    if cached and cached['source'] == source and get_cache(country, max_age=inf):
+        headers = conditional_headers(cached['img_etag'], cached['img_modified'])
+
+    with span('fetch.download', conditional=bool(headers)):
+        re = get_session().get(source,
+                               timeout=(config.CONNECT_TIMEOUT, config.READ_TIMEOUT),
+                               headers=headers)
+    if re.status_code == 304:
+        get_manifest().put(country, cached=int(time()), **metadata)
+        return
+
+    re.raise_for_status()
+    cache_flag(country,
+               re.content,
+               source=source,
+               img_etag=re.headers.get('ETag'),
+               img_modified=re.headers.get('Last-Modified'),
+               **metadata)
+
+
+def thumbnail_template(source: str, width: int | None) -> str:
+    """
+    Returns a thumbnail's link with its width replaced by {width}, so that it can link to the thumbnail at any width
+
+    :param source: link of the thumbnail, e.g. '.../thumb/a/ab/Flag_of_X.svg/1920px-Flag_of_X.svg.png'
+    :param width: width of the thumbnail
+    :return: e.g. '.../thumb/a/ab/Flag_of_X.svg/{width}px-Flag_of_X.svg.png', or source itself if its width isn't in it
+             (e.g. a raster file narrower than the width asked for is linked to as is)
+    """
+    head, sep, tail = source.rpartition(f'/{width}px-')
+    return f'{head}/{{width}}px-{tail}' if sep else source
+
+
+def thumbnail_source(resolution: dict, width: int | None = None) -> str:
+    """
+    Returns the link of a resolved flag's thumbnail at a given width
+
+    :param resolution: what the API resolved the flag to, see resolve_flag
+    :param width: width of the thumbnail, config.MASTER_WIDTH if None
+    :return: link of the thumbnail
+    """
+    return resolution['template'].replace('{width}', str(width or config.MASTER_WIDTH))
+
+
+def file_name(country: str) -> str:
+    """
+    Returns the name of the file of a country's flag on Wikimedia Commons, as resolved by the API if it ever was
+
+    :param country: name of country
+    :return: e.g. 'Flag_of_the_Bahamas.svg'
+    """
+    resolution = get_manifest().get_resolution(country)
+    if resolution:
+        return resolution['pageimage']
+    return commons_title(country).removeprefix('File:').replace(' ', '_')
+
+
+def _resolution(page: dict, headers: dict) -> dict:
+    # json dict navigating, page's format:
+    # {
+    #   "pageid": pageid_number,
+    #   "ns": 6,
+    #   "title": <title of country in catalog>,
+    #   "thumbnail": {
+    #     "source": <image link>,
+    #     "width": config.MASTER_WIDTH,
+    #     "height": <depends on flag aspect ratio and config.MASTER_WIDTH>
+    #   },
+    #   "pageimage": <image file name on Wikimedia>
+    # }
+    thumbnail = page['thumbnail']
+    return {'pageimage': page['pageimage'],
+            'template': thumbnail_template(thumbnail['source'], thumbnail.get('width')),
+            'width': thumbnail.get('width'),
+            'height': thumbnail.get('height'),
+            'resolved': int(time()),
+            'api_etag': headers.get('ETag'),
+            'api_modified': headers.get('Last-Modified')}
+
+
+def resolve_flag(country: str, refresh: bool = False) -> dict:
+    """
+    Resolve a country's flag to its file on Wikimedia Commons and the link of its thumbnail.
+    Resolutions are kept in the cache manifest for config.RESOLUTION_EXPIRY, apart from the images:
+    until then, refreshing a flag is a single request straight to the thumbnail. After that, the API call is
+    revalidated with the validators (ETag / Last-Modified) of the previous one
+
+    :param country: name of country to resolve flag of
+    :param refresh: whether to ask the API even if the flag's resolution hasn't expired
+    :return: pageimage (name of .svg file), template (see thumbnail_template), width, height, resolved (when),
+             api_etag and api_modified
+    :raises FetchError: if the flag could not be resolved, with a message to show to user
+    """
+    resolution = get_manifest().get_resolution(country)
+    if resolution and not refresh and time() - resolution['resolved'] < config.RESOLUTION_EXPIRY:
+        annotate(resolution='hit')
+        return resolution
+
+    headers = conditional_headers(resolution['api_etag'], resolution['api_modified']) if resolution else {}
+    try:
+        param_api = {'action': 'query',
+                     'format': 'json',
+                     'prop': 'pageimages',
+                     'titles': commons_title(country),
+                     'redirects': 1,
+                     'pithumbsize': config.MASTER_WIDTH}
+        with span('fetch.api', conditional=bool(headers)):
+            re = get_session().get(config.API_URL,
+                                   timeout=(config.CONNECT_TIMEOUT, config.READ_TIMEOUT),
+                                   headers=headers,
+                                   params=param_api)
+        re.raise_for_status()
+
+    except requests.exceptions.Timeout:
+        raise FetchError('JSON fetch request timed out. Please retry by re-selecting the country.')
+
+    except requests.exceptions.HTTPError:
+        raise FetchError(f'HTTP Error while fetching JSON. Code: {re.status_code}.\nMessage: {re.reason}')
+
+    except requests.exceptions.ConnectionError:
+        raise FetchError('Could not connect to Wikimedia. Please check your connection and retry by re-selecting the country.')
+
+    if re.status_code == 304:
+        annotate(resolution='revalidated')
+        del resolution['country']  # a record of the manifest, passed apart below
+        resolution.update(resolved=int(time()))
+    else:
+        annotate(resolution='miss')
+        try:
+            page = re.json()['query']['pages'].popitem()[1]  # value of str(pageid_number): {...}
+        except (ValueError, KeyError):
+            raise FetchError('Unexpected answer from Wikimedia while fetching JSON. '
+                             'Please retry by re-selecting the country.')
+        if 'thumbnail' not in page:
+            raise FetchError(f'No flag of {country} was found on Wikimedia Commons.')
+        resolution = _resolution(page, re.headers)
+    get_manifest().put_resolution(country, **resolution)
+    return resolution
+
+
+def download_original(country: str, source: str) -> None:
+    """
+    Download a flag's original .svg file into the cache, and render its master from it (see flag_finder.raster).
+    A cached original from the same link is revalidated instead: an unchanged one (304 Not Modified)
+    only refreshes when the flag was cached, its master is only rendered again if it is missing.
+    Callers downloading the same original at the same time share a single download
+
+    :param country: name of country's flag to be downloaded
+    :param source: link of the .svg file
+    :raises requests.exceptions.RequestException: if the download failed
+    :raises raster.RasterError: if the file could not be rendered
+    """
+    _in_flight.do(('original', country, source), _download_original, country, source)
+
+
+def _download_original(country: str, source: str) -> None:
+    manifest = get_manifest()
+    cached = manifest.get_original(country)
+    headers = {}
+    if cached and cached['source'] == source and os.path.exists(original_path(country)):
+        headers = conditional_headers(cached['etag'], cached['modified'])
+
+    with span('fetch.original', conditional=bool(headers)):
+        re = get_session().get(source,
+                               timeout=(config.CONNECT_TIMEOUT, config.READ_TIMEOUT),
+                               headers=headers)
+    if re.status_code == 304:
+        manifest.put_original(**{**cached, 'cached': int(time())})
+        if get_cache(country, max_age=inf):
+            manifest.put(country, cached=int(time()))
+            return
+        with open(original_path(country), 'rb') as file:
+            svg = file.read()
+    else:
+        re.raise_for_status()
+        svg = re.content
+
+    with span('fetch.rasterize', width=config.MASTER_WIDTH):
+        img = raster.rasterize(svg, config.MASTER_WIDTH)
+    if re.status_code != 304:
+        cache_original(country, svg, source, etag=re.headers.get('ETag'), modified=re.headers.get('Last-Modified'))
+    cache_flag(country, img, source=source, img_etag=None, img_modified=None)
+
+
+def download_resolved(country: str, resolution: dict) -> None:
+    """
+    Download a resolved flag into the cache: its original .svg file, rendered locally, if config.SVG_MASTERS
+    (see flag_finder.raster), otherwise (or if that failed) its thumbnail
+
+    :param country: name of country's flag to be downloaded
+    :param resolution: what the API resolved the flag to, see resolve_flag
+    :raises requests.exceptions.RequestException: if the download failed
+    """
+    source = raster.original_source(resolution) if raster.enabled() else None
+    if source:
+        try:
+            download_original(country, source)
+            return
+        except raster.RasterError:
+            pass  # e.g. an SVG cairosvg can't render, Wikimedia's renderer may
+    download_flag(country, thumbnail_source(resolution))
+
+
+def fetch_flag(country: str) -> str:
+    """
+    Fetch flag of selected country from Wikimedia and cache it.
+    The flag is resolved to its thumbnail first (see resolve_flag), which needs no request unless its resolution expired,
+    then downloaded as thumbnail or, if config.SVG_MASTERS, as original .svg file rendered locally (see download_resolved).
+    If a flag of that country is already cached, the thumbnail is revalidated with the validators (ETag / Last-Modified)
+    recorded when it was cached, so an unchanged flag isn't downloaded again.
+    Callers fetching the same country at the same time (e.g. the window and a prefetch) share a single fetch
+
+    :param country: name of country to fetch flag of
+    :return: name of .svg file
+    :raises FetchError: if the flag could not be fetched, with a message to show to user
+    """
+    return _in_flight.do(('fetch', country), _fetch_flag, country)
+
+
+def _fetch_flag(country: str) -> str:
+    resolution = resolve_flag(country)
+    try:
+        try:
+            download_resolved(country, resolution)
+        except requests.exceptions.HTTPError as error:
+            if error.response.status_code != 404:
+                raise
+            # The file may have been renamed or deleted since it was resolved, in which case the API knows better
+            refreshed = resolve_flag(country, refresh=True)
+            if refreshed['template'] == resolution['template']:
+                raise
+            resolution = refreshed
+            download_resolved(country, resolution)
+
+    except requests.exceptions.Timeout:
+        raise FetchError('Image fetch request timed out. Please retry by re-selecting the country.')
+
+    except requests.exceptions.HTTPError as error:
+        raise FetchError(f'HTTP Error while fetching image. Code: {error.response.status_code}.\n'
+                         f'Message: {error.response.reason}')
+
+    except requests.exceptions.ConnectionError:
+        raise FetchError('Could not connect to Wikimedia. Please check your connection and retry by re-selecting the country.')
+
+    return resolution['pageimage']
+
+
+def revalidate(country: str) -> None:
+    """
+    Revalidates an expired cached flag in the background, while the expired one is served in the meantime.
+    Does nothing if the flag is already being revalidated
+
+    :param country: name of country whose flag expired
+    """
+    global _revalidator
+    with _revalidating_lock:
+        if country in _revalidating:
+            return
+        _revalidating.add(country)
+        if _revalidator is None:
+            _revalidator = ThreadPoolExecutor(max_workers=2, thread_name_prefix='flag-revalidate',
+                                              initializer=set_priority, initargs=('maintenance',))
+
+    def run_revalidation() -> None:
+        try:
+            if fetch_from_daemon(country, use=False) is None:  # or every instance would revalidate it
+                fetch_flag(country)
+        except (FetchError, DaemonError):
+            pass  # the expired flag stays served, and is revalidated again next time it is shown
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(country)
+
+    _revalidator.submit(run_revalidation)
+
+
+def get_flag(country: str, width: int | None = None, use: bool = True) -> (str, str):
+    """
+    Get flag of selected country from cache,
+    if none found, fetch flag from Wikimedia and cache it.
+    An expired cached flag is still returned right away, and revalidated in the background (stale-while-revalidate).
+    A width other than the cached one is downscaled locally, never fetched
+
+    :param country: name of country to get flag of
+    :param width: flag's width (aspect ratio preserved), or None for the widest one cached
+    :param use: whether the flag counts as used for eviction, False when it is only warmed up in case it gets used
+    :return: path to cached image, and name of .svg file
+    :raises FetchError: if the flag could not be fetched, with a message to show to user
+    """
+    if not valid_name(country):  # the cache must never be written outside FLAGS_DIR
+        raise FetchError(f'Invalid name: {country}')
+    img_path = get_cache(country)
+    if img_path:
+        wiki_file = file_name(country)
+        annotate(cache='hit')
+    elif img_path := get_cache(country, max_age=inf):
+        wiki_file = file_name(country)
+        annotate(cache='stale')
+        revalidate(country)
+    else:
+        annotate(cache='miss')
+        wiki_file = fetch_flag(country)
+        img_path = os.path.normpath(os.path.join(config.FLAGS_DIR, f'{country}.png'))
+
+    if use:
+        get_manifest().touch(country)
+    if width is not None:
+        try:
+            img_path = _in_flight.do(('variant', country, width), get_variant, country, width, img_path, use)
+        except OSError as error:
+            raise FetchError(f'Could not downscale flag of {country}: {error}')
+    return img_path, wiki_file
+
+
+def get_image(country: str, width: int | None = None) -> (Image.Image, str, str):
+    """
+    Get decoded image of flag of selected country, from the flag pack if it has it (see flag_finder.pack),
+    otherwise from the cache daemon if one is running on this host (see flag_finder.daemon), otherwise see get_flag.
+    A flag from the pack is downscaled in memory if needed, never upscaled.
+    Does not touch any Tk object, so it is safe to run on a worker thread
+
+    :param country: name of country to get flag of
+    :param width: flag's width (aspect ratio preserved), or None for the widest one cached
+    :return: decoded flag image, name of .svg file, and path to cached image (or to the pack)
+    :raises FetchError: if the flag could not be fetched, with a message to show to user
+    """
+    pack = get_pack()
+    img = None
+    if pack and country in pack:
+        with span('pack.read'):
+            img = pack.image(country)  # None if truncated or corrupt, then fetched as if it weren't packed
+    if img is not None:
+        annotate(cache='pack')
+        with span('image.decode'):
+            image = Image.open(BytesIO(img))
+            image.load()
+            if width is not None and width < image.width:
+                image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        return image, pack.get(country)['pageimage'], pack.path
+
+    try:
+        with span('daemon.request'):
+            served = fetch_from_daemon(country, width)
+    except DaemonError as error:
+        raise FetchError(str(error))
+    if served:
+        annotate(cache='daemon')
+        img, wiki_file, img_path = served
+    else:
+        img_path, wiki_file = get_flag(country, width)
+        with span('image.read'), open(img_path, 'rb') as file:
+            img = file.read()
+    with span('image.decode'):
+        image = Image.open(BytesIO(img))
+        image.load()  # decode now, while still off the main thread
+    return image, wiki_file, img_path
+
+
+def query_flags(countries: list[str] | tuple[str, ...]) -> dict[str, dict]:
+    """
+    Resolve flags of many countries with a single API call, recording their resolutions (see resolve_flag)
+
+    :param countries: names of countries to query flag of, at most config.API_TITLES_LIMIT of them
+    :return: country's name -> its resolution, countries whose flag wasn't found are left out
+    :raises requests.exceptions.RequestException: if the API call failed
+    :raises ValueError, KeyError: if the API's answer wasn't as expected
+    """
+    if len(countries) > config.API_TITLES_LIMIT:
+        raise ValueError(f'At most {config.API_TITLES_LIMIT} countries can be queried at once')
+
+    titles = {commons_title(country): country for country in countries}
+    re = get_session().get(config.API_URL,
+                           timeout=(config.CONNECT_TIMEOUT, config.READ_TIMEOUT),
+                           params=query_params(titles))
+    re.raise_for_status()
+    return record_query(titles, re.json())
+
+
+def query_params(titles: dict[str, str]) -> dict:
+    """
+    Returns the parameters of an API call resolving many flags at once, see query_flags
+
+    :param titles: titles of the flags' files on Wikimedia Commons -> country's name
+    :return: query parameters of the call
+    """
+    return {'action': 'query',
+            'format': 'json',
+            'prop': 'pageimages',
+            'titles': '|'.join(titles),
+            'redirects': 1,
+            'pithumbsize': config.MASTER_WIDTH,
+            'pilimit': config.API_TITLES_LIMIT}
+
+
+def record_query(titles: dict[str, str], response: dict) -> dict[str, dict]:
+    """
+    Records the resolutions an API call made with query_params returned
+
+    :param titles: titles of the flags' files on Wikimedia Commons -> country's name, as queried
+    :param response: JSON the API answered
+    :return: country's name -> its resolution, countries whose flag wasn't found are left out
+    """
+    titles = dict(titles)
+    json = response['query']
+    for renamed in json.get('normalized', []) + json.get('redirects', []):
+        titles[renamed['to']] = titles.pop(renamed['from'])
+
+    # validators of a batch's response don't apply to the query of a single flag, so none are recorded
+    resolutions = {titles[page['title']]: _resolution(page, {})
+                   for page in json['pages'].values()
+                   if 'thumbnail' in page and page['title'] in titles}
+    for country, resolution in resolutions.items():
+        get_manifest().put_resolution(country, **resolution)
+    return resolutions
+
+
+def prefetch_flags(countries: list[str] | tuple[str, ...], max_workers: int = 8, progress=None) -> (int, list[str], float):
+    """
+    Warm the cache with the flags of all given countries that aren't cached yet.
+    Flags whose resolution hasn't expired are downloaded right away, the others are resolved
+    config.API_TITLES_LIMIT countries at a time, and downloaded by a pool of max_workers threads
+    as soon as their batch has been resolved.
+    If httpx is installed (and config.ASYNC_BATCHES), the same is done on an asyncio event loop instead,
+    see flag_finder.batch
+
+    :param countries: names of countries to cache flag of
+    :param max_workers: maximum number of flags downloaded at the same time
+    :param progress: called with (number of flags processed so far, number of flags to fetch) after each flag
+    :return: number of flags cached, names of countries whose flag could not be fetched, and elapsed time in seconds
+    """
+    from .batch import available, fetch_batch  # which imports this module
+
+    try:
+        prefetched = prefetch_on_daemon(countries, max_workers, progress)  # fetched once for every instance
+    except DaemonError:
+        prefetched = None
+    if prefetched is not None:
+        return prefetched
+    if available():
+        with priority('maintenance'):
+            cached, failed, elapsed = fetch_batch(countries, max_workers, progress)
+        return cached, list(failed), elapsed
+
+    start = perf_counter()
+    invalid = [country for country in countries if not valid_name(country)]
+    missing = [country for country in countries if valid_name(country) and not get_cache(country)]
+    failed = []
+    done = 0
+
+    with priority('maintenance'), \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='flag-prefetch',
+                               initializer=set_priority, initargs=('maintenance',)) as executor:
+        downloads = {}
+        unresolved = []
+        for country in missing:
+            resolution = get_manifest().get_resolution(country)
+            if resolution and time() - resolution['resolved'] < config.RESOLUTION_EXPIRY:
+                downloads[executor.submit(download_resolved, country, resolution)] = country
+            else:
+                unresolved.append(country)
+
+        for i in range(0, len(unresolved), config.API_TITLES_LIMIT):
+            batch = unresolved[i:i + config.API_TITLES_LIMIT]
+            try:
+                resolutions = query_flags(batch)
+            except (requests.exceptions.RequestException, ValueError, KeyError):  # as in flag_finder.batch
+                resolutions = {}  # the batch failed, not the whole prefetch
+
+            for country in batch:
+                if country in resolutions:
+                    downloads[executor.submit(download_resolved, country, resolutions[country])] = country
+                else:
+                    failed.append(country)
+                    done += 1
+                    if progress:
+                        progress(done, len(missing))
+
+        for future in as_completed(downloads):
+            if future.exception():
+                failed.append(downloads[future])
+            done += 1
+            if progress:
+                progress(done, len(missing))
+
+    return len(missing) - len(failed), invalid + failed, perf_counter() - start
+
+
+def prefetch_report(cached: int, failed: list[str], elapsed: float) -> str:
+    """
+    Returns a one-line summary of a prefetch_flags run, with its throughput
+
+    :param cached: number of flags cached
+    :param failed: names of countries whose flag could not be fetched
+    :param elapsed: duration of the run in seconds
+    :return: summary to show to user
+    """
+    report = f'Cached {cached} flags in {elapsed:.1f}s ({cached / elapsed if elapsed else 0:.1f} flags/sec)'
+    if failed:
+        report += f', {len(failed)} failed: {", ".join(failed)}'
+    return report
@@ -0,0 +1,116 @@
+"""
+Coordination of threads working on the same flag, so concurrent callers never do the same work twice
+"""
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+class SingleFlight:
+    """
+    Runs a function at most once per key at a time: the first caller for a key runs it,
+    callers asking for the same key while it runs wait for it and get the same result (or exception) instead
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future of the call in flight
+
+    def do(self, key, function, *args):
+        """
+        Returns function(*args), or the result of the call already in flight for key
+
+        :param key: hashable identifying the work, e.g. a country's name
+        :param function: function to run if no call is in flight for key
+        :param args: arguments for function
+        :return: what function returned
+        :raises: whatever function raised
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key, function, *args):
+        """
+        Awaits function(*args), or the call already in flight for key, see do.
+        Calls of do and of ado share their keys: threads and coroutines wait for each other
+
+        :param key: hashable identifying the work, e.g. a country's name
+        :param function: coroutine function to await if no call is in flight for key
+        :param args: arguments for function
+        :return: what function returned
+        :raises: whatever function raised
+        """
+        import asyncio  # slow to import, and only batches need it, see flag_finder.batch
+
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await function(*args)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self, key) -> bool:
+        """
+        Returns whether a call is running for key
+
+        :param key: hashable identifying the work
+        :return: whether a call is in flight
+        """
+        with self._lock:
+            return key in self._calls
+
+
+class KeyedLock:
+    """
+    One lock per key, made when first needed and dropped when nobody holds or waits for it anymore,
+    so that work on different keys runs at once while work on the same key is serialized.
+    Locks are reentrant: a thread holding a key's lock can take it again, e.g. to delete part of what it is deleting
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}  # key -> [lock, number of threads holding or waiting for it]
+
+    @contextmanager
+    def __call__(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
@@ -0,0 +1,326 @@
+"""
+Cache manifest: the index of cached flags and their metadata
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from hashlib import sha3_256
+from time import time
+
+
+class CacheManifest:
+    """
+    Index of cached flags, stored in a SQLite database: one record per country, so that looking up or updating a flag
+    only touches its own record instead of re-reading and rewriting a log of the whole cache.
+    Downscaled copies (variants) of a flag get a record per width in their own table, without checksum:
+    they can always be derived from the flag again. So do what the API resolved flags to (resolutions),
+    kept apart from the images so that they expire on their own, and the .svg files flags are rendered from (originals).
+    Every update is a single transaction, safe to run from several threads or processes at once,
+    and every record carries a checksum of its own fields: a record that fails it is dropped as if never cached
+
+    :param path: path to the database file, created if it doesn't exist
+    :type path: str
+    """
+    # Schema changes, a database whose PRAGMA user_version is n gets the ones from index n onwards applied
+    MIGRATIONS = (
+        'CREATE TABLE flags (country TEXT PRIMARY KEY, cached INTEGER NOT NULL, hash TEXT NOT NULL, checksum TEXT NOT NULL)',
+        # size and mtime (in ns) of the image when it was last hashed, and when that was
+        'ALTER TABLE flags ADD COLUMN size INTEGER; ALTER TABLE flags ADD COLUMN mtime INTEGER; '
+        'ALTER TABLE flags ADD COLUMN verified INTEGER',
+        # thumbnail's link, and validators (ETag / Last-Modified headers) of the API response and of the thumbnail
+        'ALTER TABLE flags ADD COLUMN source TEXT; ALTER TABLE flags ADD COLUMN api_etag TEXT; '
+        'ALTER TABLE flags ADD COLUMN api_modified TEXT; ALTER TABLE flags ADD COLUMN img_etag TEXT; '
+        'ALTER TABLE flags ADD COLUMN img_modified TEXT',
+        # downscaled copies of flags: hash of the flag they were made from, their size in bytes, and when they were made
+        'CREATE TABLE variants (country TEXT NOT NULL, width INTEGER NOT NULL, master_hash TEXT NOT NULL, '
+        'size INTEGER NOT NULL, created INTEGER NOT NULL, PRIMARY KEY (country, width))',
+        # when flags and their copies were last used and how many times, to pick which ones to evict
+        'ALTER TABLE flags ADD COLUMN last_access INTEGER; ALTER TABLE flags ADD COLUMN hits INTEGER; '
+        'ALTER TABLE variants ADD COLUMN last_access INTEGER; ALTER TABLE variants ADD COLUMN hits INTEGER',
+        # what the API resolved flags' files to: file name, link of its thumbnail with its width left as {width},
+        # the thumbnail's dimensions, when that was and the response's validators. Replaces api_etag / api_modified
+        'CREATE TABLE resolutions (country TEXT PRIMARY KEY, pageimage TEXT NOT NULL, template TEXT NOT NULL, '
+        'width INTEGER, height INTEGER, resolved INTEGER NOT NULL, api_etag TEXT, api_modified TEXT)',
+        # original .svg files of flags rendered locally (see flag_finder.raster): link, hash, size, validators and
+        # when they were cached
+        'CREATE TABLE originals (country TEXT PRIMARY KEY, source TEXT NOT NULL, hash TEXT NOT NULL, '
+        'size INTEGER NOT NULL, etag TEXT, modified TEXT, cached INTEGER NOT NULL)',
+        # no schema change: checksums stop covering UNSEALED columns, records are sealed again after any migration
+        '',
+    )
+    # Columns left out of checksums: touch updates them alone on every cache hit, and they only order eviction
+    UNSEALED = ('checksum', 'last_access', 'hits')
+    # ORDER BY clauses of eviction policies, least worth keeping first. {0} is when a record was written,
+    # standing in for its last use if it was never used
+    EVICTION_ORDER = {'lru': 'COALESCE(last_access, {0})',
+                      'lfu': 'COALESCE(hits, 0), COALESCE(last_access, {0})'}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')  # in WAL mode, commits aren't synced to disk, checkpoints are
+
+        with self._transaction():
+            version = self._db.execute('PRAGMA user_version').fetchone()[0]
+            for migration in self.MIGRATIONS[version:]:
+                for statement in migration.split(';'):
+                    self._db.execute(statement)
+            self._db.execute(f'PRAGMA user_version = {len(self.MIGRATIONS)}')
+            self.columns = tuple(column['name'] for column in self._db.execute('PRAGMA table_info(flags)'))
+
+            # New columns change what a checksum covers, so records are sealed again after a migration
+            if version < len(self.MIGRATIONS):
+                for row in self._db.execute('SELECT * FROM flags').fetchall():
+                    self._write(dict(row))
+
+    def get(self, country: str) -> dict | None:
+        """
+        Returns the record of a country's cached flag, or None if it has none or its record is corrupt
+
+        :param country: name of country to return the record of
+        :return: column name -> value | None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT * FROM flags WHERE country = ?', (country,)).fetchone()
+        if row is None:
+            return None
+
+        record = dict(row)
+        if record['checksum'] != self._checksum(record):
+            self.delete(country)
+            return None
+        return record
+
+    def put(self, country: str, **fields) -> None:
+        """
+        Creates or updates the record of a country's cached flag, fields not given are kept from its current record
+
+        :param country: name of country to update the record of
+        :param fields: column name -> new value
+        """
+        with self._transaction():
+            row = self._db.execute('SELECT * FROM flags WHERE country = ?', (country,)).fetchone()
+            record = dict(row) if row else {}
+            record.update(fields, country=country)
+            self._write(record)
+
+    def touch(self, country: str, width: int | None = None) -> None:
+        """
+        Records that a country's flag, or one of its downscaled copies, was just used.
+        Called on every cache hit, so it is a single statement that leaves the checksum as is (see UNSEALED)
+
+        :param country: name of country whose flag was used
+        :param width: width of the copy used, or None if the flag itself was used
+        """
+        with self._lock:
+            if width is not None:
+                self._db.execute('UPDATE variants SET last_access = ?, hits = COALESCE(hits, 0) + 1 '
+                                 'WHERE country = ? AND width = ?', (int(time()), country, width))
+            else:
+                self._db.execute('UPDATE flags SET last_access = ?, hits = COALESCE(hits, 0) + 1 WHERE country = ?',
+                                 (int(time()), country))
+
+    def records(self, policy: str = 'lru') -> list[dict]:
+        """
+        Returns the records of every cached flag, in the order they should be evicted.
+        Their checksum isn't checked, see get for that
+
+        :param policy: eviction policy, a key of EVICTION_ORDER
+        :return: list of column name -> value
+        """
+        order = self.EVICTION_ORDER[policy].format('cached')
+        with self._lock:
+            rows = self._db.execute(f'SELECT * FROM flags ORDER BY {order}').fetchall()
+        return [dict(row) for row in rows]
+
+    def total_size(self) -> int:
+        """
+        Returns the number of bytes taken by cached flags, their downscaled copies and their originals, as recorded
+
+        :return: size of the cache in bytes
+        """
+        with self._lock:
+            return self._db.execute('SELECT (SELECT COALESCE(SUM(size), 0) FROM flags) '
+                                    '+ (SELECT COALESCE(SUM(size), 0) FROM variants) '
+                                    '+ (SELECT COALESCE(SUM(size), 0) FROM originals)').fetchone()[0]
+
+    def compact(self) -> None:
+        """
+        Rebuilds the database file without the space left by deleted records, and empties its write-ahead log
+        """
+        with self._lock:
+            self._db.execute('VACUUM')
+            self._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def delete(self, country: str) -> None:
+        """
+        Removes the record of a country's cached flag
+
+        :param country: name of country to remove the record of
+        """
+        with self._transaction():
+            self._db.execute('DELETE FROM flags WHERE country = ?', (country,))
+
+    def get_variant(self, country: str, width: int) -> dict | None:
+        """
+        Returns the record of a downscaled copy of a country's flag, or None if it has none
+
+        :param country: name of country to return the record of
+        :param width: width of the copy
+        :return: column name -> value | None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT * FROM variants WHERE country = ? AND width = ?', (country, width)).fetchone()
+        return dict(row) if row else None
+
+    def put_variant(self, country: str, width: int, master_hash: str, size: int, created: int) -> None:
+        """
+        Creates or replaces the record of a downscaled copy of a country's flag
+
+        :param country: name of country the copy is a flag of
+        :param width: width of the copy
+        :param master_hash: hash of the flag the copy was made from
+        :param size: size of the copy in bytes
+        :param created: when the copy was made
+        """
+        with self._transaction():
+            self._db.execute('INSERT OR REPLACE INTO variants (country, width, master_hash, size, created, last_access, hits) '
+                             'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                             (country, width, master_hash, size, created, created))
+
+    def variants(self, country: str | None = None, policy: str = 'lru') -> list[dict]:
+        """
+        Returns the records of downscaled copies, in the order they should be evicted
+
+        :param country: name of country to return the copies of, or None for the copies of every country
+        :param policy: eviction policy, a key of EVICTION_ORDER
+        :return: list of column name -> value
+        """
+        order = self.EVICTION_ORDER[policy].format('created')
+        with self._lock:
+            if country is None:
+                rows = self._db.execute(f'SELECT * FROM variants ORDER BY {order}').fetchall()
+            else:
+                rows = self._db.execute(f'SELECT * FROM variants WHERE country = ? ORDER BY {order}', (country,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_variant(self, country: str, width: int) -> None:
+        """
+        Removes the record of a downscaled copy of a country's flag
+
+        :param country: name of country the copy is a flag of
+        :param width: width of the copy
+        """
+        with self._transaction():
+            self._db.execute('DELETE FROM variants WHERE country = ? AND width = ?', (country, width))
+
+    def get_resolution(self, country: str) -> dict | None:
+        """
+        Returns what the API resolved a country's flag to, or None if it was never resolved
+
+        :param country: name of country to return the resolution of
+        :return: column name -> value | None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT * FROM resolutions WHERE country = ?', (country,)).fetchone()
+        return dict(row) if row else None
+
+    def put_resolution(self, country: str, pageimage: str, template: str, width: int | None, height: int | None,
+                       resolved: int, api_etag: str | None = None, api_modified: str | None = None) -> None:
+        """
+        Creates or replaces what the API resolved a country's flag to
+
+        :param country: name of country the flag is of
+        :param pageimage: name of the flag's file on Wikimedia Commons
+        :param template: link of the flag's thumbnail, with its width replaced by {width}
+        :param width: width of the thumbnail the API linked to
+        :param height: height of the thumbnail the API linked to
+        :param resolved: when the API was asked
+        :param api_etag: ETag header of the API response
+        :param api_modified: Last-Modified header of the API response
+        """
+        with self._transaction():
+            self._db.execute('INSERT OR REPLACE INTO resolutions '
+                             '(country, pageimage, template, width, height, resolved, api_etag, api_modified) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (country, pageimage, template, width, height, resolved, api_etag, api_modified))
+
+    def delete_resolution(self, country: str) -> None:
+        """
+        Forgets what the API resolved a country's flag to
+
+        :param country: name of country to forget the resolution of
+        """
+        with self._transaction():
+            self._db.execute('DELETE FROM resolutions WHERE country = ?', (country,))
+
+    def get_original(self, country: str) -> dict | None:
+        """
+        Returns the record of the original .svg file of a country's flag, or None if it has none
+
+        :param country: name of country to return the record of
+        :return: column name -> value | None
+        """
+        with self._lock:
+            row = self._db.execute('SELECT * FROM originals WHERE country = ?', (country,)).fetchone()
+        return dict(row) if row else None
+
+    def put_original(self, country: str, source: str, hash: str, size: int, cached: int,
+                     etag: str | None = None, modified: str | None = None) -> None:
+        """
+        Creates or replaces the record of the original .svg file of a country's flag
+
+        :param country: name of country the file is a flag of
+        :param source: link the file was downloaded from
+        :param hash: hash of the file
+        :param size: size of the file in bytes
+        :param cached: when the file was downloaded, or found unchanged
+        :param etag: ETag header of the download
+        :param modified: Last-Modified header of the download
+        """
+        with self._transaction():
+            self._db.execute('INSERT OR REPLACE INTO originals (country, source, hash, size, etag, modified, cached) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (country, source, hash, size, etag, modified, cached))
+
+    def originals(self) -> list[dict]:
+        """
+        Returns the records of every original .svg file
+
+        :return: list of column name -> value
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT * FROM originals').fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_original(self, country: str) -> None:
+        """
+        Removes the record of the original .svg file of a country's flag
+
+        :param country: name of country the file is a flag of
+        """
+        with self._transaction():
+            self._db.execute('DELETE FROM originals WHERE country = ?', (country,))
+
+    def _write(self, record: dict) -> None:
+        record['checksum'] = self._checksum(record)
+        self._db.execute(f'INSERT OR REPLACE INTO flags ({", ".join(record)}) VALUES ({", ".join("?" * len(record))})',
+                         tuple(record.values()))
+
+    def _checksum(self, record: dict) -> str:
+        fields = tuple((column, record.get(column)) for column in self.columns if column not in self.UNSEALED)
+        return sha3_256(repr(fields).encode()).hexdigest()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
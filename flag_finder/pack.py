@@ -0,0 +1,174 @@
+"""
+Flag packs: every cached flag and its metadata in a single file, to provision or run Flag-finder without the network.
+A pack is "FLAGPACK", the size of its index as 8 bytes (little-endian), its index as UTF-8 JSON, then the PNGs
+one after the other, at the offsets the index gives from the end of the index.
+It is memory-mapped on first use: reading a flag is a slice of the mapped file, no file is opened
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from hashlib import sha3_256
+from math import inf
+from time import time
+
+from . import config
+
+
+MAGIC = b'FLAGPACK'
+VERSION = 1
+_HEADER = struct.Struct('<Q')  # size of the index
+
+_pack = None
+_pack_lock = threading.Lock()
+_missing = None  # (path, mtime in ns or None if it doesn't exist) of the pack that could not be opened
+
+
+class FlagPack:
+    """
+    Read-only flag pack, see build_pack for how one is made
+
+    :param path: path to the pack
+    :type path: str
+    :raises ValueError: if the file isn't a flag pack this version can read
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(MAGIC) + _HEADER.size
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a flag pack')
+        index_size = _HEADER.unpack_from(self._map, len(MAGIC))[0]
+        index = json.loads(self._map[start:start + index_size])
+        if index['version'] != VERSION:
+            raise ValueError(f'{path} is a flag pack of version {index["version"]}, only version {VERSION} can be read')
+        self.built = index['built']
+        self._flags = index['flags']
+        self._data = start + index_size  # where the PNGs start
+        self._verified = set()  # countries whose PNG matched its size and hash, checked once
+
+    def __contains__(self, country: str) -> bool:
+        return country in self._flags
+
+    def __len__(self) -> int:
+        return len(self._flags)
+
+    def names(self) -> list[str]:
+        """
+        Returns names of all flags in the pack
+        """
+        return list(self._flags)
+
+    def get(self, country: str) -> dict | None:
+        """
+        Returns the metadata of a flag in the pack, or None if the pack doesn't have it
+
+        :param country: name of country
+        :return: offset and size (in bytes), hash (SHA3-256 hex of the PNG), width, height,
+                 pageimage (name of .svg file) and cached (when) | None
+        """
+        return self._flags.get(country)
+
+    def image(self, country: str) -> memoryview | None:
+        """
+        Returns the PNG of a flag in the pack, without copying it out of the mapped file.
+        It is checked against its size and hash the first time it is read
+
+        :param country: name of country
+        :return: PNG's bytes, or None if the pack doesn't have it or it is truncated or corrupt
+        """
+        entry = self._flags.get(country)
+        if entry is None:
+            return None
+        start = self._data + entry['offset']
+        img = memoryview(self._map)[start:start + entry['size']]
+        if country not in self._verified:
+            if len(img) != entry['size'] or sha3_256(img).hexdigest() != entry['hash']:
+                return None
+            self._verified.add(country)
+        return img
+
+    def close(self) -> None:
+        self._map.close()
+
+
+def get_pack() -> FlagPack | None:
+    """
+    Returns the flag pack at config.PACK_PATH, opening it on first use.
+    A pack that could not be opened is only tried again once its file appears or changes, which costs a stat
+
+    :return: shared flag pack, or None if there is none (or it can't be read)
+    """
+    global _pack, _missing
+    with _pack_lock:
+        if _pack is None or _pack.path != config.PACK_PATH:
+            try:
+                mtime = os.stat(config.PACK_PATH).st_mtime_ns
+            except OSError:
+                mtime = None
+            if _missing == (config.PACK_PATH, mtime):
+                return None
+            try:
+                _pack = FlagPack(config.PACK_PATH)
+            except (OSError, ValueError, struct.error):
+                _missing = (config.PACK_PATH, mtime)
+                return None
+    return _pack
+
+
+def build_pack(path: str, width: int | None = None, progress=None) -> (int, int):
+    """
+    Builds a flag pack out of every flag in the cache whose image is intact, e.g. once prefetch warmed it
+
+    :param path: where to write the pack, replacing any pack there
+    :param width: flags' width in the pack, downscaled from the cache (aspect ratio preserved), or None for as cached
+    :param progress: called with (number of flags packed so far, number of flags in the cache) after each flag
+    :return: number of flags packed, and size of the pack in bytes
+    """
+    from PIL import Image  # only building a pack needs Pillow and the cache, reading one needs neither
+
+    from .cache import get_cache, get_manifest, get_variant
+    from .catalog import commons_title
+
+    manifest = get_manifest()
+    records = manifest.records()
+    flags = {}
+    images = []
+    offset = 0
+    for i, record in enumerate(records, start=1):
+        country = record['country']
+        img_path = get_cache(country, max_age=inf)
+        if img_path:
+            if width is not None:
+                img_path = get_variant(country, width, img_path, use=False)
+            with open(img_path, 'rb') as file:
+                img = file.read()
+            with Image.open(img_path) as image:
+                size = image.size
+
+            resolution = manifest.get_resolution(country)
+            flags[country] = {'offset': offset,
+                              'size': len(img),
+                              'hash': sha3_256(img).hexdigest(),  # of the downscaled copy if width was given
+                              'width': size[0],
+                              'height': size[1],
+                              'pageimage': resolution['pageimage'] if resolution
+                              else commons_title(country).removeprefix('File:').replace(' ', '_'),
+                              'cached': record['cached']}
+            images.append(img)
+            offset += len(img)
+        if progress:
+            progress(i, len(records))
+
+    index = json.dumps({'version': VERSION, 'built': int(time()), 'flags': flags}).encode()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(MAGIC)
+        file.write(_HEADER.pack(len(index)))
+        file.write(index)
+        file.writelines(images)
+    os.replace(tmp_path, path)
+    return len(flags), os.path.getsize(path)
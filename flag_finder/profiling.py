@@ -0,0 +1,72 @@
+"""
+Measuring where startup time goes: how long each module took to import, without running Python with -X importtime
+"""
+import builtins
+import sys
+import threading
+from importlib.util import resolve_name
+from time import perf_counter
+
+_import = None  # builtins.__import__ while imports are profiled
+_times = {}  # module name -> (seconds to import it including what it imported, seconds excluding that)
+_nested = threading.local()  # .stack: seconds spent in imports nested in each import in progress on this thread
+
+
+def profile_imports() -> None:
+    """
+    Starts timing every import of a module not imported yet, until stop_profiling()
+    """
+    global _import
+    if _import is None:
+        _import = builtins.__import__
+        builtins.__import__ = _timed_import
+
+
+def stop_profiling() -> None:
+    """
+    Stops timing imports, the ones timed so far are kept for import_report()
+    """
+    global _import
+    if _import is not None:
+        builtins.__import__ = _import
+        _import = None
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    importer = _import or builtins.__import__
+    try:
+        module = resolve_name('.' * level + name, (globals or {}).get('__package__')) if level else name
+    except (ImportError, ValueError):
+        return importer(name, globals, locals, fromlist, level)
+    if module in sys.modules and all(f'{module}.{item}' in sys.modules or item == '*' for item in fromlist or ()):
+        return importer(name, globals, locals, fromlist, level)
+
+    if not hasattr(_nested, 'stack'):
+        _nested.stack = []
+    stack = _nested.stack
+    stack.append(0)
+    start = perf_counter()
+    try:
+        return importer(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        if module not in _times:
+            _times[module] = (elapsed, elapsed - nested)
+
+
+def import_report(top: int = 15) -> str:
+    """
+    Returns a table of the modules that took the longest to import, by their own time (excluding what they imported)
+
+    :param top: number of modules in the table
+    :return: table to show to user, with the total time spent importing
+    """
+    total = sum(own for _, own in _times.values())
+    lines = [f'Imported {len(_times)} modules in {total * 1000:.1f} ms, slowest:',
+             f'{"own ms":>9} {"cumulative ms":>14}  module']
+    for module, (cumulative, own) in sorted(_times.items(), key=lambda item: item[1][1], reverse=True)[:top]:
+        lines.append(f'{own * 1000:9.1f} {cumulative * 1000:14.1f}  {module}')
+    return '\n'.join(lines)
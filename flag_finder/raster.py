@@ -0,0 +1,97 @@
+"""
+Local rasterization of flags' SVG originals, an optional alternative to Wikimedia's thumbnails (config.SVG_MASTERS):
+each flag's .svg is downloaded once, and rendered at any width in a pool of processes with cairosvg,
+which isn't a required dependency. Without it, flags are fetched as thumbnails as usual
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import config
+
+
+_available = None  # whether cairosvg (and the cairo library it loads) can be imported, checked on first use
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class RasterError(Exception):
+    """
+    Raised when an SVG could not be rendered
+    """
+
+
+def enabled() -> bool:
+    """
+    Returns whether flags are rendered locally from their SVG: config.SVG_MASTERS is set and cairosvg can be imported
+    """
+    global _available
+    if not config.SVG_MASTERS:
+        return False
+    if _available is None:
+        try:
+            import cairosvg
+            _available = True
+        except (ImportError, OSError):  # OSError: cairosvg is installed, but not the cairo library
+            _available = False
+    return _available
+
+
+def original_source(resolution: dict) -> str | None:
+    """
+    Returns the link of a resolved flag's original file, if it is an SVG
+
+    :param resolution: what the API resolved the flag to, see flag_finder.fetch.resolve_flag
+    :return: e.g. 'https://upload.wikimedia.org/wikipedia/commons/a/ab/Flag_of_X.svg' for a thumbnail
+             '.../commons/thumb/a/ab/Flag_of_X.svg/{width}px-Flag_of_X.svg.png' | None
+    """
+    template = resolution['template']
+    head, sep, tail = template.partition('/thumb/')
+    if not sep or '/{width}px-' not in tail:
+        return None
+    original = f'{head}/{tail.rsplit("/", 1)[0]}'
+    return original if original.lower().endswith('.svg') else None
+
+
+def rasterize(svg: bytes, width: int) -> bytes:
+    """
+    Renders an SVG as PNG in the rasterizing processes, started on first use (config.RASTER_WORKERS of them)
+
+    :param svg: content of the .svg file
+    :param width: width of the PNG, aspect ratio preserved
+    :return: PNG's bytes
+    :raises RasterError: if the SVG could not be rendered
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=config.RASTER_WORKERS or os.cpu_count())
+    try:
+        return _pool.submit(_render, svg, width).result()
+    except BrokenProcessPool as error:
+        with _pool_lock:
+            _pool = None  # a process died, e.g. out of memory: the next render starts a new pool
+        raise RasterError(f'Rasterizing process died: {error}')
+    except Exception as error:
+        raise RasterError(f'Could not render SVG: {error}')
+
+
+def _render(svg: bytes, width: int) -> bytes:
+    """
+    Internally called only, in a rasterizing process
+    """
+    import cairosvg
+
+    return cairosvg.svg2png(bytestring=svg, output_width=width)
+
+
+def shutdown() -> None:
+    """
+    Stops the rasterizing processes once the renders already running are done, dropping the others
+    """
+    global _pool
+    with _pool_lock:
+        if _pool:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,296 @@
+"""
+Scheduling of requests to Wikimedia: a global rate limit (token bucket), a cap on concurrent requests per host,
+and priority classes, so that a flag picked by the user never waits behind a prefetch. The rate adapts to the server:
+halved on every 429 Too Many Requests (and the host paused for its Retry-After), raised back slowly on success.
+Threads (see slot) and coroutines (see aslot) wait in the same line
+"""
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from itertools import count
+from math import inf
+from time import monotonic, time
+
+from . import config
+from .trace import span
+
+
+PRIORITIES = ('interactive', 'speculative', 'maintenance')  # served in this order
+
+_local = threading.local()  # .priority: priority of the requests made by this thread
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def set_priority(name: str) -> None:
+    """
+    Sets the priority of the requests this thread makes from now on, e.g. as initializer of a thread pool
+
+    :param name: one of PRIORITIES
+    """
+    if name not in PRIORITIES:
+        raise ValueError(f'Unknown priority: {name}, expected one of {", ".join(PRIORITIES)}')
+    _local.priority = name
+
+
+def current_priority() -> str:
+    """
+    Returns the priority of the requests this thread makes, 'interactive' unless set otherwise
+    """
+    return getattr(_local, 'priority', PRIORITIES[0])
+
+
+@contextmanager
+def priority(name: str):
+    """
+    Makes the requests this thread makes within the block of the given priority
+
+    :param name: one of PRIORITIES
+    """
+    outer = current_priority()
+    set_priority(name)
+    try:
+        yield
+    finally:
+        _local.priority = outer
+
+
+def retry_after(value: str | None) -> float:
+    """
+    Returns how long a Retry-After header asks to wait
+
+    :param value: header's value, in seconds or as an HTTP date
+    :return: seconds, 0 if there is no (valid) header
+    """
+    if not value:
+        return 0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime  # slow to import, and rarely needed
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return 0
+
+
+class UpstreamScheduler:
+    """
+    Admits requests one at a time, in priority order (then in order of arrival), once they are within the rate limit
+    and their host is below its cap of concurrent requests. A request waiting for a busy host doesn't hold back
+    requests of lower priority to other hosts
+
+    :param rate: requests per second over all hosts, 0 for no limit
+    :type rate: float
+    :param burst: requests that may be sent at once after an idle period, at least 1
+    :type burst: int
+    :param host_concurrency: maximum number of requests in flight per host
+    :type host_concurrency: int
+    :param min_rate: the rate is never lowered below this many requests per second by 429 responses
+    :type min_rate: float
+    """
+    def __init__(self, rate: float, burst: int, host_concurrency: int, min_rate: float = 0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.host_concurrency = host_concurrency
+        self.min_rate = min(min_rate, rate) if rate else 0
+        self.throttled = 0  # 429 responses received
+        self.admitted = Counter()  # priority -> requests admitted
+        self.waited = Counter()  # priority -> seconds spent waiting to be admitted
+        self._tokens = float(self.burst)
+        self._refilled = monotonic()
+        self._in_flight = Counter()  # host -> requests in flight
+        self._paused_until = {}  # host -> when it may be sent requests again, after a 429
+        self._waiting = []  # (priority's index, arrival, host) of every request waiting to be admitted
+        self._wakers = set()  # (event loop, future) of every coroutine waiting to be admitted, see aslot
+        self._arrivals = count()
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, host: str):
+        """
+        Waits until a request to host may be sent, at the priority of this thread, and holds its slot during the block
+
+        :param host: host the request is sent to, e.g. 'upload.wikimedia.org'
+        """
+        name = current_priority()
+        start = monotonic()
+        with span('upstream.wait', priority=name), self._cond:
+            waiter = (PRIORITIES.index(name), next(self._arrivals), host)
+            self._waiting.append(waiter)
+            try:
+                while delay := self._delay(waiter):
+                    self._cond.wait(None if delay == inf else delay)
+            except BaseException:
+                self._waiting.remove(waiter)
+                raise
+            self._admit(waiter, start)
+        try:
+            yield
+        finally:
+            self._release(host)
+
+    @asynccontextmanager
+    async def aslot(self, host: str):
+        """
+        Same as slot, for a coroutine: waits without blocking its event loop, woken up through it
+        whenever a waiting thread would be
+
+        :param host: host the request is sent to, e.g. 'upload.wikimedia.org'
+        """
+        import asyncio  # slow to import, and only batches need it, never the window's startup
+
+        name = current_priority()  # of the thread running the event loop
+        start = monotonic()
+        loop = asyncio.get_running_loop()
+        with span('upstream.wait', priority=name):
+            with self._cond:
+                waiter = (PRIORITIES.index(name), next(self._arrivals), host)
+                self._waiting.append(waiter)
+            try:
+                while True:
+                    with self._cond:
+                        if not (delay := self._delay(waiter)):
+                            self._admit(waiter, start)
+                            break
+                        waker = (loop, loop.create_future())
+                        self._wakers.add(waker)
+                    try:
+                        await asyncio.wait_for(waker[1], None if delay == inf else delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    finally:
+                        with self._cond:
+                            self._wakers.discard(waker)
+            except BaseException:  # e.g. cancelled
+                with self._cond:
+                    self._waiting.remove(waiter)
+                    self._notify()
+                raise
+        try:
+            yield
+        finally:
+            self._release(host)
+
+    def throttle(self, host: str, wait: float = 0) -> None:
+        """
+        Slows down after a 429 Too Many Requests response: halves the rate, and pauses requests to host for wait seconds
+
+        :param host: host that answered 429
+        :param wait: seconds the host asked to wait (its Retry-After), 0 if it didn't say
+        """
+        with self._cond:
+            self.throttled += 1
+            if self.rate:
+                self.rate = max(self.min_rate, self.rate / 2)
+            if wait:
+                self._paused_until[host] = max(self._paused_until.get(host, 0), monotonic() + wait)
+            self._notify()
+
+    def succeeded(self) -> None:
+        """
+        Raises the rate back towards its maximum after a request that wasn't throttled
+        """
+        with self._cond:
+            if self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self) -> dict:
+        """
+        Returns how requests were scheduled so far
+
+        :return: current rate, number of 429 responses, and requests admitted, seconds waited and requests waiting
+                 per priority
+        """
+        with self._cond:
+            waiting = Counter(PRIORITIES[waiter[0]] for waiter in self._waiting)
+            return {'rate': round(self.rate, 2),
+                    'throttled': self.throttled,
+                    'priorities': {name: {'admitted': self.admitted[name],
+                                          'waited_s': round(self.waited[name], 3),
+                                          'waiting': waiting[name]}
+                                   for name in PRIORITIES}}
+
+    def report(self) -> str:
+        """
+        Returns a one-line summary of stats()
+        """
+        stats = self.stats()
+        priorities = ', '.join(f'{name} {value["admitted"]} ({value["waited_s"]:.1f}s waited)'
+                               for name, value in stats['priorities'].items())
+        rate = f'{stats["rate"]:g}/s' if self.max_rate else 'unlimited'
+        return f'Requests to Wikimedia: {priorities}, rate {rate}, {stats["throttled"]} throttled (429)'
+
+    def _admit(self, waiter: tuple, start: float) -> None:
+        """
+        Internally called only, with self._cond held, once waiter may go
+        """
+        self._waiting.remove(waiter)
+        if self.rate:
+            self._tokens -= 1
+        self._in_flight[waiter[2]] += 1
+        self.admitted[PRIORITIES[waiter[0]]] += 1
+        self.waited[PRIORITIES[waiter[0]]] += monotonic() - start
+        self._notify()  # the next request in line may be to another host
+
+    def _release(self, host: str) -> None:
+        """
+        Internally called only, once a request admitted to host got its response
+        """
+        with self._cond:
+            self._in_flight[host] -= 1
+            self._notify()
+
+    def _notify(self) -> None:
+        """
+        Internally called only, with self._cond held: wakes up every request waiting to be admitted, threads and coroutines
+        """
+        self._cond.notify_all()
+        for loop, future in self._wakers:
+            loop.call_soon_threadsafe(_wake, future)
+        self._wakers.clear()
+
+    def _delay(self, waiter: tuple) -> float:
+        """
+        Internally called only, with self._cond held
+
+        Returns how long waiter has to wait at least before being admitted: 0 if it may go now,
+        inf if it has to wait for another request to be admitted or to finish first
+        """
+        now = monotonic()
+        host = waiter[2]
+        if self._in_flight[host] >= self.host_concurrency:
+            return inf
+        if self._paused_until.get(host, 0) > now:
+            return self._paused_until[host] - now
+        if any(other < waiter and self._in_flight[other[2]] < self.host_concurrency
+               and self._paused_until.get(other[2], 0) <= now for other in self._waiting):
+            return inf  # a request ahead in line can go, it goes first
+
+        if not self.rate:
+            return 0
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        return 0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+
+def _wake(future: 'asyncio.Future') -> None:
+    if not future.done():  # it may have timed out meanwhile
+        future.set_result(None)
+
+
+def get_scheduler() -> UpstreamScheduler:
+    """
+    Returns the shared scheduler, made on first use with config.UPSTREAM_RATE, config.UPSTREAM_BURST
+    and config.HOST_CONCURRENCY
+
+    :return: shared scheduler
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = UpstreamScheduler(config.UPSTREAM_RATE, config.UPSTREAM_BURST, config.HOST_CONCURRENCY)
+    return _scheduler
@@ -0,0 +1,154 @@
+"""
+Scrubbing of the on-disk cache: a slow pass over every cached file that repairs what get_cache only ignores
+"""
+import os
+import threading
+from time import perf_counter, sleep, time
+
+from . import config
+from .cache import (cache_locks, delete_flag, delete_original, delete_variant, get_hash, get_manifest, make_room,
+                    original_path, variant_path)
+
+# files older than this are leftovers of a write that never finished, younger ones may still be written
+TMP_MAX_AGE = 3600
+
+
+def scrub(stop: threading.Event | None = None, progress=None) -> (int, int, int, float):
+    """
+    Goes through the whole cache, sleeping config.SCRUB_PAUSE seconds after each file:
+    - hashes every flag again, deleting the ones that don't match their record,
+      and the ones not used for config.MAX_IDLE seconds
+    - deletes records whose file is missing or changed size, and files without a record (including leftover .tmp files)
+    - evicts flags beyond config.DISK_BUDGET, then compacts the cache manifest
+
+    :param stop: if given, the scrub ends early once it is set, e.g. when the program is closing
+    :param progress: called with (number of files checked so far, number of bytes reclaimed so far) after each file
+    :return: number of files checked, number of bytes reclaimed, number of bytes hashed, and elapsed time in seconds
+    """
+    start = perf_counter()
+    manifest = get_manifest()
+    checked = reclaimed = hashed = 0
+
+    def checked_file(freed: int = 0) -> bool:
+        nonlocal checked, reclaimed
+        checked += 1
+        reclaimed += freed
+        if progress:
+            progress(checked, reclaimed)
+        sleep(config.SCRUB_PAUSE)
+        return bool(stop and stop.is_set())
+
+    masters = set()
+    for record in manifest.records():
+        country = record['country']
+        img_path = os.path.join(config.FLAGS_DIR, f'{country}.png')
+        if manifest.get(country) is None:  # corrupt record, dropped by get: its file is deleted below as an orphan
+            continue
+
+        freed = 0
+        with cache_locks(country):  # a flag swapped in meanwhile would fail its old record's hash
+            record = manifest.get(country) or record
+            if config.MAX_IDLE and int(time()) - (record['last_access'] or record['cached']) > config.MAX_IDLE \
+                    or not os.path.exists(img_path):
+                freed = delete_flag(country)
+            else:
+                hashed += os.path.getsize(img_path)
+                if get_hash(img_path) == record['hash']:
+                    stat = os.stat(img_path)
+                    manifest.put(country, size=stat.st_size, mtime=stat.st_mtime_ns, verified=int(time()))
+                    masters.add(country)
+                else:
+                    freed = delete_flag(country)
+        if checked_file(freed):
+            return checked, reclaimed, hashed, perf_counter() - start
+
+    for variant in manifest.variants():
+        country, width = variant['country'], variant['width']
+        with cache_locks(country):
+            variant = manifest.get_variant(country, width) or variant
+            try:
+                intact = country in masters and os.path.getsize(variant_path(country, width)) == variant['size']
+            except FileNotFoundError:
+                intact = False
+            freed = 0 if intact else delete_variant(country, width)
+        if checked_file(freed):
+            return checked, reclaimed, hashed, perf_counter() - start
+
+    for original in manifest.originals():
+        country = original['country']
+        with cache_locks(country):
+            original = manifest.get_original(country) or original
+            try:
+                intact = country in masters and os.path.getsize(original_path(country)) == original['size']
+            except FileNotFoundError:
+                intact = False
+            freed = 0 if intact else delete_original(country)
+        if checked_file(freed):
+            return checked, reclaimed, hashed, perf_counter() - start
+
+    # Files written since the records were read above are kept: they have a record, or are too young to be leftovers
+    for directory, _, files in os.walk(config.FLAGS_DIR):
+        width = os.path.basename(directory)
+        for file in files:
+            path = os.path.join(directory, file)
+            svg = directory == os.path.join(config.FLAGS_DIR, 'svg')
+            country = file.removesuffix('.svg' if svg else '.png')
+            freed = 0
+            try:
+                with cache_locks(country):  # not while the file is being swapped in and recorded
+                    if file.endswith('.tmp'):
+                        orphan = time() - os.path.getmtime(path) > TMP_MAX_AGE
+                    elif directory == config.FLAGS_DIR:
+                        orphan = manifest.get(country) is None
+                    elif svg:
+                        orphan = manifest.get_original(country) is None
+                    else:
+                        orphan = not (width.isdigit() and manifest.get_variant(country, int(width)))
+                    if orphan:
+                        freed = os.path.getsize(path)
+                        os.remove(path)
+            except FileNotFoundError:
+                pass  # renamed or deleted by a fetch meanwhile
+            if checked_file(freed):
+                return checked, reclaimed, hashed, perf_counter() - start
+
+        if directory != config.FLAGS_DIR and not os.listdir(directory):
+            os.rmdir(directory)
+
+    reclaimed += make_room(0)
+    manifest.compact()
+    return checked, reclaimed, hashed, perf_counter() - start
+
+
+def scrub_report(checked: int, reclaimed: int, hashed: int, elapsed: float) -> str:
+    """
+    Returns a one-line summary of a scrub run, with its rate
+
+    :param checked: number of files checked
+    :param reclaimed: number of bytes reclaimed
+    :param hashed: number of bytes hashed
+    :param elapsed: duration of the run in seconds
+    :return: summary to show to user
+    """
+    return (f'Scrubbed {checked} files in {elapsed:.1f}s '
+            f'({checked / elapsed if elapsed else 0:.1f} files/sec, '
+            f'{hashed / 2 ** 20 / elapsed if elapsed else 0:.1f} MiB/sec hashed), '
+            f'reclaimed {reclaimed / 2 ** 20:.1f} MiB')
+
+
+def scrub_due() -> bool:
+    """
+    Returns whether config.SCRUB_INTERVAL seconds passed since the last scrub started, and marks a new one as started if so
+
+    :return: whether a scrub should start
+    """
+    marker = os.path.join(config.FLAGS_LOG_DIR, 'scrubbed')
+    try:
+        if time() - os.path.getmtime(marker) < config.SCRUB_INTERVAL:
+            return False
+    except FileNotFoundError:
+        pass
+    get_manifest()  # creates the cache directories
+    with open(marker, 'w'):
+        pass
+    return True
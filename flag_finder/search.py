@@ -0,0 +1,121 @@
+"""
+Indexes behind the search bar: subsequence search and prefix completion over a list of names
+"""
+import sys
+from bisect import bisect_left
+
+
+class SubsequenceIndex:
+    """
+    Finds, among a list of names, those containing the letters of a query in the same order (non-case sensitive),
+    e.g. "ez" matches Belize "B(e)li(z)e" and New Zealand "N(e)w (Z)ealand".
+    Built once per list: every character maps to the set of names containing it,
+    so a query only checks the names containing all of its characters instead of every name
+
+    :param values: names to search in
+    :type values: list[str] | tuple[str, ...]
+    """
+    def __init__(self, values: list[str] | tuple[str, ...]):
+        self.values = tuple(values)
+        self._members = frozenset(self.values)
+        self._lowered = tuple(value.lower() for value in self.values)
+        containing = {}
+        for i, value in enumerate(self._lowered):
+            for char in set(value):
+                containing.setdefault(char, set()).add(i)
+        self._containing = {char: frozenset(indices) for char, indices in containing.items()}
+
+    def __contains__(self, value: str) -> bool:
+        return value in self._members
+
+    def search(self, query: str) -> list[str]:
+        """
+        Returns the names containing the letters of query in the same order, best matches first:
+        names starting with query, then names whose matched letters are the closest together, then in their original order
+
+        :param query: letters to look for
+        :return: matching names
+        """
+        query = query.lower()
+        if not query:
+            return list(self.values)
+        if not all(char in self._containing for char in query):
+            return []
+        if len(query) == 1:  # every match spans a single letter, only prefix and original order matter
+            return [self.values[i] for i in sorted(self._containing[query], key=lambda i: (self._lowered[i][0] != query, i))]
+
+        # Smallest set first, so each intersection only iterates over the fewest names
+        containing = sorted((self._containing[char] for char in set(query)), key=len)
+        ranked = []
+        for i in containing[0].intersection(*containing[1:]):
+            value = self._lowered[i]
+            end = -1
+            for char in query:
+                end = value.find(char, end + 1)
+                if end < 0:
+                    break
+            else:
+                # Walk back from the last matched letter to the latest possible first one, for the tightest span
+                start = end + 1
+                for char in reversed(query):
+                    start = value.rfind(char, 0, start)
+                ranked.append((not value.startswith(query), end - start, i))
+
+        ranked.sort()
+        return [self.values[i] for *_, i in ranked]
+
+
+class PrefixIndex:
+    """
+    Completes what has been typed so far into the first name starting with it (non-case sensitive), in alphabetical order.
+    Names are kept sorted, so the ones starting with a prefix form a contiguous range found by binary search.
+    The range found for each prefix is saved: typing one more letter only searches within the previous range,
+    and deleting letters goes back to the range saved for the shorter prefix
+
+    :param values: names to complete into
+    :type values: list[str] | tuple[str, ...]
+    """
+    def __init__(self, values: list[str] | tuple[str, ...]):
+        ordered = sorted(range(len(values)), key=lambda i: (values[i].lower(), i))
+        self._keys = [values[i].lower() for i in ordered]
+        self._values = [values[i] for i in ordered]
+        self._states = [('', 0, len(self._keys))]  # (prefix, start, end of its range) of every prefix typed so far
+
+    def rewind(self, prefix: str) -> None:
+        """
+        Drops the ranges saved for prefixes that what is typed no longer starts with, e.g. after a backspace
+
+        :param prefix: what is typed so far
+        """
+        prefix = prefix.lower()
+        while not prefix.startswith(self._states[-1][0]):
+            self._states.pop()
+
+    def complete(self, prefix: str) -> str | None:
+        """
+        Returns the first name starting with prefix, or None if there isn't any
+
+        :param prefix: what is typed so far
+        :return: completed name | None
+        """
+        self.rewind(prefix)
+        prefix = prefix.lower()
+        typed, start, end = self._states[-1]
+        if typed != prefix:
+            start = bisect_left(self._keys, prefix, start, end)
+            end = bisect_left(self._keys, prefix + chr(sys.maxunicode), start, end)
+            self._states.append((prefix, start, end))
+
+        return self._values[start] if start < end else None
+
+    def matches(self, prefix: str, limit: int) -> (int, list[str]):
+        """
+        Returns how many names start with prefix, and the first limit of them
+
+        :param prefix: what is typed so far
+        :param limit: maximum number of names returned
+        :return: number of names starting with prefix, and the first ones in alphabetical order
+        """
+        self.complete(prefix)
+        _, start, end = self._states[-1]
+        return end - start, self._values[start:min(end, start + limit)]
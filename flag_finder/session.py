@@ -0,0 +1,96 @@
+"""
+HTTP session shared by every request to Wikimedia
+"""
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from . import config
+from .scheduler import UpstreamScheduler, get_scheduler, retry_after
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class SchedulerRetry(Retry):
+    """
+    Retry policy of urllib3 leaving 429 Too Many Requests responses to ScheduledAdapter, even with a Retry-After header
+    """
+    RETRY_AFTER_STATUS_CODES = Retry.RETRY_AFTER_STATUS_CODES - {429}
+
+
+class ScheduledAdapter(HTTPAdapter):
+    """
+    Transport adapter sending every request through an UpstreamScheduler.
+    429 Too Many Requests responses are retried here rather than by urllib3, so that the scheduler slows down
+    and every retry waits its turn again
+
+    :param scheduler: scheduler admitting requests
+    :type scheduler: UpstreamScheduler
+    :param retries: times a request answered 429 is retried before giving up
+    :type retries: int
+    :param kwargs: all keyword arguments accepted by HTTPAdapter.__init__()
+    """
+    def __init__(self, scheduler: UpstreamScheduler, retries: int, **kwargs):
+        self.scheduler = scheduler
+        self.retries = retries
+        super().__init__(**kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        host = urlparse(request.url).hostname
+        for attempt in range(self.retries + 1):
+            with self.scheduler.slot(host):
+                response = super().send(request, **kwargs)
+            if response.status_code != 429:
+                self.scheduler.succeeded()
+                return response
+
+            self.scheduler.throttle(host, retry_after(response.headers.get('Retry-After')))
+            if attempt < self.retries:
+                response.close()
+        return response  # the last 429, so raise_for_status() can report it
+
+
+def make_session(retries: int, pool_size: int, scheduler: UpstreamScheduler | None = None) -> requests.Session:
+    """
+    Returns a session meant to be shared by every request to Wikimedia: connections are kept alive and pooled per host,
+    so only the first request to commons.wikimedia.org and upload.wikimedia.org pays for the TLS handshake.
+    Requests wait their turn in the scheduler (see flag_finder.scheduler) before being sent.
+    Timed out requests and 5xx responses are retried with exponential backoff, waiting for Retry-After if sent,
+    429 responses are retried once the scheduler slowed down
+
+    :param retries: times a request is retried before giving up
+    :param pool_size: maximum number of connections kept alive per host, should be the number of threads using it
+    :param scheduler: scheduler admitting requests, the shared one if None
+    :return: shared session
+    """
+    retry = SchedulerRetry(total=retries,
+                           backoff_factor=0.5,  # 0s, 1s, 2s, 4s...
+                           status_forcelist=(500, 502, 503, 504),
+                           allowed_methods=('GET', 'HEAD'),
+                           respect_retry_after_header=True,
+                           raise_on_status=False)  # the last response is returned, so raise_for_status() can report its code
+    adapter = ScheduledAdapter(scheduler or get_scheduler(), retries, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(config.HEADERS)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the shared session, made on first use with config.RETRIES and config.POOL_SIZE
+
+    :return: shared session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session(config.RETRIES, config.POOL_SIZE)
+    return _session
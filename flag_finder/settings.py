@@ -0,0 +1,77 @@
+"""
+Command line options changing config, shared by the window and the command line
+"""
+import argparse
+
+from . import config
+from .trace import serve_metrics
+
+
+def settings_parser() -> argparse.ArgumentParser:
+    """
+    Returns a parser of the options changing config, to be used as a parent parser
+
+    :return: argparse parent parser
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--connect-timeout', type=float, default=config.CONNECT_TIMEOUT,
+                        help=f'seconds to wait for a connection to Wikimedia (default: {config.CONNECT_TIMEOUT})')
+    parser.add_argument('--read-timeout', type=float, default=config.READ_TIMEOUT,
+                        help=f'seconds to wait for Wikimedia to send data once connected (default: {config.READ_TIMEOUT})')
+    parser.add_argument('--retries', type=int, default=config.RETRIES,
+                        help=f'times a timed out or failed (429, 5xx) request to Wikimedia is retried (default: {config.RETRIES})')
+    parser.add_argument('--rate-limit', type=float, default=config.UPSTREAM_RATE,
+                        help='requests per second sent to Wikimedia at most, lowered for a while whenever it answers '
+                             f'429 Too Many Requests, 0 for no limit (default: {config.UPSTREAM_RATE})')
+    parser.add_argument('--host-concurrency', type=int, default=config.HOST_CONCURRENCY,
+                        help=f'requests in flight per Wikimedia host at most (default: {config.HOST_CONCURRENCY})')
+    parser.add_argument('--verify-interval', type=int, default=config.VERIFY_INTERVAL,
+                        help='seconds after which a cached flag is hashed again even if its size and modification time '
+                             f'are unchanged, 0 to hash it on every read (default: {config.VERIFY_INTERVAL})')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of flags fetched in parallel by batch commands (default: 8)')
+    parser.add_argument('--disk-budget-mb', type=int, default=config.DISK_BUDGET // 2 ** 20,
+                        help='disk space the cache may take, flags least worth keeping are evicted beyond it, '
+                             f'0 for no limit (default: {config.DISK_BUDGET // 2 ** 20})')
+    parser.add_argument('--eviction', choices=('lru', 'lfu'), default=config.EVICTION_POLICY,
+                        help='evict the least recently (lru) or least frequently (lfu) used flags first '
+                             f'(default: {config.EVICTION_POLICY})')
+    parser.add_argument('--no-async', action='store_true',
+                        help='fetch batches of flags on threads even if httpx is installed, '
+                             'instead of on an asyncio event loop')
+    parser.add_argument('--svg', action='store_true',
+                        help='download flags as .svg once and render every size locally (needs cairosvg), '
+                             'instead of downloading each size from Wikimedia')
+    parser.add_argument('--pack', metavar='PATH', default=config.PACK_PATH,
+                        help=f'flag pack read before the cache and the network (default: {config.PACK_PATH})')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='get flags from the cache directly even if a cache daemon is running on this host')
+    parser.add_argument('--trace-log', metavar='PATH',
+                        help='append how long each stage of getting every flag took to this file, as lines of JSON')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve how long each stage took so far as JSON at http://127.0.0.1:<port>/metrics')
+    return parser
+
+
+def apply_settings(args: argparse.Namespace) -> None:
+    """
+    Applies the options parsed by settings_parser() to config. Must be called before the first fetch
+
+    :param args: parsed arguments
+    """
+    config.CONNECT_TIMEOUT = args.connect_timeout
+    config.READ_TIMEOUT = args.read_timeout
+    config.RETRIES = args.retries
+    config.UPSTREAM_RATE = args.rate_limit
+    config.HOST_CONCURRENCY = args.host_concurrency
+    config.VERIFY_INTERVAL = args.verify_interval
+    config.ASYNC_BATCHES = not args.no_async
+    config.POOL_SIZE = args.workers + 4  # batch pool and interactive fetches may run at once
+    config.DISK_BUDGET = args.disk_budget_mb * 2 ** 20
+    config.EVICTION_POLICY = args.eviction
+    config.PACK_PATH = args.pack
+    config.SVG_MASTERS = args.svg
+    config.USE_DAEMON = not args.no_daemon
+    config.TRACE_LOG = args.trace_log
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
@@ -0,0 +1,97 @@
+"""
+Fetching ahead the flags a user is likely to pick next, e.g. the few still matching what they typed
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from math import inf
+from time import perf_counter
+
+from . import config
+from .scheduler import set_priority
+
+
+class SpeculativePrefetcher:
+    """
+    Warms the cache with the best few candidates of the latest guess, one flag at a time on a single background thread,
+    so that it never competes much with fetches of flags actually asked for (those join a fetch already in flight).
+    Downloads are paced to config.SPECULATE_BANDWIDTH. A new guess cancels what is left of the previous one
+
+    :param width: width flags are warmed at, the one they will be shown at
+    :type width: int | None
+    """
+    def __init__(self, width: int | None = None):
+        self.width = width
+        self.warmed = 0  # flags fetched ahead
+        self.skipped = 0  # flags left out because a newer guess came first
+        self.downloaded = 0  # bytes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='flag-speculate',
+                                            initializer=set_priority, initargs=('speculative',))
+        self._candidates = ()
+        self._cancelled = threading.Event()
+
+    def speculate(self, candidates: list[str] | tuple[str, ...]) -> None:
+        """
+        Fetches ahead the first config.SPECULATE_TOP_N candidates, unless they are the ones already being fetched ahead
+
+        :param candidates: names of countries, most likely first
+        """
+        candidates = tuple(candidates[:config.SPECULATE_TOP_N])
+        if candidates == self._candidates:
+            return
+        self.cancel()
+        self._candidates = candidates
+        if candidates:
+            self._executor.submit(self._warm, candidates, self._cancelled)
+
+    def cancel(self) -> None:
+        """
+        Stops fetching ahead the latest candidates, the flag being downloaded (if any) is still cached
+        """
+        self._cancelled.set()
+        self._cancelled = threading.Event()
+        self._candidates = ()
+
+    def shutdown(self) -> None:
+        """
+        Cancels the latest candidates and drops the guesses not started yet
+        """
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> str:
+        """
+        Returns a one-line summary of what was fetched ahead
+        """
+        return (f'Fetched ahead: {self.warmed} flags, {self.downloaded / 2 ** 20:.1f} MB, '
+                f'{self.skipped} skipped for a newer guess')
+
+    def _warm(self, candidates: tuple[str, ...], cancelled: threading.Event) -> None:
+        from .cache import get_cache  # requests and Pillow are imported here, on the background thread
+        from .daemon import DaemonError, fetch_from_daemon
+        from .fetch import FetchError, get_flag
+        from .pack import get_pack
+
+        pack = get_pack()
+        for i, country in enumerate(candidates):
+            if cancelled.is_set():
+                self.skipped += len(candidates) - i
+                return
+            if pack and country in pack:
+                continue  # shown from the pack, never from the cache
+            was_cached = get_cache(country, max_age=inf)
+            start = perf_counter()
+            try:
+                # fetched by the daemon if it runs, once for every instance, an already cached flag is only downscaled
+                if fetch_from_daemon(country, self.width, use=False) is None:
+                    get_flag(country, self.width, use=False)
+            except (FetchError, DaemonError):
+                continue
+            if was_cached:
+                continue  # nothing was downloaded
+
+            self.warmed += 1
+            size = os.path.getsize(os.path.join(config.FLAGS_DIR, f'{country}.png'))
+            self.downloaded += size
+            # Pace downloads: the next one starts once this one would have finished at config.SPECULATE_BANDWIDTH
+            cancelled.wait(size / config.SPECULATE_BANDWIDTH - (perf_counter() - start))
@@ -0,0 +1,193 @@
+"""
+Tracing of the stages of getting a flag: how long each stage took, for a given flag and over the whole run.
+A Trace collects the spans run by the threads it is active on. Every span also adds up into metrics(),
+served as JSON by serve_metrics(). Every finished trace is appended to config.TRACE_LOG as a line of JSON, if set
+"""
+import json
+import threading
+from contextlib import contextmanager
+from time import perf_counter, time
+
+from . import config
+
+
+_local = threading.local()  # .trace: trace active on this thread
+_metrics = {}  # span name -> [count, total seconds, max seconds]
+_metrics_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+class Trace:
+    """
+    Spans of one operation (e.g. showing a flag), possibly run on several threads one after the other
+
+    :param name: name of the operation
+    :type name: str
+    :param attributes: what the operation was about, e.g. the country's name, or how it went, e.g. a cache hit
+    """
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.spans = []  # (name, seconds since the trace started, duration in seconds, attributes)
+        self.started = time()
+        self.start = perf_counter()
+        self.duration = None
+
+    def add(self, name: str, start: float, duration: float, **attributes) -> None:
+        """
+        Adds a span that ran within the trace
+
+        :param name: name of the stage
+        :param start: when the span started, as per perf_counter()
+        :param duration: duration in seconds
+        :param attributes: details of the stage
+        """
+        self.spans.append((name, start - self.start, duration, attributes))
+
+    def breakdown(self) -> dict[str, float]:
+        """
+        Returns the time spent in each stage, a stage run several times adds up
+
+        :return: name of stage -> milliseconds, in the order the stages first ran
+        """
+        stages = {}
+        for name, _, duration, _ in self.spans:
+            stages[name] = stages.get(name, 0) + duration * 1000
+        return stages
+
+    def finish(self) -> None:
+        """
+        Ends the trace, adding its duration to the metrics and appending it to config.TRACE_LOG if set
+        """
+        self.duration = perf_counter() - self.start
+        _measured(self.name, self.duration)
+        if config.TRACE_LOG:
+            with _log_lock, open(config.TRACE_LOG, 'a') as log:
+                log.write(json.dumps(self.to_dict()) + '\n')
+
+    def to_dict(self) -> dict:
+        """
+        Returns the trace as JSON-serializable dict
+
+        :return: name, start (epoch), duration and attributes of the trace, and its spans
+        """
+        return {'trace': self.name,
+                'started': round(self.started, 3),
+                'ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+                **self.attributes,
+                'spans': [{'name': name, 'at_ms': round(at * 1000, 3), 'ms': round(duration * 1000, 3), **attributes}
+                          for name, at, duration, attributes in self.spans]}
+
+
+def _measured(name: str, duration: float) -> None:
+    with _metrics_lock:
+        metric = _metrics.setdefault(name, [0, 0, 0])
+        metric[0] += 1
+        metric[1] += duration
+        metric[2] = max(metric[2], duration)
+
+
+@contextmanager
+def tracing(current: Trace):
+    """
+    Makes spans run by this thread within the block part of a trace, e.g. on the worker thread running a fetch
+
+    :param current: trace to add spans to
+    """
+    outer = getattr(_local, 'trace', None)
+    _local.trace = current
+    try:
+        yield current
+    finally:
+        _local.trace = outer
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    Traces the block as a new operation, finished when the block ends
+
+    :param name: name of the operation
+    :param attributes: details of the operation
+    :return: the trace, once the block ended
+    """
+    current = Trace(name, **attributes)
+    try:
+        with tracing(current):
+            yield current
+    finally:
+        current.finish()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the block as a stage of the active trace, if any, and adds it to the metrics
+
+    :param name: name of the stage, e.g. 'fetch.api'
+    :param attributes: details of the stage
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        duration = perf_counter() - start
+        _measured(name, duration)
+        current = getattr(_local, 'trace', None)
+        if current is not None:
+            current.add(name, start, duration, **attributes)
+
+
+def annotate(**attributes) -> None:
+    """
+    Records how the active trace is going, e.g. annotate(cache='hit'). Does nothing if no trace is active
+
+    :param attributes: details of the operation
+    """
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def metrics() -> dict[str, dict[str, float]]:
+    """
+    Returns how many times each stage and operation ran since the program started, and how long they took
+
+    :return: name -> count, total, mean and max duration in milliseconds
+    """
+    with _metrics_lock:
+        return {name: {'count': count,
+                       'total_ms': round(total * 1000, 3),
+                       'mean_ms': round(total * 1000 / count, 3),
+                       'max_ms': round(longest * 1000, 3)}
+                for name, (count, total, longest) in _metrics.items()}
+
+
+def serve_metrics(port: int) -> 'ThreadingHTTPServer':
+    """
+    Serves metrics() as JSON at http://127.0.0.1:<port>/metrics, on a background thread
+
+    :param port: port to listen on, 0 for any free port
+    :return: the server, whose server_address holds the port actually listened on
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # slow to import, and rarely needed
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *_) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = json.dumps(metrics(), indent=2).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='flag-metrics', daemon=True).start()
+    return server